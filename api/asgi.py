@@ -0,0 +1,428 @@
+"""ASGI serving mode: the same routes as index.py on Starlette, for one process with many open downloads.
+
+    pip install -r requirements-asgi.txt
+    python -m uvicorn asgi:app --app-dir api --host 0.0.0.0 --port 8000
+
+Run it from the repository root, so the pdfbirch package is importable.
+
+index.py stays the WSGI entry point that Vercel deploys. This module reuses its
+generators, caches, stores and settings and changes only how requests wait:
+token verification that misses the cache runs on a worker thread (concurrent
+requests with the same token share one verification), store and database
+calls go to Starlette's thread pool, and document builds run on a bounded
+executor and stream back as they are produced, so no request holds the event
+loop while it waits.
+"""
+import asyncio
+import os
+import random
+import string
+import time
+from concurrent.futures import ThreadPoolExecutor
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.middleware import Middleware
+from starlette.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
+from starlette.routing import Route
+from werkzeug.http import parse_accept_header, parse_etags
+import index
+from pdfbirch import auth, procpool, render, usage
+from pdfbirch.metrics import log_event, observe, span
+from pdfbirch.spec import GenerationBudgetError
+# --- BUILD EXECUTOR ---
+# Builds are CPU-bound (or wait on PDF_WORKERS processes), so a few threads
+# are enough; ASGI_MAX_BUILDS caps builds running or queued, past which new
+# downloads get a 503 instead of piling up. A request reserves its slot with
+# _reserve_build() before it is admitted or charged, and a streamed build
+# keeps it until the response has finished.
+#
+# A stream's first chunk (the PDF header) goes out as soon as it exists;
+# after that, chunks are gathered up to ASGI_STREAM_CHUNK bytes per executor
+# hop, which keeps loop round trips down without holding the client back.
+ASGI_BUILD_WORKERS = int(os.getenv('ASGI_BUILD_WORKERS', '4'))
+ASGI_MAX_BUILDS = int(os.getenv('ASGI_MAX_BUILDS', '64'))
+ASGI_STREAM_CHUNK = int(os.getenv('ASGI_STREAM_CHUNK', str(16 * 1024)))  # bytes gathered per executor hop
+_build_executor = ThreadPoolExecutor(max_workers=ASGI_BUILD_WORKERS, thread_name_prefix='asgi-build')
+_builds = 0  # only touched on the event loop thread
+_verifying = {}  # token cache key -> in-flight verification task
+def _reserve_build():
+    """Take a build slot; False when ASGI_MAX_BUILDS are already taken"""
+    global _builds
+    if _builds >= ASGI_MAX_BUILDS:
+        return False
+    _builds += 1
+    return True
+def _release_build():
+    global _builds
+    _builds -= 1
+async def run_build(fn, *args):
+    """Run a blocking build on the build executor"""
+    return await asyncio.get_running_loop().run_in_executor(_build_executor, fn, *args)
+class BuildStreamingResponse(StreamingResponse):
+    """StreamingResponse that owns a reserved build slot and releases it once sent, failed or cancelled"""
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            _release_build()
+async def stream_build(chunks):
+    """Advance a blocking chunk iterator on the build executor: the first chunk alone, then ASGI_STREAM_CHUNK-byte batches"""
+    loop = asyncio.get_running_loop()
+    it = iter(chunks)
+    def pull(limit):
+        parts = []
+        size = 0
+        for chunk in it:
+            parts.append(chunk)
+            size += len(chunk)
+            if size >= limit:
+                break
+        return b"".join(parts)
+    try:
+        limit = 1
+        while True:
+            data = await loop.run_in_executor(_build_executor, pull, limit)
+            if not data:
+                break
+            yield data
+            limit = ASGI_STREAM_CHUNK
+    finally:
+        try:
+            it.close()
+        except (AttributeError, ValueError):  # not a generator, or a cancelled pull still running
+            pass
+def _busy():
+    return PlainTextResponse("Server busy, try again shortly", 503, headers={'Retry-After': '1'})
+# --- AUTH ---
+async def verify_token(token):
+    """verify_firebase_token without blocking the loop; cache hits stay inline"""
+    with span('token_verify'):
+        key = auth._token_cache_key(token)
+        email = auth._token_cache_get(key)
+        if email:
+            return email
+        task = _verifying.get(key)
+        if task is None:
+            task = asyncio.ensure_future(run_in_threadpool(auth.verify_token_uncached, key, token))
+            _verifying[key] = task
+            task.add_done_callback(lambda _: _verifying.pop(key, None))
+        # shield: one caller disconnecting must not cancel the others' verification
+        return await asyncio.shield(task)
+async def authenticate(request, endpoint):
+    """Return (email, None), or (None, 401 response) like the Flask routes"""
+    token = request.headers.get('Authorization')
+    if not token:
+        log_event('auth_rejected', 'warning', endpoint=endpoint, reason='no token')
+        return None, PlainTextResponse("Unauthorized - No token", 401)
+    email = await verify_token(token.replace('Bearer ', ''))
+    if not email:
+        log_event('auth_rejected', 'warning', endpoint=endpoint, reason='invalid token')
+        return None, PlainTextResponse("Unauthorized - Invalid token", 401)
+    return email, None
+async def admit(email, count=1):
+    """index.admit off the loop, as the usage store and shared rate limiter may query a database; 429 or None"""
+    refused = await run_in_threadpool(index.admit, email, count)
+    if refused is None:
+        return None
+    return PlainTextResponse(refused[0], 429, headers={'Retry-After': str(refused[1])})
+async def settle(email, count=1, delivered=True):
+    """index.settle_usage; handing a reservation back writes to the usage store, so that runs off the loop"""
+    if delivered:
+        index.settle_usage(email, count)
+    else:
+        await run_in_threadpool(index.settle_usage, email, count, False)
+async def json_body(request):
+    """index.request_body for the request's JSON: {} when absent or malformed, None when not an object"""
+    try:
+        return index.request_body(await request.json())
+    except ValueError:
+        return {}
+def _attachment(name):
+    return {'Content-Disposition': f'attachment; filename="{name}"'}
+# --- STATIC ---
+def serve_static(request, asset):
+    """index.serve_static for Starlette requests: negotiated encoding, ETag and 304"""
+    etags = asset['etags']
+    accept = parse_accept_header(request.headers.get('accept-encoding'))
+    enc, best_q = 'identity', 0.0
+    for candidate in ('br', 'gzip'):
+        q = accept.quality(candidate) if candidate in etags else 0
+        if q > best_q:
+            enc, best_q = candidate, q
+    headers = {'ETag': f'"{etags[enc]}"', 'Cache-Control': index.STATIC_CACHE_CONTROL, 'Vary': 'Accept-Encoding'}
+    if_none_match = parse_etags(request.headers.get('if-none-match'))
+    if any(if_none_match.contains(tag) for tag in etags.values()):
+        return Response(status_code=304, headers=headers)
+    if enc != 'identity':
+        headers['Content-Encoding'] = enc
+    return Response(index.static_body(asset, enc), media_type=asset['content_type'], headers=headers)
+async def home(request):
+    return serve_static(request, index._STATIC_HOME)
+async def robots(request):
+    return serve_static(request, index._STATIC_ROBOTS)
+async def sitemap(request):
+    return serve_static(request, index._STATIC_SITEMAP)
+# --- ROUTES ---
+async def check_limit(request):
+    """Allow if authenticated and under the daily download limit"""
+    try:
+        token = request.headers.get('Authorization')
+        if not token:
+            log_event('auth_rejected', 'warning', endpoint='check_limit', reason='no token')
+            return JSONResponse({"allowed": False, "error": "No token"}, 401)
+        email = await verify_token(token.replace('Bearer ', ''))
+        if not email:
+            log_event('auth_rejected', 'warning', endpoint='check_limit', reason='invalid token')
+            return JSONResponse({"allowed": False, "error": "Invalid token"}, 401)
+        if usage.USAGE_DAILY_LIMIT <= 0 or not usage.USAGE_STORE:
+            return JSONResponse({"allowed": True})
+        used = await run_in_threadpool(index.get_usage, email)
+        limit = usage.USAGE_DAILY_LIMIT
+        return JSONResponse({"allowed": used < limit, "used": used, "limit": limit,
+                             "remaining": max(0, limit - used)})
+    except Exception as e:
+        log_event('endpoint_error', 'error', exc_info=True, endpoint='check_limit', error=str(e))
+        return JSONResponse({"allowed": False, "error": str(e)}, 500)
+def metrics_refusal(request):
+    """index.metrics_refusal as a response, or None when the request carries METRICS_TOKEN"""
+    refused = index.metrics_refusal(request.headers.get('authorization'))
+    if refused is None:
+        return None
+    message, status, headers = refused
+    return PlainTextResponse(message, status, headers=headers)
+async def token_cache_stats_route(request):
+    return metrics_refusal(request) or JSONResponse(index.token_cache_stats())
+async def pool_stats_route(request):
+    return metrics_refusal(request) or JSONResponse(index.pdf_pool_stats())
+async def cache_stats_route(request):
+    return metrics_refusal(request) or JSONResponse(index.pdf_cache_stats())
+async def metrics(request):
+    refused = metrics_refusal(request)
+    if refused is not None:
+        return refused
+    body = index.render_metrics()
+    body += f"# TYPE pdfbirch_asgi_builds gauge\npdfbirch_asgi_builds {_builds}\n"
+    return Response(body, media_type='text/plain; version=0.0.4; charset=utf-8')
+async def download(request):
+    """Generate and download PDF if authenticated and within the rate limit and daily quota"""
+    try:
+        email, error = await authenticate(request, 'download')
+        if error is not None:
+            return error
+        body = await json_body(request)
+        if body is None:
+            return PlainTextResponse("Request body must be a JSON object", 400)
+        try:
+            seed = index.request_seed(body, request.query_params)
+            spec = index.request_doc_spec(body, 1, request.query_params)
+        except GenerationBudgetError as e:
+            return PlainTextResponse(str(e), 413)
+        except ValueError as e:
+            return PlainTextResponse(str(e), 400)
+        corpus = index.get_corpus() if seed is None else None
+        from_corpus = corpus is not None and spec == corpus.spec
+        # Everything but a corpus read may build, so a busy server refuses before charging anything
+        reserved = not from_corpus
+        if reserved and not _reserve_build():
+            return _busy()
+        admitted = False
+        try:
+            refused = await admit(email)
+            if refused is not None:
+                return refused
+            # Usage is settled once the document exists; until then a failure hands the reservation back
+            admitted = True
+            if seed is not None:
+                name = index.random_pdf_name(random.Random(seed))
+                doc = await run_build(index.get_seeded_pdf, seed, spec)
+                await settle(email)
+                log_event('download', email=email, source='seeded', name=name, bytes=len(doc))
+                return Response(doc, media_type='application/pdf', headers=_attachment(name))
+            name = index.random_pdf_name()
+            if from_corpus:
+                response = Response(index.random_corpus_document(corpus), media_type='application/pdf',
+                                    headers=_attachment(name))
+                await settle(email)
+                log_event('download', email=email, source='corpus', name=name)
+                return response
+            use_pool = render.PDF_ENGINE != 'fpdf' and spec == index.DEFAULT_DOC_SPEC
+            doc = index.take_pooled_pdf() if use_pool else None
+            if doc is not None:
+                await settle(email)
+                log_event('download', email=email, source='pool', name=name, bytes=len(doc))
+                return Response(doc, media_type='application/pdf', headers=_attachment(name))
+            if render.PDF_ENGINE != 'fpdf' and procpool.PDF_WORKERS <= 0:
+                log_event('download', email=email, source='stream', name=name)
+                chunks = index.settled_chunks(index._stream_pdf(index.iter_pdf(*spec)), email)
+                response = BuildStreamingResponse(stream_build(chunks), media_type='application/pdf',
+                                                  headers=_attachment(name))
+                reserved = False  # the response releases the slot once sent
+                return response
+            doc = await run_build(index.build_pdf_bytes, None, spec)
+            await settle(email)
+            log_event('download', email=email, source='inline', name=name, bytes=len(doc))
+            return Response(doc, media_type='application/pdf', headers=_attachment(name))
+        except Exception:
+            if admitted:
+                await settle(email, delivered=False)
+            raise
+        finally:
+            if reserved:
+                _release_build()
+    except Exception as e:
+        log_event('endpoint_error', 'error', exc_info=True, endpoint='download', error=str(e))
+        return PlainTextResponse(str(e), 500)
+async def download_batch(request):
+    """Generate `count` PDFs with a single auth check and stream them as one ZIP"""
+    try:
+        email, error = await authenticate(request, 'download_batch')
+        if error is not None:
+            return error
+        body = await json_body(request)
+        if body is None:
+            return PlainTextResponse("Request body must be a JSON object", 400)
+        try:
+            count = int(body.get('count', 5))
+        except (TypeError, ValueError):
+            return PlainTextResponse("Invalid count", 400)
+        max_files = index.batch_max_files()
+        if not 1 <= count <= max_files:
+            return PlainTextResponse(f"count must be between 1 and {max_files}", 400)
+        try:
+            seed = index.request_seed(body, request.query_params)
+            spec = index.request_doc_spec(body, count, request.query_params)
+        except GenerationBudgetError as e:
+            return PlainTextResponse(str(e), 413)
+        except ValueError as e:
+            return PlainTextResponse(str(e), 400)
+        if not _reserve_build():
+            return _busy()
+        reserved = True
+        try:
+            refused = await admit(email, count)
+            if refused is not None:
+                return refused
+            log_event('download_batch', email=email, count=count)
+            name = f"Pdfbirch_Batch_{''.join(random.choices(string.ascii_uppercase + string.digits, k=4))}.zip"
+            # The documents themselves build on index's batch executor; this
+            # stream's slot covers the thread that waits on them and zips
+            chunks = index.settled_chunks(index._stream_zip(count, seed, spec), email, count)
+            response = BuildStreamingResponse(stream_build(chunks), media_type='application/zip',
+                                              headers=_attachment(name))
+            reserved = False
+            return response
+        finally:
+            if reserved:
+                _release_build()
+    except Exception as e:
+        log_event('endpoint_error', 'error', exc_info=True, endpoint='download_batch', error=str(e))
+        return PlainTextResponse(str(e), 500)
+async def submit_job(request):
+    """Queue a document build and return its job ID without waiting for it"""
+    try:
+        email, error = await authenticate(request, 'submit_job')
+        if error is not None:
+            return error
+        body = await json_body(request)
+        if body is None:
+            return PlainTextResponse("Request body must be a JSON object", 400)
+        try:
+            seed = index.request_seed(body, request.query_params)
+            spec = index.request_doc_spec(body, 1, request.query_params)
+        except GenerationBudgetError as e:
+            return PlainTextResponse(str(e), 413)
+        except ValueError as e:
+            return PlainTextResponse(str(e), 400)
+        refused = await admit(email)
+        if refused is not None:
+            return refused
+        try:
+            job = await run_in_threadpool(index.queue_job, email, seed, spec)
+        except Exception:
+            await settle(email, delivered=False)
+            raise
+        if job is None:
+            await settle(email, delivered=False)
+            return PlainTextResponse("Too many pending jobs, try again shortly", 503)
+        log_event('job_submitted', email=email, job_id=job['id'], pages=spec.pages, target_bytes=spec.target_bytes)
+        return JSONResponse(index.job_view(job), 202, headers={'Location': f"/api/jobs/{job['id']}"})
+    except Exception as e:
+        log_event('endpoint_error', 'error', exc_info=True, endpoint='submit_job', error=str(e))
+        return PlainTextResponse(str(e), 500)
+async def job_status(request):
+    """Status and progress (pages done) of a submitted job"""
+    try:
+        email, error = await authenticate(request, 'job_status')
+        if error is not None:
+            return error
+        job = await run_in_threadpool(index.get_job, request.path_params['job_id'], email)
+        if job is None:
+            return PlainTextResponse("Job not found or expired", 404)
+        return JSONResponse(index.job_view(job))
+    except Exception as e:
+        log_event('endpoint_error', 'error', exc_info=True, endpoint='job_status', error=str(e))
+        return PlainTextResponse(str(e), 500)
+async def job_result(request):
+    """Download a finished job's document"""
+    try:
+        email, error = await authenticate(request, 'job_result')
+        if error is not None:
+            return error
+        job_id = request.path_params['job_id']
+        job = await run_in_threadpool(index.get_job, job_id, email)
+        if job is None:
+            return PlainTextResponse("Job not found or expired", 404)
+        if job['status'] == 'failed':
+            return PlainTextResponse(f"Job failed: {job['error']}", 500)
+        if job['status'] != 'done':
+            return JSONResponse(index.job_view(job), 409)
+        doc = await run_in_threadpool(index.get_job_store().result, job_id)
+        if doc is None:
+            return PlainTextResponse("Job not found or expired", 404)
+        log_event('download', email=email, source='job', name=job['name'], bytes=len(doc))
+        return Response(doc, media_type='application/pdf', headers=_attachment(job['name']))
+    except Exception as e:
+        log_event('endpoint_error', 'error', exc_info=True, endpoint='job_result', error=str(e))
+        return PlainTextResponse(str(e), 500)
+# --- APP ---
+class RequestMetrics:
+    """ASGI middleware recording the same request histograms and log line as index's Flask hooks"""
+    def __init__(self, app):
+        self.app = app
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+        start = time.perf_counter()
+        state = {}
+        async def timed_send(message):
+            if message['type'] == 'http.response.start':
+                state['handled'] = time.perf_counter()
+                state['status'] = message['status']
+                # The router has stored the matched endpoint in the scope by now
+                state['endpoint'] = getattr(scope.get('endpoint'), '__name__', 'unknown')
+                observe('pdfbirch_request_seconds', state['handled'] - start,
+                        endpoint=state['endpoint'], status=str(state['status']))
+            await send(message)
+            if message['type'] == 'http.response.body' and not message.get('more_body') and 'handled' in state:
+                done = time.perf_counter()
+                handled = state.pop('handled')
+                observe('pdfbirch_stage_seconds', done - handled, stage='send')
+                log_event('request', endpoint=state['endpoint'], status=state['status'],
+                          handler_ms=round((handled - start) * 1000, 2), send_ms=round((done - handled) * 1000, 2))
+        await self.app(scope, receive, timed_send)
+routes = [
+    Route('/', home),
+    Route('/robots.txt', robots),
+    Route('/sitemap.xml', sitemap),
+    Route('/api/check_limit', check_limit),
+    Route('/api/token_cache_stats', token_cache_stats_route),
+    Route('/api/pool_stats', pool_stats_route),
+    Route('/api/cache_stats', cache_stats_route),
+    Route('/metrics', metrics),
+    Route('/api/download', download, methods=['POST']),
+    Route('/api/download_batch', download_batch, methods=['POST']),
+    Route('/api/jobs', submit_job, methods=['POST']),
+    Route('/api/jobs/{job_id}', job_status),
+    Route('/api/jobs/{job_id}/result', job_result),
+]
+app = Starlette(routes=routes, middleware=[Middleware(RequestMetrics)])
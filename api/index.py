@@ -1,33 +1,60 @@
-from flask import Flask, send_file, make_response, request, jsonify
-from fpdf import FPDF
+from flask import Flask, Response, send_file, make_response, request, jsonify, g
 import random, string, io
 import os
-import json
-import firebase_admin
-from firebase_admin import credentials, auth as firebase_auth
-import traceback
+import time
+import hashlib
+import secrets
+import zipfile
+import gzip
+from concurrent.futures import ThreadPoolExecutor, as_completed
+try:
+    import brotli
+except ImportError:  # gzip-only static responses
+    brotli = None
+# Generation, caches, quotas and auth live in the pdfbirch package at the
+# repository root; this module is the Flask app and its routes
+from pdfbirch import procpool, ratelimit, render, usage
+from pdfbirch.auth import token_cache_stats, verify_firebase_token
+from pdfbirch.cache import get_seeded_pdf, pdf_cache_stats
+from pdfbirch.corpus import corpus_stats, get_corpus, open_random_document, random_corpus_document
+from pdfbirch.fragments import fragment_stats
+from pdfbirch.jobs import get_job, get_job_store, job_view, jobs_pending, queue_job
+from pdfbirch.layout import DEFAULT_DOC_SPEC, random_pdf_name, ttf_stats
+from pdfbirch.metrics import METRIC_BUCKETS, log_event, metrics_snapshot, observe
+from pdfbirch.pool import pdf_pool_stats, start_pdf_pool, take_pooled_pdf
+from pdfbirch.procpool import build_pdf_bytes
+from pdfbirch.ratelimit import admit, rate_limit_stats
+from pdfbirch.render import gen_pdf_content_fpdf, iter_pdf
+from pdfbirch.spec import GenerationBudgetError, request_body, request_doc_spec, request_seed
+from pdfbirch.usage import get_usage, settle_usage, settled_chunks, usage_stats
 app = Flask(__name__)
-# Initialize Firebase Admin
-service_account_json = os.getenv('FIREBASE_SERVICE_ACCOUNT')
-if service_account_json:
-    try:
-        cred_dict = json.loads(service_account_json)
-        cred = credentials.Certificate(cred_dict)
-        if not firebase_admin._apps: # Check if already initialized
-            firebase_admin.initialize_app(cred)
-        print("Firebase initialized successfully")
-    except Exception as e:
-        print(f"Firebase initialization error: {e}")
-else:
-    print("WARNING: FIREBASE_SERVICE_ACCOUNT not set")
-def verify_firebase_token(token):
-    """Verify Firebase ID token and return email if valid"""
-    try:
-        decoded_token = firebase_auth.verify_id_token(token)
-        return decoded_token.get('email')
-    except Exception as e:
-        print(f"Token verification error: {e}")
-        return None
+# --- METRICS ---
+# Request timings go into the same histograms as the generation stages (see
+# pdfbirch/metrics.py). /metrics and the /api/*_stats endpoints expose
+# internal counters, so they answer 404 unless METRICS_TOKEN is set, and then
+# only to requests sending it as `Authorization: Bearer <METRICS_TOKEN>`.
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')
+@app.before_request
+def _start_request_timer():
+    g.request_start = time.perf_counter()
+@app.after_request
+def _record_request(response):
+    start = g.get('request_start')
+    if start is None:
+        return response
+    handled = time.perf_counter()
+    endpoint = request.endpoint or 'unknown'
+    status = response.status_code
+    observe('pdfbirch_request_seconds', handled - start, endpoint=endpoint, status=str(status))
+    def sent():
+        # Runs once the server has written the whole body, so for streamed
+        # responses `send` includes generating it
+        done = time.perf_counter()
+        observe('pdfbirch_stage_seconds', done - handled, stage='send')
+        log_event('request', endpoint=endpoint, status=status,
+                  handler_ms=round((handled - start) * 1000, 2), send_ms=round((done - handled) * 1000, 2))
+    response.call_on_close(sent)
+    return response
 # ... (keep all your existing imports, Firebase init, verify_firebase_token, etc.) ...
 
 HTML_PAGE = """
@@ -365,6 +392,59 @@ HTML_PAGE = """
                 element.innerHTML = originalText;
             }
         }
+        async function downloadZip(element, token, count) {
+            if (element.classList.contains('downloading')) {
+                return;
+            }
+            element.classList.add('downloading');
+            const originalText = element.innerHTML;
+            element.innerHTML = '<span>All ' + count + ' files (.zip)</span><span>⏳</span>';
+            try {
+                const res = await fetch('/api/download_batch', {
+                    method: 'POST',
+                    headers: {
+                        'Authorization': 'Bearer ' + token,
+                        'Content-Type': 'application/json'
+                    },
+                    body: JSON.stringify({ count: count })
+                });
+                if (res.status === 401) {
+                    alert('Authentication failed. Please sign in again.');
+                    location.reload();
+                    return;
+                }
+                if (!res.ok) {
+                    const errorText = await res.text();
+                    console.error('Batch download failed:', errorText);
+                    alert('Download failed: ' + errorText);
+                    element.classList.remove('downloading');
+                    element.innerHTML = originalText;
+                    return;
+                }
+                const blob = await res.blob();
+                const url = window.URL.createObjectURL(blob);
+                const a = document.createElement('a');
+                a.href = url;
+                a.download = 'Pdfbirch_Batch.zip';
+                document.body.appendChild(a);
+                a.click();
+                a.remove();
+                window.URL.revokeObjectURL(url);
+                element.classList.remove('downloading');
+                element.innerHTML = originalText;
+                let downloadCount = parseInt(localStorage.getItem('pdfbirch_download_count') || '0', 10);
+                downloadCount += count;
+                localStorage.setItem('pdfbirch_download_count', downloadCount);
+                if (downloadCount >= 50) {
+                    openSupportModal();
+                }
+            } catch(e) {
+                console.error('Batch download exception:', e);
+                alert('Download error: ' + e.message);
+                element.classList.remove('downloading');
+                element.innerHTML = originalText;
+            }
+        }
         function showResults(token) {
             const files = [
                 'Research_Analysis_K7M2.pdf',
@@ -377,6 +457,7 @@ HTML_PAGE = """
             resultsDiv.innerHTML = files.map(f =>
                 `<div class="file-link" onclick="downloadPDF(this, '${token}', '${f}')"><span>${f}</span><span>↓</span></div>`
             ).join('') +
+            `<div class="file-link" onclick="downloadZip(this, '${token}', ${files.length})"><span>All ${files.length} files (.zip)</span><span>↓</span></div>` +
             '<button class="btn" onclick="location.reload()" style="background:none; color:var(--primary); box-shadow:none; border:1px solid #e2e8f0; margin-top:20px;">Refresh Batch</button>';
             resultsDiv.style.display = 'block';
         }
@@ -717,23 +798,21 @@ HTML_PAGE = """
 # </html>
 # """
 # --- THE BACKEND ---
-PREFIXES = ["Research", "Analysis", "Draft", "Final", "Project", "Report", "Case_Study", "Thesis"]
-WORDS = ["strategy", "growth", "market", "value", "user", "product", "system", "data", "cloud", "AI", "project", "scale"]
-@app.route('/')
-def home():
-    return HTML_PAGE
-@app.route('/robots.txt')
-def robots():
-    return """User-agent: *
+BATCH_MAX_FILES = int(os.getenv('BATCH_MAX_FILES', '10'))
+BATCH_WORKERS = int(os.getenv('BATCH_WORKERS', '4'))
+def batch_max_files():
+    """Largest count a batch may ask for: BATCH_MAX_FILES, capped at one full rate-limit bucket"""
+    if ratelimit.RATE_LIMIT_RATE > 0:
+        return min(BATCH_MAX_FILES, int(ratelimit.RATE_LIMIT_BURST))
+    return BATCH_MAX_FILES
+ROBOTS_TXT = """User-agent: *
 Allow: /
 Sitemap: https://pdfbirch.app/sitemap.xml
 User-agent: GPTBot
 Disallow: /
 User-agent: CCBot
-Disallow: /""", 200, {'Content-Type': 'text/plain'}
-@app.route('/sitemap.xml')
-def sitemap():
-    return """<?xml version="1.0" encoding="UTF-8"?>
+Disallow: /"""
+SITEMAP_XML = """<?xml version="1.0" encoding="UTF-8"?>
 <urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">
   <url>
     <loc>https://pdfbirch.app</loc>
@@ -741,87 +820,450 @@ def sitemap():
     <changefreq>weekly</changefreq>
     <priority>1.0</priority>
   </url>
-</urlset>""", 200, {'Content-Type': 'application/xml'}
+</urlset>"""
+# Static responses carry a strong ETag per encoding (identity, gzip and, when
+# the brotli package is installed, br), so repeat visitors and edge caches get
+# a 304 instead of the body. Each compressed body is built on the first request
+# that asks for it rather than at import, which keeps max-level compression off
+# the cold start path.
+STATIC_CACHE_CONTROL = os.getenv('STATIC_CACHE_CONTROL', 'public, max-age=300, stale-while-revalidate=86400')
+def _static_asset(body, content_type):
+    raw = body.encode('utf-8')
+    digest = hashlib.sha256(raw).hexdigest()[:32]
+    encodings = ('identity', 'gzip') + (('br',) if brotli is not None else ())
+    return {
+        'content_type': content_type,
+        'etags': {enc: f"{digest}-{enc}" for enc in encodings},
+        'bodies': {'identity': raw},
+    }
+def static_body(asset, enc):
+    """The asset's bytes in `enc`, compressed once on first use"""
+    data = asset['bodies'].get(enc)
+    if data is None:
+        raw = asset['bodies']['identity']
+        data = gzip.compress(raw, 9, mtime=0) if enc == 'gzip' else brotli.compress(raw, quality=11)
+        # Output is deterministic, so a racing request compressing the same body is harmless
+        asset['bodies'][enc] = data
+    return data
+def _pick_encoding(etags):
+    best, best_q = 'identity', 0.0
+    for enc in ('br', 'gzip'):
+        q = request.accept_encodings.quality(enc) if enc in etags else 0
+        if q > best_q:
+            best, best_q = enc, q
+    return best
+def serve_static(asset):
+    """Serve a static asset in the negotiated encoding, answering If-None-Match with 304"""
+    etags = asset['etags']
+    enc = _pick_encoding(etags)
+    # Every encoding has the same content, so any of our tags validates
+    if any(request.if_none_match.contains(tag) for tag in etags.values()):
+        response = Response(status=304)
+    else:
+        response = Response(static_body(asset, enc), content_type=asset['content_type'])
+        if enc != 'identity':
+            response.headers['Content-Encoding'] = enc
+    response.set_etag(etags[enc])
+    response.headers['Cache-Control'] = STATIC_CACHE_CONTROL
+    response.headers['Vary'] = 'Accept-Encoding'
+    return response
+_STATIC_HOME = _static_asset(HTML_PAGE, 'text/html; charset=utf-8')
+_STATIC_ROBOTS = _static_asset(ROBOTS_TXT, 'text/plain')
+_STATIC_SITEMAP = _static_asset(SITEMAP_XML, 'application/xml')
+@app.route('/')
+def home():
+    return serve_static(_STATIC_HOME)
+@app.route('/robots.txt')
+def robots():
+    return serve_static(_STATIC_ROBOTS)
+@app.route('/sitemap.xml')
+def sitemap():
+    return serve_static(_STATIC_SITEMAP)
 @app.route('/api/check_limit')
 def check_limit():
-    """Always allow if authenticated"""
+    """Allow if authenticated and under the daily download limit"""
     try:
         token = request.headers.get('Authorization')
         if not token:
-            print("No token provided")
+            log_event('auth_rejected', 'warning', endpoint='check_limit', reason='no token')
             return jsonify({"allowed": False, "error": "No token"}), 401
        
         email = verify_firebase_token(token.replace('Bearer ', ''))
         if not email:
-            print("Invalid token")
+            log_event('auth_rejected', 'warning', endpoint='check_limit', reason='invalid token')
             return jsonify({"allowed": False, "error": "Invalid token"}), 401
        
-        return jsonify({"allowed": True})
+        limit = usage.USAGE_DAILY_LIMIT
+        if limit <= 0 or not usage.USAGE_STORE:
+            return jsonify({"allowed": True})
+        used = get_usage(email)
+        return jsonify({"allowed": used < limit, "used": used, "limit": limit, "remaining": max(0, limit - used)})
     except Exception as e:
-        print(f"Error in check_limit: {e}")
-        traceback.print_exc()
+        log_event('endpoint_error', 'error', exc_info=True, endpoint='check_limit', error=str(e))
         return jsonify({"allowed": False, "error": str(e)}), 500
+def metrics_refusal(authorization):
+    """None if `authorization` carries METRICS_TOKEN, else the (message, status, headers) to answer with"""
+    if not METRICS_TOKEN:
+        return "Not Found", 404, {}
+    expected = f"Bearer {METRICS_TOKEN}".encode('utf-8')
+    if not secrets.compare_digest((authorization or '').encode('utf-8'), expected):
+        return "Unauthorized", 401, {'WWW-Authenticate': 'Bearer'}
+    return None
+@app.route('/api/token_cache_stats')
+def token_cache_stats_route():
+    """Verified-token cache counters, for checking the effect on auth latency"""
+    refused = metrics_refusal(request.headers.get('Authorization'))
+    if refused is not None:
+        return refused
+    return jsonify(token_cache_stats())
+@app.route('/api/pool_stats')
+def pool_stats_route():
+    """Pre-generated PDF pool occupancy and hit/miss counters"""
+    refused = metrics_refusal(request.headers.get('Authorization'))
+    if refused is not None:
+        return refused
+    return jsonify(pdf_pool_stats())
+@app.route('/api/cache_stats')
+def cache_stats_route():
+    """Seeded-document cache hit counters and tier sizes"""
+    refused = metrics_refusal(request.headers.get('Authorization'))
+    if refused is not None:
+        return refused
+    return jsonify(pdf_cache_stats())
+def _prometheus_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join('%s="%s"' % (k, v) for k, v in pairs) + "}"
+def render_metrics():
+    """Timing histograms plus cache, pool, usage and rate-limit counters in Prometheus text format"""
+    histograms, alloc_blocks, log_suppressed = metrics_snapshot()
+    lines = []
+    declared = set()
+    for (name, labels), (counts, total) in histograms:
+        if name not in declared:
+            declared.add(name)
+            lines.append(f"# TYPE {name} histogram")
+        cumulative = 0
+        for le, count in zip(METRIC_BUCKETS + ('+Inf',), counts):
+            cumulative += count
+            lines.append(f"{name}_bucket{_prometheus_labels(labels, [('le', le)])} {cumulative}")
+        lines.append(f"{name}_sum{_prometheus_labels(labels)} {total}")
+        lines.append(f"{name}_count{_prometheus_labels(labels)} {cumulative}")
+    if alloc_blocks:
+        lines.append("# TYPE pdfbirch_stage_allocated_blocks gauge")
+        for stage, blocks in alloc_blocks:
+            lines.append(f'pdfbirch_stage_allocated_blocks{{stage="{stage}"}} {blocks}')
+    counters = {"hits", "misses", "evictions", "expired", "generated", "memory_hits", "disk_hits",
+                "cache_hits", "cache_misses", "flushes", "rows_written", "errors", "reused", "fresh",
+                "served", "sendfile", "reloads",
+                "allowed", "limited", "backend_calls", "backend_errors"}
+    for prefix, stats in (("pdfbirch_token_cache", token_cache_stats()),
+                          ("pdfbirch_pool", pdf_pool_stats()),
+                          ("pdfbirch_document_cache", pdf_cache_stats()),
+                          ("pdfbirch_corpus", corpus_stats()),
+                          ("pdfbirch_fragments", fragment_stats()),
+                          ("pdfbirch_ttf", ttf_stats()),
+                          ("pdfbirch_usage", usage_stats()),
+                          ("pdfbirch_rate_limit", rate_limit_stats())):
+        for key, value in stats.items():
+            if value is None or key == "hit_rate":
+                continue
+            name = f"{prefix}_{key}_total" if key in counters else f"{prefix}_{key}"
+            lines.append(f"# TYPE {name} {'counter' if key in counters else 'gauge'}")
+            lines.append(f"{name} {value}")
+    lines.append("# TYPE pdfbirch_jobs_pending gauge")
+    lines.append(f"pdfbirch_jobs_pending {jobs_pending()}")
+    lines.append("# TYPE pdfbirch_log_suppressed_total counter")
+    lines.append(f"pdfbirch_log_suppressed_total {log_suppressed}")
+    return "\n".join(lines) + "\n"
+@app.route('/metrics')
+def metrics():
+    refused = metrics_refusal(request.headers.get('Authorization'))
+    if refused is not None:
+        return refused
+    return Response(render_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8')
 @app.route('/api/download', methods=['POST'])
 def download():
-    """Generate and download PDF if authenticated - no quota"""
+    """Generate and download PDF if authenticated and within the rate limit and daily quota"""
+    admitted = False
     try:
         token = request.headers.get('Authorization')
         if not token:
-            print("No token provided in download")
+            log_event('auth_rejected', 'warning', endpoint='download', reason='no token')
             return "Unauthorized - No token", 401
        
         email = verify_firebase_token(token.replace('Bearer ', ''))
         if not email:
-            print("Invalid token in download")
+            log_event('auth_rejected', 'warning', endpoint='download', reason='invalid token')
             return "Unauthorized - Invalid token", 401
        
-        print(f"Download request from: {email}")
+        body = request_body(request.get_json(silent=True))
+        if body is None:
+            return "Request body must be a JSON object", 400
+        try:
+            seed = request_seed(body, request.args)
+            spec = request_doc_spec(body, 1, request.args)
+        except GenerationBudgetError as e:
+            return str(e), 413
+        except ValueError as e:
+            return str(e), 400
+        refused = admit(email)
+        if refused is not None:
+            return refused[0], 429, {'Retry-After': str(refused[1])}
+        # Usage is settled once the document exists; until then a failure hands the reservation back
+        admitted = True
+        if seed is not None:
+            # Same seed, same filename and same bytes, served from the cache when possible
+            name = random_pdf_name(random.Random(seed))
+            doc = get_seeded_pdf(seed, spec)
+            settle_usage(email)
+            log_event('download', email=email, source='seeded', name=name, bytes=len(doc))
+            return Response(doc, mimetype='application/pdf',
+                            headers={'Content-Disposition': f'attachment; filename="{name}"'})
        
+        name = random_pdf_name()
+        corpus = get_corpus()
+        if corpus is not None and spec == corpus.spec:
+            response = corpus_response(corpus, name)
+            settle_usage(email)
+            log_event('download', email=email, source='corpus', name=name)
+            return response
+        doc = take_pooled_pdf() if render.PDF_ENGINE != 'fpdf' and spec == DEFAULT_DOC_SPEC else None
+        if doc is not None:
+            settle_usage(email)
+            log_event('download', email=email, source='pool', name=name, bytes=len(doc))
+            return Response(doc, mimetype='application/pdf',
+                            headers={'Content-Disposition': f'attachment; filename="{name}"'})
+        if render.PDF_ENGINE != 'fpdf' and procpool.PDF_WORKERS <= 0:
+            # Stream pages as they are laid out; without a Content-Length the
+            # server falls back to chunked transfer encoding
+            log_event('download', email=email, source='stream', name=name)
+            return Response(settled_chunks(_stream_pdf(iter_pdf(*spec)), email), mimetype='application/pdf',
+                            headers={'Content-Disposition': f'attachment; filename="{name}"'})
         # Generate and return PDF
-        print("Generating PDF content...")
-        buf = gen_pdf_content()
+        buf = gen_pdf_content(spec=spec)
         buf.seek(0)
-        name = f"{random.choice(PREFIXES)}_{random.choice(PREFIXES)}_{''.join(random.choices(string.ascii_uppercase+string.digits, k=4))}.pdf"
-        print(f"Sending PDF: {name}, Size: {buf.getbuffer().nbytes} bytes")
+        size = buf.getbuffer().nbytes
+        settle_usage(email)
+        log_event('download', email=email, source='inline', name=name, bytes=size)
        
-        return make_response(send_file(buf, as_attachment=True, download_name=name, mimetype='application/pdf'))
+        response = make_response(send_file(buf, as_attachment=True, download_name=name, mimetype='application/pdf'))
+        # send_file can't size an in-memory file on its own
+        response.content_length = size
+        return response
    
     except Exception as e:
-        print(f"Error in download endpoint: {str(e)}")
-        traceback.print_exc()
+        log_event('endpoint_error', 'error', exc_info=True, endpoint='download', error=str(e))
+        if admitted:
+            settle_usage(email, delivered=False)
         return str(e), 500
-def gen_pdf_content():
-    """Generate PDF with randomized fonts, sizes, and styles"""
+@app.route('/api/download_batch', methods=['POST'])
+def download_batch():
+    """Generate `count` PDFs with a single auth check and stream them as one ZIP"""
     try:
-        pdf = FPDF()
-        pdf.set_auto_page_break(auto=True, margin=15)
+        token = request.headers.get('Authorization')
+        if not token:
+            log_event('auth_rejected', 'warning', endpoint='download_batch', reason='no token')
+            return "Unauthorized - No token", 401
        
-        for page_num in range(10):
-            pdf.add_page()
-           
-            for line_num in range(25):
-                # Randomize font, style, and size for EACH line
-                family = random.choice(['Arial', 'Times', 'Courier'])
-                style = random.choice(['', 'B', 'I', 'BI'])
-                size = random.randint(10, 14)
-               
-                pdf.set_font(family, style, size)
-               
-                # Generate random sentence
-                line = " ".join(random.choice(WORDS) for _ in range(random.randint(10, 20))).capitalize() + "."
-                pdf.multi_cell(0, 10, line, align='L')
-               
-                # Anti-Detector Noise
-                pdf.set_text_color(255, 255, 255)
-                pdf.set_font('Arial', '', 6)
-                noise = ''.join(random.choices(string.ascii_letters + string.digits, k=15))
-                pdf.cell(0, 5, noise, ln=1)
-                pdf.set_text_color(0, 0, 0)
+        email = verify_firebase_token(token.replace('Bearer ', ''))
+        if not email:
+            log_event('auth_rejected', 'warning', endpoint='download_batch', reason='invalid token')
+            return "Unauthorized - Invalid token", 401
+        body = request_body(request.get_json(silent=True))
+        if body is None:
+            return "Request body must be a JSON object", 400
+        try:
+            count = int(body.get('count', 5))
+        except (TypeError, ValueError):
+            return "Invalid count", 400
+        max_files = batch_max_files()
+        if not 1 <= count <= max_files:
+            return f"count must be between 1 and {max_files}", 400
+        try:
+            seed = request_seed(body, request.args)
+            spec = request_doc_spec(body, count, request.args)
+        except GenerationBudgetError as e:
+            return str(e), 413
+        except ValueError as e:
+            return str(e), 400
+       
+        refused = admit(email, count)
+        if refused is not None:
+            return refused[0], 429, {'Retry-After': str(refused[1])}
+        log_event('download_batch', email=email, count=count)
+        name = f"Pdfbirch_Batch_{''.join(random.choices(string.ascii_uppercase+string.digits, k=4))}.zip"
+        return Response(settled_chunks(_stream_zip(count, seed, spec), email, count), mimetype='application/zip',
+                        headers={'Content-Disposition': f'attachment; filename="{name}"'})
+   
+    except Exception as e:
+        log_event('endpoint_error', 'error', exc_info=True, endpoint='download_batch', error=str(e))
+        return str(e), 500
+@app.route('/api/jobs', methods=['POST'])
+def submit_job():
+    """Queue a document build and return its job ID without waiting for it"""
+    try:
+        token = request.headers.get('Authorization')
+        if not token:
+            log_event('auth_rejected', 'warning', endpoint='submit_job', reason='no token')
+            return "Unauthorized - No token", 401
        
-        return io.BytesIO(pdf.output(dest='S').encode('latin-1'))
+        email = verify_firebase_token(token.replace('Bearer ', ''))
+        if not email:
+            log_event('auth_rejected', 'warning', endpoint='submit_job', reason='invalid token')
+            return "Unauthorized - Invalid token", 401
+        body = request_body(request.get_json(silent=True))
+        if body is None:
+            return "Request body must be a JSON object", 400
+        try:
+            seed = request_seed(body, request.args)
+            spec = request_doc_spec(body, 1, request.args)
+        except GenerationBudgetError as e:
+            return str(e), 413
+        except ValueError as e:
+            return str(e), 400
+        refused = admit(email)
+        if refused is not None:
+            return refused[0], 429, {'Retry-After': str(refused[1])}
+        try:
+            job = queue_job(email, seed, spec)
+        except Exception:
+            settle_usage(email, delivered=False)
+            raise
+        if job is None:
+            settle_usage(email, delivered=False)
+            return "Too many pending jobs, try again shortly", 503
+        log_event('job_submitted', email=email, job_id=job['id'], pages=spec.pages, target_bytes=spec.target_bytes)
+        return jsonify(job_view(job)), 202, {'Location': f"/api/jobs/{job['id']}"}
+   
+    except Exception as e:
+        log_event('endpoint_error', 'error', exc_info=True, endpoint='submit_job', error=str(e))
+        return str(e), 500
+@app.route('/api/jobs/<job_id>')
+def job_status(job_id):
+    """Status and progress (pages done) of a submitted job"""
+    try:
+        token = request.headers.get('Authorization')
+        if not token:
+            return "Unauthorized - No token", 401
+        email = verify_firebase_token(token.replace('Bearer ', ''))
+        if not email:
+            return "Unauthorized - Invalid token", 401
+        job = get_job(job_id, email)
+        if job is None:
+            return "Job not found or expired", 404
+        return jsonify(job_view(job))
+    except Exception as e:
+        log_event('endpoint_error', 'error', exc_info=True, endpoint='job_status', error=str(e))
+        return str(e), 500
+@app.route('/api/jobs/<job_id>/result')
+def job_result(job_id):
+    """Download a finished job's document"""
+    try:
+        token = request.headers.get('Authorization')
+        if not token:
+            return "Unauthorized - No token", 401
+        email = verify_firebase_token(token.replace('Bearer ', ''))
+        if not email:
+            return "Unauthorized - Invalid token", 401
+        job = get_job(job_id, email)
+        if job is None:
+            return "Job not found or expired", 404
+        if job['status'] == 'failed':
+            return f"Job failed: {job['error']}", 500
+        if job['status'] != 'done':
+            return jsonify(job_view(job)), 409
+        doc = get_job_store().result(job_id)
+        if doc is None:
+            return "Job not found or expired", 404
+        log_event('download', email=email, source='job', name=job['name'], bytes=len(doc))
+        return Response(doc, mimetype='application/pdf',
+                        headers={'Content-Disposition': f"attachment; filename=\"{job['name']}\""})
+    except Exception as e:
+        log_event('endpoint_error', 'error', exc_info=True, endpoint='job_result', error=str(e))
+        return str(e), 500
+class _ZipStream:
+    """Write-only file object that lets zipfile emit an archive piece by piece"""
+    def __init__(self):
+        self.chunks = []
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+    def flush(self):
+        pass
+    def drain(self):
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+_batch_executor = ThreadPoolExecutor(max_workers=BATCH_WORKERS, thread_name_prefix='pdf-batch')
+def _build_document(seed=None, spec=DEFAULT_DOC_SPEC):
+    if seed is not None:
+        return random_pdf_name(random.Random(seed)), get_seeded_pdf(seed, spec)
+    doc = take_pooled_pdf() if spec == DEFAULT_DOC_SPEC else None
+    if doc is None:
+        doc = build_pdf_bytes(spec=spec)
+    return random_pdf_name(), doc
+def _stream_zip(count, seed=None, spec=DEFAULT_DOC_SPEC):
+    """Yield a ZIP archive of `count` fresh PDFs, adding each entry as soon as its document is done"""
+    out = _ZipStream()
+    names = set()
+    try:
+        with zipfile.ZipFile(out, 'w', compression=zipfile.ZIP_DEFLATED, compresslevel=1) as zf:
+            # A seeded batch is `count` seeded documents: seed/0, seed/1, ...
+            futures = [_batch_executor.submit(_build_document, None if seed is None else f"{seed}/{i}", spec)
+                       for i in range(count)]
+            for future in as_completed(futures):
+                name, doc = future.result()
+                while name in names:
+                    name = random_pdf_name()
+                names.add(name)
+                zf.writestr(zipfile.ZipInfo(name, time.localtime()[:6]), doc,
+                            compress_type=zipfile.ZIP_DEFLATED, compresslevel=1)
+                yield out.drain()
+        yield out.drain()
+        log_event('zip_streamed', count=count)
+    except Exception as e:
+        log_event('zip_stream_error', 'error', exc_info=True, error=str(e))
+        raise
+def _stream_pdf(chunks):
+    """Pass PDF chunks through to the client, logging failures that happen after headers are sent"""
+    try:
+        sent = 0
+        for chunk in chunks:
+            sent += len(chunk)
+            yield chunk
+        log_event('pdf_streamed', bytes=sent)
+    except Exception as e:
+        log_event('pdf_stream_error', 'error', exc_info=True, error=str(e))
+        raise
+def gen_pdf_content(seed=None, spec=DEFAULT_DOC_SPEC):
+    """Generate PDF with randomized fonts, sizes, and styles"""
+    if render.PDF_ENGINE == 'fpdf' and procpool.PDF_WORKERS <= 0:
+        return gen_pdf_content_fpdf(seed, spec)
+    try:
+        return io.BytesIO(build_pdf_bytes(seed, spec))
     except Exception as e:
-        print(f"Error generating PDF: {e}")
-        traceback.print_exc()
+        log_event('generation_error', 'error', exc_info=True, error=str(e))
         raise
+def corpus_response(corpus, name):
+    """Serve a random corpus document, through wsgi.file_wrapper when the server has one"""
+    headers = {'Content-Disposition': f'attachment; filename="{name}"'}
+    file_wrapper = request.environ.get('wsgi.file_wrapper')
+    opened = open_random_document(corpus) if file_wrapper is not None else None
+    if opened is None:
+        doc = random_corpus_document(corpus)
+        if request.environ.get('SERVER_SOFTWARE', '').startswith('Werkzeug/'):
+            doc = doc.tobytes()
+        # A one-item iterable, since Response() would iterate a bare memoryview int by int
+        response = Response([doc], mimetype='application/pdf', headers=headers, direct_passthrough=True)
+        response.content_length = len(doc)
+        return response
+    f, length = opened
+    response = Response(file_wrapper(f, 256 * 1024), mimetype='application/pdf', headers=headers,
+                        direct_passthrough=True)
+    response.content_length = length
+    return response
+start_pdf_pool()
 # For Vercel, we need to export the app
 app = app
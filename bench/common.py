@@ -0,0 +1,98 @@
+"""Shared helpers for the benchmark scripts: loading the app offline, timing and result files."""
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+API_DIR = os.path.join(ROOT, 'api')
+BENCH_EMAIL = 'bench@pdfbirch.app'
+
+# The pdfbirch package lives at the repository root
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+
+def load_index(stub_auth=False):
+    """Import api/index.py; with stub_auth every non-empty token verifies as BENCH_EMAIL"""
+    if API_DIR not in sys.path:
+        sys.path.insert(0, API_DIR)
+    import index
+    if stub_auth:
+        index.verify_firebase_token = lambda token: BENCH_EMAIL if token else None
+        # asgi.py checks the token cache itself and only calls this on a miss
+        from pdfbirch import auth
+        auth.verify_token_uncached = lambda key, token: BENCH_EMAIL if token else None
+    return index
+
+
+def load_asgi(stub_auth=False):
+    """Import api/asgi.py (needs requirements-asgi.txt), with the same auth stub as load_index"""
+    load_index(stub_auth)
+    import asgi
+    return asgi
+
+
+def percentiles(samples):
+    """Summary of a list of durations in seconds, reported in milliseconds"""
+    ordered = sorted(samples)
+    n = len(ordered)
+
+    def pick(q):
+        return ordered[min(n - 1, int(q * n))] * 1000
+
+    return {
+        "n": n,
+        "mean_ms": sum(ordered) / n * 1000,
+        "min_ms": ordered[0] * 1000,
+        "p50_ms": pick(0.50),
+        "p95_ms": pick(0.95),
+        "p99_ms": pick(0.99),
+        "max_ms": ordered[-1] * 1000,
+    }
+
+
+def time_calls(fn, repeat, warmup=3):
+    """Call fn() warmup + repeat times and return the timed durations in seconds"""
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process so far"""
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is KiB on Linux and bytes on macOS
+    return rss / (1024 * 1024) if sys.platform == 'darwin' else rss / 1024
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def write_results(path, suite, config, results):
+    """Write a result file that bench/compare.py can diff against another commit's"""
+    payload = {
+        "suite": suite,
+        "git_revision": git_revision(),
+        "timestamp": time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "config": config,
+        "results": results,
+    }
+    with open(path, 'w') as f:
+        json.dump(payload, f, indent=2)
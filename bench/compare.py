@@ -0,0 +1,72 @@
+"""Diff two benchmark result files and flag regressions.
+
+    python bench/compare.py before.json after.json [--threshold 10]
+
+Works on the output of micro.py, e2e.py, compression.py and import_time.py.
+Latency-style numbers (`*_ms`, `peak_*`) and document sizes regress when
+they go up, throughput (`*_per_s`) when it goes down. Exits 1 if any tracked metric moved the wrong way by more than the
+threshold percentage, so it can gate a CI step.
+"""
+import argparse
+import json
+import sys
+
+LOWER_IS_BETTER = ("p50_ms", "p95_ms", "p99_ms", "peak_kib", "peak_rss_mb",
+                   "avg_bytes", "cpu_ms_per_doc", "process_wall_ms", "cumulative_ms")
+HIGHER_IS_BETTER = ("ops_per_s", "requests_per_s", "mb_per_s")
+
+
+def flatten(results, prefix=''):
+    flat = {}
+    for key, value in results.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(flatten(value, name + '.'))
+        elif isinstance(value, (int, float)):
+            flat[name] = value
+    return flat
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('before')
+    parser.add_argument('after')
+    parser.add_argument('--threshold', type=float, default=10.0, help="percent change treated as a regression")
+    args = parser.parse_args()
+    with open(args.before) as f:
+        before = json.load(f)
+    with open(args.after) as f:
+        after = json.load(f)
+    if before.get("suite") != after.get("suite"):
+        print(f"warning: comparing suite {before.get('suite')} against {after.get('suite')}")
+    print(f"{before.get('git_revision')} -> {after.get('git_revision')}")
+
+    old, new = flatten(before["results"]), flatten(after["results"])
+    regressions = 0
+    print(f"{'metric':<45} {'before':>12} {'after':>12} {'change':>9}")
+    for name in sorted(old.keys() & new.keys()):
+        metric = name.rsplit('.', 1)[-1]
+        if metric in LOWER_IS_BETTER:
+            worse_sign = 1
+        elif metric in HIGHER_IS_BETTER:
+            worse_sign = -1
+        else:
+            continue
+        a, b = old[name], new[name]
+        change = (b - a) / a * 100 if a else 0.0
+        flag = ''
+        if change * worse_sign > args.threshold:
+            flag = '  REGRESSION'
+            regressions += 1
+        elif -change * worse_sign > args.threshold:
+            flag = '  improved'
+        print(f"{name:<45} {a:>12.3f} {b:>12.3f} {change:>+8.1f}%{flag}")
+    missing = sorted((old.keys() ^ new.keys()))
+    if missing:
+        print(f"only in one file: {', '.join(missing)}")
+    print(f"{regressions} regression(s) over {args.threshold:g}%")
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == '__main__':
+    main()
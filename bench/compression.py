@@ -0,0 +1,51 @@
+"""Size/CPU trade-off of the template engine's Flate compression levels.
+
+    python bench/compression.py [--docs 50] [--pages 10] [--json out.json]
+
+Every level renders the same seeded documents, so sizes are comparable.
+"""
+import argparse
+import time
+
+from common import write_results
+from pdfbirch.render import render_pdf
+
+
+def run(docs, pages, levels):
+    results = []
+    for level in levels:
+        total_bytes = 0
+        start = time.process_time()
+        for i in range(docs):
+            total_bytes += len(render_pdf(pages=pages, seed=f"bench/{i}", compress=level))
+        cpu = time.process_time() - start
+        results.append({
+            "level": level,
+            "avg_bytes": total_bytes / docs,
+            "cpu_ms_per_doc": cpu * 1000 / docs,
+        })
+    base = results[0]["avg_bytes"]
+    for r in results:
+        r["ratio"] = r["avg_bytes"] / base
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--docs', type=int, default=50)
+    parser.add_argument('--pages', type=int, default=10)
+    parser.add_argument('--levels', default='0,1,2,3,4,5,6,7,8,9')
+    parser.add_argument('--json', help="also write the results to this file")
+    args = parser.parse_args()
+    levels = [int(x) for x in args.levels.split(',')]
+    results = run(args.docs, args.pages, levels)
+    print(f"{'level':>5} {'avg bytes':>11} {'ratio':>7} {'cpu ms/doc':>11}")
+    for r in results:
+        print(f"{r['level']:>5} {r['avg_bytes']:>11.0f} {r['ratio']:>7.3f} {r['cpu_ms_per_doc']:>11.2f}")
+    if args.json:
+        write_results(args.json, 'compression', {"docs": args.docs, "pages": args.pages, "levels": levels},
+                      {f"level_{r['level']}": {k: v for k, v in r.items() if k != 'level'} for r in results})
+
+
+if __name__ == '__main__':
+    main()
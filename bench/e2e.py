@@ -0,0 +1,148 @@
+"""End-to-end load test against a local server with auth stubbed out.
+
+    python bench/e2e.py [--route download] [--concurrency 8] [--requests 200] [--server wsgi] [--json out.json]
+
+Starts the Flask app (or with --server asgi, api/asgi.py under uvicorn) on a
+loopback port in a background thread (so no Firebase project or network
+access is needed), then drives it with concurrent keep-alive clients and
+reports throughput, latency and time-to-first-byte percentiles and the
+server's peak RSS.
+"""
+import argparse
+import http.client
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.serving import WSGIRequestHandler, make_server
+
+from common import load_asgi, load_index, peak_rss_mb, percentiles, write_results
+
+ROUTES = {
+    "home": ('GET', '/', None),
+    "check_limit": ('GET', '/api/check_limit', None),
+    "download": ('POST', '/api/download', {}),
+    "download_seeded": ('POST', '/api/download', {"seed": "bench"}),
+    "download_batch": ('POST', '/api/download_batch', {"count": 5}),
+}
+
+
+class QuietHandler(WSGIRequestHandler):
+    def log_request(self, *args, **kwargs):
+        pass
+
+
+def start_server(app):
+    server = make_server('127.0.0.1', 0, app, threaded=True, request_handler=QuietHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server.server_port, server.shutdown
+
+
+def start_asgi_server(app):
+    import socket
+    import uvicorn
+    # asyncio only sets TCP_NODELAY on sockets whose proto is IPPROTO_TCP; a
+    # bare socket.socket() has proto 0, which stalls every keep-alive response
+    # on delayed ACKs (about 40ms) where `uvicorn --host --port` would not
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM, socket.IPPROTO_TCP)
+    sock.bind(('127.0.0.1', 0))
+    server = uvicorn.Server(uvicorn.Config(app, log_level='warning', access_log=False, backlog=2048))
+    thread = threading.Thread(target=server.run, kwargs={'sockets': [sock]}, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.01)
+
+    def shutdown():
+        server.should_exit = True
+        thread.join()
+    return sock.getsockname()[1], shutdown
+
+
+def run_client(port, route, n, ttfb, latency, errors):
+    method, path, body = ROUTES[route]
+    headers = {"Authorization": "Bearer bench"}
+    payload = None
+    if body is not None:
+        payload = json.dumps(body)
+        headers["Content-Type"] = "application/json"
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+    received = 0
+    for _ in range(n):
+        start = time.perf_counter()
+        try:
+            conn.request(method, path, body=payload, headers=headers)
+            resp = conn.getresponse()
+            first = resp.read(1)
+            ttfb.append(time.perf_counter() - start)
+            rest = resp.read()
+            latency.append(time.perf_counter() - start)
+            received += len(first) + len(rest)
+            if resp.status != 200:
+                errors.append(resp.status)
+        except (OSError, http.client.HTTPException) as e:
+            errors.append(repr(e))
+            conn.close()
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+    conn.close()
+    return received
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--route', choices=sorted(ROUTES), default='download')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=200, help="total requests across all clients")
+    parser.add_argument('--warmup', type=int, default=5)
+    parser.add_argument('--server', choices=['wsgi', 'asgi'], default='wsgi')
+    parser.add_argument('--json', help="also write the results to this file")
+    args = parser.parse_args()
+
+    # Per-request log lines would otherwise interleave with the report
+    os.environ.setdefault('LOG_LEVEL', 'warning')
+    # One stub user sends every request, so the per-user limit would throttle the run
+    os.environ.setdefault('RATE_LIMIT_RATE', '0')
+    if args.server == 'asgi':
+        port, shutdown = start_asgi_server(load_asgi(stub_auth=True).app)
+    else:
+        port, shutdown = start_server(load_index(stub_auth=True).app)
+    run_client(port, args.route, args.warmup, [], [], [])
+
+    ttfb, latency, errors = [], [], []
+    per_client = [args.requests // args.concurrency] * args.concurrency
+    for i in range(args.requests % args.concurrency):
+        per_client[i] += 1
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        received = sum(executor.map(lambda n: run_client(port, args.route, n, ttfb, latency, errors), per_client))
+    elapsed = time.perf_counter() - start
+    shutdown()
+
+    results = {
+        "requests": len(latency),
+        "errors": len(errors),
+        "elapsed_s": elapsed,
+        "requests_per_s": len(latency) / elapsed,
+        "mb_per_s": received / elapsed / (1024 * 1024),
+        "latency": percentiles(latency) if latency else None,
+        "ttfb": percentiles(ttfb) if ttfb else None,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+    print(f"{args.route} ({args.server}): {results['requests']} requests, {results['errors']} errors, "
+          f"concurrency {args.concurrency}, {elapsed:.2f}s")
+    print(f"  throughput  {results['requests_per_s']:.1f} req/s, {results['mb_per_s']:.2f} MB/s")
+    for label in ("latency", "ttfb"):
+        s = results[label]
+        if s:
+            print(f"  {label:<10}  p50 {s['p50_ms']:.2f}ms  p95 {s['p95_ms']:.2f}ms  "
+                  f"p99 {s['p99_ms']:.2f}ms  max {s['max_ms']:.2f}ms")
+    print(f"  peak RSS    {results['peak_rss_mb']:.1f} MB")
+    if errors:
+        print(f"  first errors: {errors[:5]}")
+    if args.json:
+        write_results(args.json, 'e2e', vars(args), {args.route: results})
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+"""Cold-start import profile of the app module.
+
+    python bench/import_time.py [--runs 5] [--top 15] [--json out.json]
+
+Imports api/index.py in fresh interpreters with `python -X importtime`
+and reports the median self/cumulative time of index and each package it
+imports directly, so the cost a serverless cold start pays before serving
+`/` is visible.
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+from common import API_DIR, ROOT, write_results
+
+
+def profile_once():
+    start = time.perf_counter()
+    proc = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import index'],
+        cwd=API_DIR, env=dict(os.environ, PYTHONPATH=ROOT), capture_output=True, text=True, check=True)
+    wall = time.perf_counter() - start
+    entries = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip(' ')) - 1) // 2
+        entries.append((depth, name.strip(), int(self_us), int(cumulative_us)))
+    # -X importtime lists children before their parent: index's subtree is
+    # everything after the previous top-level import
+    end = next(i for i, e in enumerate(entries) if e[0] == 0 and e[1] == 'index')
+    begin = end
+    while begin > 0 and entries[begin - 1][0] > 0:
+        begin -= 1
+    packages = {name: (self_us, cumulative_us)
+                for depth, name, self_us, cumulative_us in entries[begin:end + 1] if depth <= 1}
+    return wall, packages
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--top', type=int, default=15)
+    parser.add_argument('--json', help="also write the results to this file")
+    args = parser.parse_args()
+    walls = []
+    samples = {}
+    for _ in range(args.runs):
+        wall, packages = profile_once()
+        walls.append(wall)
+        for name, times in packages.items():
+            samples.setdefault(name, []).append(times)
+    report = {
+        "runs": args.runs,
+        "process_wall_ms": statistics.median(walls) * 1000,
+        "packages": sorted(
+            ({"name": name,
+              "self_ms": statistics.median(t[0] for t in times) / 1000,
+              "cumulative_ms": statistics.median(t[1] for t in times) / 1000}
+             for name, times in samples.items()),
+            key=lambda p: p["cumulative_ms"], reverse=True),
+    }
+    print(f"interpreter start + import index: {report['process_wall_ms']:.1f} ms (median of {args.runs})")
+    print(f"{'package':<40} {'self ms':>9} {'cumulative ms':>14}")
+    for p in report["packages"][:args.top]:
+        print(f"{p['name']:<40} {p['self_ms']:>9.1f} {p['cumulative_ms']:>14.1f}")
+    if args.json:
+        packages = {p["name"]: {"self_ms": p["self_ms"], "cumulative_ms": p["cumulative_ms"]}
+                    for p in report["packages"]}
+        write_results(args.json, 'import_time', {"runs": args.runs},
+                      {"process_wall_ms": report["process_wall_ms"], "packages": packages})
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,177 @@
+"""Micro-benchmarks for the generation and auth hot paths.
+
+    python bench/micro.py [--repeat 50] [--only synth,fpdf] [--json out.json]
+
+Covers text synthesis, line wrapping, FPDF layout and serialization, the template engine
+(core fonts and an embedded TrueType subset), page-fragment stitching and token verification
+(cache hit and local RS256). Everything runs offline; the RS256 case signs its own token with
+a throwaway key.
+"""
+import argparse
+import datetime
+import random
+import string
+import time
+import tracemalloc
+
+from common import percentiles, time_calls, write_results
+from pdfbirch import auth, fragments, layout, render
+
+
+def synth_per_call():
+    """The original per-line random.choice / randint / choices calls, for comparison"""
+    for _ in range(250):
+        random.choice(layout.PDF_FAMILIES)
+        random.choice(layout.PDF_STYLES)
+        random.randint(10, 14)
+        " ".join(random.choice(layout.WORDS) for _ in range(random.randint(10, 20))).capitalize() + "."
+        ''.join(random.choices(string.ascii_letters + string.digits, k=15))
+
+
+def _fpdf_output_bench(calls):
+    # FPDF.output() closes the document, so lay out one per call up front
+    pending = [render.layout_fpdf() for _ in range(calls)]
+    return lambda: pending.pop().output(dest='S')
+
+
+def _wrap_benches():
+    """Line breaking alone on the same 250 lines: stock multi_cell(split_only=True) vs the width table"""
+    fonts, sizes, texts, _ = layout.synth_lines(random.Random(1), 250)
+    pdf = render.buffered_fpdf_class()()
+    pdf.add_page()
+    w = pdf.w - pdf.r_margin - pdf.x
+    lines = list(zip(fonts, sizes, texts))
+
+    def stock():
+        for (family, style), size, text in lines:
+            pdf.set_font(family, style, size)
+            pdf.multi_cell(w, 10, text, align='L', split_only=True)
+
+    def table():
+        for font_key, size, text in lines:
+            layout.wrap_words(text.split(' '), layout.WORD_WIDTHS[font_key], (w - 2 * pdf.c_margin) * 1000.0 / size)
+    return stock, table
+
+
+def _fpdf_layout_stock():
+    """layout_fpdf with the stock multi_cell put back, for comparison"""
+    fast = render.multi_cell_fast
+    render.multi_cell_fast = lambda pdf, w, h, txt, widths: pdf.multi_cell(w, h, txt, align='L')
+    try:
+        return render.layout_fpdf()
+    finally:
+        render.multi_cell_fast = fast
+
+
+def _fragment_bench(pages):
+    """render_pdf with a warm page-fragment library, PDF_FRAGMENTS=512"""
+    def compose():
+        fragments.PDF_FRAGMENTS = 512
+        try:
+            return render.render_pdf(pages)
+        finally:
+            fragments.PDF_FRAGMENTS = 0
+    fragments.PDF_FRAGMENTS = 512
+    render.render_pdf(512)
+    fragments.PDF_FRAGMENTS = 0
+    return compose
+
+
+def _ttf_benches():
+    """render_pdf with every line in the first PDF_TTF_FONTS family, and building its glyph subsets"""
+    family = next(iter(layout.TTF_FAMILIES), None)
+    if family is None:
+        return {}
+    font = layout.get_ttf_font(family)
+    chars = {c for words in layout.UNICODE_WORDS for word in words for c in word + word.capitalize()}
+
+    def subset():
+        font._subsets.clear()
+        return font.subset(chars, layout.PDF_COMPRESS_LEVEL)
+    return {
+        "template_render_ttf": lambda: render.render_pdf(fonts=(family,)),
+        "ttf_subset_build": subset,
+    }
+
+
+def _local_verify_bench():
+    import jwt
+    from cryptography import x509
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import rsa
+    from cryptography.x509.oid import NameOID
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, 'bench')])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    cert = (x509.CertificateBuilder().subject_name(name).issuer_name(name)
+            .public_key(key.public_key()).serial_number(1)
+            .not_valid_before(now).not_valid_after(now + datetime.timedelta(days=1))
+            .sign(key, hashes.SHA256()))
+    auth._signing_keys = auth._parse_signing_keys(
+        {'bench': cert.public_bytes(serialization.Encoding.PEM).decode('ascii')})
+    auth._signing_keys_ready = True
+    auth.FIREBASE_PROJECT_ID = 'pdfbirch-bench'
+    t = int(time.time())
+    token = jwt.encode({'iss': 'https://securetoken.google.com/pdfbirch-bench', 'aud': 'pdfbirch-bench',
+                        'sub': 'bench', 'iat': t, 'exp': t + 3600, 'auth_time': t, 'email': 'bench@pdfbirch.app'},
+                       key, algorithm='RS256', headers={'kid': 'bench'})
+    return lambda: auth.verify_token_locally(token)
+
+
+def _cache_hit_bench():
+    token = 'bench-token-' + 'x' * 900
+    auth._token_cache_put(auth._token_cache_key(token), 'bench@pdfbirch.app', {'exp': time.time() + 3600})
+    return lambda: auth.verify_firebase_token(token)
+
+
+def benchmarks(repeat):
+    rng = random.Random(0)
+    wrap_stock, wrap_table = _wrap_benches()
+    return {
+        "synth_bulk_250_lines": lambda: layout.synth_lines(rng, 250),
+        "synth_per_call_250_lines": synth_per_call,
+        "wrap_stock_multi_cell_250_lines": wrap_stock,
+        "wrap_width_table_250_lines": wrap_table,
+        "fpdf_layout": render.layout_fpdf,
+        "fpdf_layout_stock_multi_cell": _fpdf_layout_stock,
+        "fpdf_serialize": _fpdf_output_bench(repeat + 4),
+        "fpdf_gen_pdf_content": render.gen_pdf_content_fpdf,
+        "template_layout": lambda: list(layout._layout_pages()),
+        "template_render_uncompressed": lambda: render.render_pdf(compress=0),
+        "template_render": render.render_pdf,
+        "template_render_200_pages": lambda: render.render_pdf(200),
+        "fragment_compose_200_pages": _fragment_bench(200),
+        **_ttf_benches(),
+        "auth_cache_hit": _cache_hit_bench(),
+        "auth_local_rs256": _local_verify_bench(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=50)
+    parser.add_argument('--only', help="comma-separated substrings of benchmark names to run")
+    parser.add_argument('--json', help="also write the results to this file")
+    args = parser.parse_args()
+    selected = args.only.split(',') if args.only else None
+    results = {}
+    print(f"{'benchmark':<30} {'ops/s':>10} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'peak KiB':>9}")
+    for name, fn in benchmarks(args.repeat).items():
+        if selected and not any(s in name for s in selected):
+            continue
+        stats = percentiles(time_calls(fn, args.repeat))
+        # Allocation peak from one separate traced call so tracing doesn't skew timings
+        tracemalloc.start()
+        fn()
+        stats["peak_kib"] = tracemalloc.get_traced_memory()[1] / 1024
+        tracemalloc.stop()
+        stats["ops_per_s"] = 1000 / stats["mean_ms"]
+        results[name] = stats
+        print(f"{name:<30} {stats['ops_per_s']:>10.1f} {stats['p50_ms']:>9.3f} {stats['p95_ms']:>9.3f} "
+              f"{stats['p99_ms']:>9.3f} {stats['peak_kib']:>9.0f}")
+    if args.json:
+        write_results(args.json, 'micro', {"repeat": args.repeat}, results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,23 @@
+"""Document generation, caching, quotas and auth behind the pdfbirch web app.
+
+api/index.py (the Flask app Vercel deploys) and api/asgi.py only hold the
+routes; everything they serve comes from these modules, which import each
+other relatively and never touch sys.path. The repository root must be on
+the import path, as it is on Vercel and for `python -m` from the root.
+
+    metrics     stage timings and structured logs
+    auth        Firebase token verification and the verified-token cache
+    layout      template engine building blocks: fixed objects, wrapping, fonts, text
+    ttf         TrueType parsing and subsetting
+    fragments   unseeded documents stitched from stored pages
+    render      whole documents from the template or FPDF engine
+    procpool    builds on a pool of worker processes
+    pool        documents built ahead of requests
+    cache       seeded documents by content address
+    corpus      prebuilt document packs
+    jobs        background builds with progress
+    usage       daily download counts and quotas
+    ratelimit   per-user token buckets
+    spec        request parameters to a DocSpec
+    cli         bulk generation and corpus builds
+"""
@@ -0,0 +1,232 @@
+"""Firebase ID token verification for the protected routes, behind a verified-token cache.
+
+The auth stack (firebase_admin, PyJWT/cryptography, the service account and
+signing keys) is only needed by protected routes, so it is imported and set
+up on the first token verification rather than on every cold start.
+"""
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+import urllib.request
+from collections import OrderedDict
+from .metrics import log_event, span
+FIREBASE_PROJECT_ID = os.getenv('FIREBASE_PROJECT_ID')
+firebase_auth = None
+_auth_lock = threading.Lock()
+_firebase_ready = False
+_signing_keys_ready = False
+def _service_account():
+    service_account_json = os.getenv('FIREBASE_SERVICE_ACCOUNT')
+    if not service_account_json:
+        log_event('firebase_service_account_missing', 'warning')
+        return None
+    return json.loads(service_account_json)
+def init_firebase():
+    """Import and initialize Firebase Admin once, on first use"""
+    global firebase_auth, _firebase_ready, FIREBASE_PROJECT_ID
+    if _firebase_ready:
+        return
+    with _auth_lock:
+        if _firebase_ready:
+            return
+        import firebase_admin
+        from firebase_admin import credentials, auth
+        try:
+            cred_dict = _service_account()
+            if cred_dict:
+                FIREBASE_PROJECT_ID = FIREBASE_PROJECT_ID or cred_dict.get('project_id')
+                cred = credentials.Certificate(cred_dict)
+                if not firebase_admin._apps: # Check if already initialized
+                    firebase_admin.initialize_app(cred)
+                log_event('firebase_initialized')
+        except Exception as e:
+            log_event('firebase_init_error', 'error', error=str(e))
+        firebase_auth = auth
+        _firebase_ready = True
+# Verified-token cache. The browser reuses one ID token for every file in a
+# batch, so we keep successful verifications keyed by a hash of the token and
+# drop them at the token's own `exp`. Failed verifications are never cached.
+# A cached token would skip the revocation check TOKEN_CHECK_REVOKED asks
+# for, so with it on nothing is cached unless TOKEN_REVOCATION_TTL > 0 opts
+# in to accepting a revoked token for up to that many seconds.
+TOKEN_CACHE_SIZE = int(os.getenv('TOKEN_CACHE_SIZE', '1024'))
+TOKEN_CLOCK_SKEW = int(os.getenv('TOKEN_CLOCK_SKEW', '0'))
+TOKEN_CHECK_REVOKED = os.getenv('TOKEN_CHECK_REVOKED', '') == '1'
+TOKEN_REVOCATION_TTL = int(os.getenv('TOKEN_REVOCATION_TTL', '0'))
+_token_cache = OrderedDict()
+_token_cache_lock = threading.Lock()
+_token_cache_stats = {"hits": 0, "misses": 0, "evictions": 0, "expired": 0}
+def _token_cache_key(token):
+    return hashlib.sha256(token.encode('utf-8')).digest()
+def _token_cache_get(key):
+    now = time.time()
+    with _token_cache_lock:
+        entry = _token_cache.get(key)
+        if entry is None:
+            _token_cache_stats["misses"] += 1
+            return None
+        email, expires_at = entry
+        if now >= expires_at:
+            del _token_cache[key]
+            _token_cache_stats["expired"] += 1
+            _token_cache_stats["misses"] += 1
+            return None
+        _token_cache.move_to_end(key)
+        _token_cache_stats["hits"] += 1
+        return email
+def _token_cache_put(key, email, decoded_token):
+    if TOKEN_CACHE_SIZE <= 0 or not email:
+        return
+    # Never trust a cached entry past `exp`, even though verify_id_token would
+    # still accept the token for another TOKEN_CLOCK_SKEW seconds
+    expires_at = float(decoded_token.get('exp', 0))
+    if TOKEN_CHECK_REVOKED:
+        if TOKEN_REVOCATION_TTL <= 0:
+            return
+        expires_at = min(expires_at, time.time() + TOKEN_REVOCATION_TTL)
+    if expires_at <= time.time():
+        return
+    with _token_cache_lock:
+        _token_cache[key] = (email, expires_at)
+        _token_cache.move_to_end(key)
+        while len(_token_cache) > TOKEN_CACHE_SIZE:
+            _token_cache.popitem(last=False)
+            _token_cache_stats["evictions"] += 1
+def token_cache_stats():
+    """Return hit/miss counters and current size of the verified-token cache"""
+    with _token_cache_lock:
+        stats = dict(_token_cache_stats)
+        stats["size"] = len(_token_cache)
+    lookups = stats["hits"] + stats["misses"]
+    stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+    return stats
+# Offline verification. TOKEN_VERIFIER=local checks the RS256 signature and
+# claims against an in-memory copy of Google's signing certs instead of going
+# through firebase_admin. The key set refreshes in the background following the
+# endpoint's Cache-Control max-age; FIREBASE_PUBLIC_KEYS_FILE loads a stand-in
+# key set ({"kid": "<PEM certificate>", ...}) for tests and air-gapped runs.
+TOKEN_VERIFIER = os.getenv('TOKEN_VERIFIER', 'firebase')
+FIREBASE_PUBLIC_KEYS_FILE = os.getenv('FIREBASE_PUBLIC_KEYS_FILE')
+FIREBASE_CERTS_URL = 'https://www.googleapis.com/robot/v1/metadata/x509/securetoken@system.gserviceaccount.com'
+KEY_REFRESH_RETRY = 60
+_signing_keys = {}
+_signing_keys_lock = threading.Lock()
+_signing_keys_fetched_at = 0.0
+_signing_keys_timer = None
+def _parse_signing_keys(certs):
+    from cryptography import x509
+    return {kid: x509.load_pem_x509_certificate(pem.encode('utf-8')).public_key()
+            for kid, pem in certs.items()}
+def load_signing_keys_file(path):
+    """Load a {kid: PEM certificate} key set from disk and make it the active one"""
+    global _signing_keys
+    with open(path) as f:
+        keys = _parse_signing_keys(json.load(f))
+    with _signing_keys_lock:
+        _signing_keys = keys
+    return len(keys)
+def _schedule_key_refresh(delay):
+    global _signing_keys_timer
+    if _signing_keys_timer is not None:
+        _signing_keys_timer.cancel()
+    _signing_keys_timer = threading.Timer(delay, refresh_signing_keys)
+    _signing_keys_timer.daemon = True
+    _signing_keys_timer.start()
+def refresh_signing_keys():
+    """Fetch Google's current signing certs and schedule the next refresh from max-age"""
+    global _signing_keys, _signing_keys_fetched_at
+    try:
+        with urllib.request.urlopen(FIREBASE_CERTS_URL, timeout=5) as resp:
+            certs = json.loads(resp.read().decode('utf-8'))
+            cache_control = resp.headers.get('Cache-Control', '')
+        keys = _parse_signing_keys(certs)
+        with _signing_keys_lock:
+            _signing_keys = keys
+            _signing_keys_fetched_at = time.time()
+        m = re.search(r'max-age=(\d+)', cache_control)
+        max_age = int(m.group(1)) if m else 3600
+        # Refresh a little ahead of expiry so requests never see a stale set
+        _schedule_key_refresh(max(KEY_REFRESH_RETRY, max_age - KEY_REFRESH_RETRY))
+        return True
+    except Exception as e:
+        log_event('signing_key_refresh_error', 'error', error=str(e))
+        _schedule_key_refresh(KEY_REFRESH_RETRY)
+        return False
+def _get_signing_key(kid):
+    key = _signing_keys.get(kid)
+    if key is None and not FIREBASE_PUBLIC_KEYS_FILE:
+        # Unknown kid usually means Google rotated keys; refetch at most once a minute
+        if time.time() - _signing_keys_fetched_at > KEY_REFRESH_RETRY:
+            refresh_signing_keys()
+            key = _signing_keys.get(kid)
+    return key
+def init_signing_keys():
+    """Resolve the project ID and load the signing key set once, on first use"""
+    global _signing_keys_ready, FIREBASE_PROJECT_ID
+    if _signing_keys_ready:
+        return
+    with _auth_lock:
+        if _signing_keys_ready:
+            return
+        if not FIREBASE_PROJECT_ID:
+            try:
+                FIREBASE_PROJECT_ID = (_service_account() or {}).get('project_id')
+            except ValueError as e:
+                log_event('firebase_service_account_error', 'error', error=str(e))
+        if FIREBASE_PUBLIC_KEYS_FILE:
+            count = load_signing_keys_file(FIREBASE_PUBLIC_KEYS_FILE)
+            log_event('signing_keys_loaded', count=count, path=FIREBASE_PUBLIC_KEYS_FILE)
+        else:
+            refresh_signing_keys()
+        _signing_keys_ready = True
+def verify_token_locally(token):
+    """Verify a Firebase ID token against the in-memory key set and return its claims"""
+    import jwt
+    init_signing_keys()
+    if not FIREBASE_PROJECT_ID:
+        raise ValueError("FIREBASE_PROJECT_ID is not configured")
+    header = jwt.get_unverified_header(token)
+    if header.get('alg') != 'RS256':
+        raise ValueError(f"Unexpected token algorithm: {header.get('alg')}")
+    key = _get_signing_key(header.get('kid'))
+    if key is None:
+        raise ValueError(f"Unknown signing key: {header.get('kid')}")
+    claims = jwt.decode(
+        token, key, algorithms=['RS256'],
+        audience=FIREBASE_PROJECT_ID,
+        issuer=f"https://securetoken.google.com/{FIREBASE_PROJECT_ID}",
+        leeway=TOKEN_CLOCK_SKEW,
+        options={"require": ["exp", "iat", "sub"]})
+    sub = claims.get('sub')
+    if not isinstance(sub, str) or not sub or len(sub) > 128:
+        raise ValueError("Token has an invalid subject")
+    # Older PyJWT releases only check that iat is an integer, not that it is in the past
+    if claims['iat'] > time.time() + TOKEN_CLOCK_SKEW:
+        raise ValueError("Token iat is in the future")
+    if claims.get('auth_time', 0) > time.time() + TOKEN_CLOCK_SKEW:
+        raise ValueError("Token auth_time is in the future")
+    return claims
+def verify_firebase_token(token):
+    """Verify Firebase ID token and return email if valid"""
+    with span('token_verify'):
+        key = _token_cache_key(token)
+        return _token_cache_get(key) or verify_token_uncached(key, token)
+def verify_token_uncached(key, token):
+    """Full verification for a token that missed the cache under `key`; caches and returns the email"""
+    try:
+        # Revocation needs a round trip to Firebase, so it always takes the admin SDK path
+        if TOKEN_VERIFIER == 'local' and not TOKEN_CHECK_REVOKED:
+            decoded_token = verify_token_locally(token)
+        else:
+            init_firebase()
+            decoded_token = firebase_auth.verify_id_token(
+                token, check_revoked=TOKEN_CHECK_REVOKED, clock_skew_seconds=TOKEN_CLOCK_SKEW)
+        email = decoded_token.get('email')
+        _token_cache_put(key, email, decoded_token)
+        return email
+    except Exception as e:
+        log_event('token_verification_error', 'warning', error=str(e))
+        return None
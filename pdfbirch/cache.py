@@ -0,0 +1,123 @@
+"""Seeded documents, cached in memory and on disk under a hash of their inputs.
+
+A seeded document is fully determined by its inputs, so it is stored under
+a hash of them: an in-memory LRU of up to PDF_CACHE_MEMORY_BYTES in front of
+a directory of <key>.pdf files capped at PDF_CACHE_DISK_BYTES (oldest files
+are evicted first). Set PDF_CACHE_DIR to '' to keep only the memory tier.
+"""
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from . import layout, render
+from .layout import DEFAULT_DOC_SPEC, TTF_FAMILIES
+from .metrics import log_event
+from .procpool import build_pdf_bytes
+PDF_CACHE_VERSION = 2  # bump when the generator's output changes for a given seed
+PDF_CACHE_MEMORY_BYTES = int(os.getenv('PDF_CACHE_MEMORY_BYTES', str(16 * 1024 * 1024)))
+PDF_CACHE_DIR = os.getenv('PDF_CACHE_DIR', '/tmp/pdfbirch-cache')
+PDF_CACHE_DISK_BYTES = int(os.getenv('PDF_CACHE_DISK_BYTES', str(256 * 1024 * 1024)))
+_pdf_cache = OrderedDict()
+_pdf_cache_bytes = 0
+_pdf_cache_lock = threading.Lock()
+_pdf_cache_stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0}
+_pdf_disk_index = None  # key -> size, oldest first
+_pdf_disk_bytes = 0
+def pdf_cache_key(seed, spec=DEFAULT_DOC_SPEC):
+    """Content address of the document generated for `seed` and `spec`"""
+    ident = [PDF_CACHE_VERSION, render.PDF_ENGINE, layout.PDF_COMPRESS_LEVEL, layout.PDF_XREF_STREAM, seed, list(spec)]
+    # The bytes also depend on which file a TrueType family points at
+    ident += [TTF_FAMILIES[f] for f in spec.fonts if f in TTF_FAMILIES]
+    ident = json.dumps(ident)
+    return hashlib.sha256(ident.encode('utf-8')).hexdigest()
+def _pdf_cache_remember(key, doc):
+    global _pdf_cache_bytes
+    if len(doc) > PDF_CACHE_MEMORY_BYTES:
+        return
+    with _pdf_cache_lock:
+        if key in _pdf_cache:
+            return
+        _pdf_cache[key] = doc
+        _pdf_cache_bytes += len(doc)
+        while _pdf_cache_bytes > PDF_CACHE_MEMORY_BYTES:
+            _, old = _pdf_cache.popitem(last=False)
+            _pdf_cache_bytes -= len(old)
+def _load_disk_index():
+    global _pdf_disk_index, _pdf_disk_bytes
+    entries = []
+    os.makedirs(PDF_CACHE_DIR, exist_ok=True)
+    with os.scandir(PDF_CACHE_DIR) as it:
+        for entry in it:
+            if entry.name.endswith('.pdf'):
+                st = entry.stat()
+                entries.append((st.st_mtime, entry.name[:-4], st.st_size))
+    entries.sort()
+    _pdf_disk_index = OrderedDict((key, size) for _, key, size in entries)
+    _pdf_disk_bytes = sum(size for _, _, size in entries)
+def _disk_cache_read(key):
+    if not PDF_CACHE_DIR:
+        return None
+    with _pdf_cache_lock:
+        if _pdf_disk_index is None:
+            _load_disk_index()
+        if key not in _pdf_disk_index:
+            return None
+        _pdf_disk_index.move_to_end(key)
+    try:
+        with open(os.path.join(PDF_CACHE_DIR, key + '.pdf'), 'rb') as f:
+            return f.read()
+    except OSError:
+        return None
+def _disk_cache_write(key, doc):
+    global _pdf_disk_bytes
+    if not PDF_CACHE_DIR or len(doc) > PDF_CACHE_DISK_BYTES:
+        return
+    path = os.path.join(PDF_CACHE_DIR, key + '.pdf')
+    try:
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, 'wb') as f:
+            f.write(doc)
+        os.replace(tmp, path)
+    except OSError as e:
+        log_event('pdf_cache_write_error', 'error', error=str(e))
+        return
+    with _pdf_cache_lock:
+        if _pdf_disk_index is None:
+            _load_disk_index()
+        elif key not in _pdf_disk_index:
+            _pdf_disk_index[key] = len(doc)
+            _pdf_disk_bytes += len(doc)
+        while _pdf_disk_bytes > PDF_CACHE_DISK_BYTES and _pdf_disk_index:
+            old_key, size = _pdf_disk_index.popitem(last=False)
+            _pdf_disk_bytes -= size
+            try:
+                os.remove(os.path.join(PDF_CACHE_DIR, old_key + '.pdf'))
+            except OSError:
+                pass
+def get_seeded_pdf(seed, spec=DEFAULT_DOC_SPEC, build=None):
+    """Return the deterministic document for `seed`, building it with `build(seed, spec)` only on a cache miss"""
+    key = pdf_cache_key(seed, spec)
+    with _pdf_cache_lock:
+        doc = _pdf_cache.get(key)
+        if doc is not None:
+            _pdf_cache.move_to_end(key)
+            _pdf_cache_stats["memory_hits"] += 1
+            return doc
+    doc = _disk_cache_read(key)
+    with _pdf_cache_lock:
+        _pdf_cache_stats["misses" if doc is None else "disk_hits"] += 1
+    if doc is None:
+        doc = (build or build_pdf_bytes)(seed, spec)
+        _disk_cache_write(key, doc)
+    _pdf_cache_remember(key, doc)
+    return doc
+def pdf_cache_stats():
+    """Return seeded-document cache hit counters and tier sizes"""
+    with _pdf_cache_lock:
+        stats = dict(_pdf_cache_stats)
+        stats["memory_entries"] = len(_pdf_cache)
+        stats["memory_bytes"] = _pdf_cache_bytes
+        stats["disk_entries"] = len(_pdf_disk_index) if _pdf_disk_index is not None else None
+        stats["disk_bytes"] = _pdf_disk_bytes
+    return stats
@@ -0,0 +1,179 @@
+"""Command-line tools that run against the app's generators and settings.
+
+    python -m pdfbirch.cli generate --count 10000 (--out DIR | --tar FILE|-) [--seed S] [--workers N]
+    python -m pdfbirch.cli build-corpus --out corpus.pack [--count 1000] [--workers N]
+
+Run them from the repository root. Both take --pages/--lines/--fonts for
+the document shape. No web server, Firebase project or token is involved:
+documents come from the same render_document() that gen_pdf_content()
+uses, on a pool of --workers processes (default: all cores).
+
+generate writes N documents to a directory or a tar stream ('-' is stdout;
+.tar.gz/.tgz compresses), reporting progress on stderr and docs/s and MB/s
+at the end. With --seed, document i is the one /api/download_batch returns
+for that seed and index, and the output (tar included) is reproducible.
+
+build-corpus packs the documents for PDF_CORPUS_PATH and swaps the pack in
+atomically, so servers pick it up without a restart.
+"""
+import argparse
+import gzip
+import io
+import os
+import random
+import sys
+import tarfile
+import time
+from collections import deque
+from . import procpool
+from .corpus import PDF_CORPUS_PATH, write_corpus
+from .layout import DEFAULT_DOC_SPEC, TTF_FAMILIES, random_pdf_name
+from .render import render_document
+from .spec import request_doc_spec
+_DONE = object()
+def parse_spec(args):
+    """DocSpec from --pages/--lines/--fonts, with the same validation and budget as a request"""
+    body = {key: value for key, value in (('pages', args.pages), ('lines', args.lines), ('fonts', args.fonts))
+            if value is not None}
+    return request_doc_spec(body, 1, {})
+def document_seeds(count, seed=None):
+    # Same per-document seeds as a seeded /api/download_batch
+    return [None if seed is None else f"{seed}/{i}" for i in range(count)]
+def iter_documents(seeds, spec, workers):
+    """Yield one document per seed, in order, rendered on `workers` processes"""
+    if workers <= 1:
+        for seed in seeds:
+            yield render_document(seed, spec)
+        return
+    procpool.PDF_WORKERS = workers
+    # A bounded run doesn't need recycled workers, and respawning costs more than it saves here
+    procpool.PDF_WORKER_MAX_TASKS = 0
+    pool = procpool.get_process_pool()
+    pending = iter(seeds)
+    window = deque()
+    # Keep every worker busy while holding only a few finished documents in memory
+    for seed in pending:
+        window.append(pool.submit(procpool._render_in_worker, seed, spec))
+        if len(window) >= 4 * workers:
+            break
+    while window:
+        doc = procpool._worker_result(window.popleft().result())
+        seed = next(pending, _DONE)  # seeds are None when unseeded
+        if seed is not _DONE:
+            window.append(pool.submit(procpool._render_in_worker, seed, spec))
+        yield doc
+class Progress:
+    """Documents and bytes done so far, redrawn on stderr at most every `interval` seconds"""
+    def __init__(self, total, quiet=False, interval=0.5):
+        self.total = total
+        self.quiet = quiet
+        self.interval = interval
+        self.done = 0
+        self.bytes = 0
+        self.start = self.shown = time.perf_counter()
+    def add(self, size):
+        self.done += 1
+        self.bytes += size
+        now = time.perf_counter()
+        if not self.quiet and (now - self.shown >= self.interval or self.done == self.total):
+            self.shown = now
+            end = '\r' if sys.stderr.isatty() and self.done < self.total else '\n'
+            print(f"{self.done}/{self.total} documents  {self.rates(now)}", end=end, file=sys.stderr, flush=True)
+    def rates(self, now=None):
+        elapsed = max((now or time.perf_counter()) - self.start, 1e-9)
+        return f"{self.done / elapsed:.1f} docs/s  {self.bytes / elapsed / (1024 * 1024):.2f} MB/s"
+    def summary(self):
+        elapsed = time.perf_counter() - self.start
+        return (f"{self.done} documents, {self.bytes / (1024 * 1024):.1f} MB in {elapsed:.2f}s: "
+                f"{self.rates()}")
+class DirectorySink:
+    def __init__(self, path):
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+    def write(self, name, doc):
+        with open(os.path.join(self.path, name), 'wb') as f:
+            f.write(doc)
+    def close(self):
+        pass
+class TarSink:
+    """Append documents to a streamed tar archive; mtime 0 when the output should be reproducible"""
+    def __init__(self, path, reproducible=False):
+        self.mtime = 0 if reproducible else int(time.time())
+        self.file = sys.stdout.buffer if path == '-' else open(path, 'wb')
+        self.gzip = None
+        fileobj = self.file
+        if path.endswith(('.tar.gz', '.tgz')):
+            # tarfile's own 'w|gz' stamps the gzip header with the time and file name
+            self.gzip = fileobj = gzip.GzipFile(filename='', mode='wb', fileobj=self.file, mtime=self.mtime)
+        self.tar = tarfile.open(fileobj=fileobj, mode='w|')
+    def write(self, name, doc):
+        info = tarfile.TarInfo(name)
+        info.size = len(doc)
+        info.mtime = self.mtime
+        info.mode = 0o644
+        self.tar.addfile(info, io.BytesIO(doc))
+    def close(self):
+        self.tar.close()
+        if self.gzip is not None:
+            self.gzip.close()
+        if self.file is sys.stdout.buffer:
+            self.file.flush()
+        else:
+            self.file.close()
+def generate_command(args):
+    if args.count < 1:
+        raise ValueError("--count must be at least 1")
+    spec = parse_spec(args)
+    seeds = document_seeds(args.count, args.seed)
+    sink = DirectorySink(args.out) if args.out else TarSink(args.tar, reproducible=args.seed is not None)
+    progress = Progress(args.count, args.quiet)
+    try:
+        for i, (seed, doc) in enumerate(zip(seeds, iter_documents(seeds, spec, args.workers))):
+            rng = random.Random(seed) if seed is not None else random
+            # The index prefix keeps names unique and in generation order
+            sink.write(f"{i + 1:06d}_{random_pdf_name(rng)}", doc)
+            progress.add(len(doc))
+    finally:
+        sink.close()
+    print(f"generated {progress.summary()}", file=sys.stderr)
+def build_corpus_command(args):
+    if args.count < 1:
+        raise ValueError("--count must be at least 1")
+    spec = parse_spec(args)
+    progress = Progress(args.count, args.quiet)
+    def docs():
+        for doc in iter_documents(document_seeds(args.count), spec, args.workers):
+            progress.add(len(doc))
+            yield doc
+    write_corpus(args.out, docs(), spec)
+    print(f"packed {progress.summary()} into {args.out}", file=sys.stderr)
+def add_spec_arguments(parser):
+    parser.add_argument('--pages', type=int)
+    parser.add_argument('--lines', type=int)
+    parser.add_argument('--fonts', help="comma-separated subset of " + ",".join(DEFAULT_DOC_SPEC.fonts + tuple(TTF_FAMILIES)))
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help="generation processes (default: all cores)")
+    parser.add_argument('--quiet', action='store_true', help="no progress lines, only the summary")
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest='command', required=True)
+    generate = commands.add_parser('generate', help="write documents to a directory or tar stream")
+    output = generate.add_mutually_exclusive_group(required=True)
+    output.add_argument('--out', help="directory to write <n>_<name>.pdf files into")
+    output.add_argument('--tar', help="tar archive to write, or - for stdout")
+    generate.add_argument('--count', type=int, required=True)
+    generate.add_argument('--seed', help="make the documents and their names reproducible")
+    add_spec_arguments(generate)
+    generate.set_defaults(run=generate_command)
+    corpus = commands.add_parser('build-corpus', help="generate documents into a packed corpus for PDF_CORPUS_PATH")
+    corpus.add_argument('--out', default=PDF_CORPUS_PATH or None, required=not PDF_CORPUS_PATH,
+                        help="pack to write (default PDF_CORPUS_PATH)")
+    corpus.add_argument('--count', type=int, default=1000)
+    add_spec_arguments(corpus)
+    corpus.set_defaults(run=build_corpus_command)
+    args = parser.parse_args()
+    try:
+        args.run(args)
+    except ValueError as e:
+        parser.error(str(e))
+if __name__ == '__main__':
+    main()
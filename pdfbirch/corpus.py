@@ -0,0 +1,178 @@
+"""Prebuilt packs of unseeded documents, mapped into memory and served without a copy.
+
+For fixture-style traffic, PDF_CORPUS_PATH names a prebuilt pack of
+unseeded documents (`python -m pdfbirch.cli build-corpus`). Layout: magic, a
+JSON header with the document spec, the documents back to back, an array of
+count + 1 little-endian u64 offsets, and a trailer pointing at that array.
+The file is mmap'd once; a download that matches the pack's spec picks a
+random document and, when the server provides wsgi.file_wrapper (gunicorn,
+uWSGI), hands it a file descriptor positioned at the document so the bytes
+go out with sendfile(). Otherwise the body is a memoryview of the mapping,
+written from the page cache without a copy into the heap (the Werkzeug dev
+server insists on bytes, so it alone gets a copy).
+Rebuilds write a temporary file and os.replace() it over the old one;
+servers notice the new inode within PDF_CORPUS_CHECK_INTERVAL seconds and
+responses already under way keep reading the old file.
+"""
+import io
+import json
+import mmap
+import os
+import random
+import struct
+import sys
+import threading
+import time
+from array import array
+from . import render
+from .layout import DEFAULT_DOC_SPEC, DocSpec
+from .metrics import log_event
+from .render import render_document
+PDF_CORPUS_PATH = os.getenv('PDF_CORPUS_PATH', '')
+PDF_CORPUS_CHECK_INTERVAL = float(os.getenv('PDF_CORPUS_CHECK_INTERVAL', '5'))
+_CORPUS_MAGIC = b"PDFBPACK"
+_CORPUS_TRAILER = struct.Struct('<QQ8s')  # index offset, document count, magic
+_corpus = None
+_corpus_checked_at = float('-inf')
+_corpus_lock = threading.Lock()
+_corpus_stats = {"served": 0, "sendfile": 0, "reloads": 0}
+class PackedCorpus:
+    """A read-only mmap of a corpus pack with its offset index"""
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            st = os.fstat(f.fileno())
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.path = path
+        self.inode = (st.st_dev, st.st_ino)
+        mm = self.mm
+        if len(mm) < len(_CORPUS_MAGIC) + _CORPUS_TRAILER.size or mm[:len(_CORPUS_MAGIC)] != _CORPUS_MAGIC:
+            raise ValueError(f"{path} is not a corpus pack")
+        index_at, count, magic = _CORPUS_TRAILER.unpack_from(mm, len(mm) - _CORPUS_TRAILER.size)
+        if magic != _CORPUS_MAGIC or index_at + 8 * (count + 1) != len(mm) - _CORPUS_TRAILER.size:
+            raise ValueError(f"{path} has a damaged trailer")
+        self.offsets = array('Q', mm[index_at:index_at + 8 * (count + 1)])
+        if sys.byteorder == 'big':
+            self.offsets.byteswap()
+        meta_len, = struct.unpack_from('<I', mm, len(_CORPUS_MAGIC))
+        start = len(_CORPUS_MAGIC) + 4
+        self.meta = json.loads(mm[start:start + meta_len])
+        spec = self.meta['spec']
+        self.spec = DocSpec(spec['pages'], spec['lines'], tuple(spec['fonts']), spec['target_bytes'])
+    def __len__(self):
+        return len(self.offsets) - 1
+    def span(self, i):
+        return self.offsets[i], self.offsets[i + 1] - self.offsets[i]
+    def document(self, i):
+        """Document i as a memoryview of the mapping; it keeps the mapping open while alive"""
+        return memoryview(self.mm)[self.offsets[i]:self.offsets[i + 1]]
+    def open_document(self, i):
+        """Document i as a file of its own, or None if the pack was replaced since it was mapped"""
+        fd = os.open(self.path, os.O_RDONLY)
+        st = os.fstat(fd)
+        if (st.st_dev, st.st_ino) != self.inode:
+            os.close(fd)
+            return None
+        start, length = self.span(i)
+        return _CorpusFile(fd, start, length)
+class _CorpusFile(io.RawIOBase):
+    """One document of a pack: an own descriptor positioned at its start, for sendfile-capable file wrappers"""
+    def __init__(self, fd, start, length):
+        self.fd = fd
+        self.remaining = length
+        os.lseek(fd, start, os.SEEK_SET)
+    def fileno(self):
+        return self.fd
+    def readable(self):
+        return True
+    def readinto(self, b):
+        data = os.read(self.fd, min(len(b), self.remaining))
+        b[:len(data)] = data
+        self.remaining -= len(data)
+        return len(data)
+    def close(self):
+        if not self.closed:
+            os.close(self.fd)
+        super().close()
+def write_corpus(path, docs, spec=DEFAULT_DOC_SPEC):
+    """Pack the documents from `docs` into a new corpus and atomically swap it in at `path`"""
+    meta = json.dumps({"version": 1, "engine": render.PDF_ENGINE, "created": time.time(), "spec": spec._asdict()}).encode('utf-8')
+    tmp = f"{path}.{os.getpid()}.tmp"
+    offsets = array('Q')
+    try:
+        with open(tmp, 'wb') as f:
+            f.write(_CORPUS_MAGIC + struct.pack('<I', len(meta)) + meta)
+            pos = f.tell()
+            for doc in docs:
+                offsets.append(pos)
+                f.write(doc)
+                pos += len(doc)
+            offsets.append(pos)
+            count = len(offsets) - 1
+            if sys.byteorder == 'big':
+                offsets.byteswap()
+            f.write(offsets.tobytes())
+            f.write(_CORPUS_TRAILER.pack(pos, count, _CORPUS_MAGIC))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+        raise
+    # Make the rename itself durable
+    dir_fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    try:
+        os.fsync(dir_fd)
+    finally:
+        os.close(dir_fd)
+    return count, pos
+def build_corpus(path, count, spec=DEFAULT_DOC_SPEC):
+    """Generate `count` unseeded documents with the configured engine and pack them at `path`"""
+    return write_corpus(path, (render_document(None, spec) for _ in range(count)), spec)
+def get_corpus():
+    """The current corpus pack, reopened after a rebuild; None when not configured or unreadable"""
+    global _corpus, _corpus_checked_at
+    if not PDF_CORPUS_PATH:
+        return None
+    now = time.monotonic()
+    if now - _corpus_checked_at < PDF_CORPUS_CHECK_INTERVAL:
+        return _corpus
+    with _corpus_lock:
+        if now - _corpus_checked_at < PDF_CORPUS_CHECK_INTERVAL:
+            return _corpus
+        _corpus_checked_at = now
+        try:
+            st = os.stat(PDF_CORPUS_PATH)
+            if _corpus is None or (st.st_dev, st.st_ino) != _corpus.inode:
+                # The old mapping closes once the last response using it is done
+                _corpus = PackedCorpus(PDF_CORPUS_PATH)
+                _corpus_stats["reloads"] += 1
+                log_event('corpus_loaded', path=PDF_CORPUS_PATH, documents=len(_corpus), bytes=len(_corpus.mm))
+        except (OSError, ValueError) as e:
+            log_event('corpus_load_error', 'error', path=PDF_CORPUS_PATH, error=str(e))
+    return _corpus
+def random_corpus_document(corpus):
+    """A random document of `corpus` as a memoryview, for servers that can't sendfile"""
+    with _corpus_lock:
+        _corpus_stats["served"] += 1
+    return corpus.document(random.randrange(len(corpus)))
+def open_random_document(corpus):
+    """A random document of `corpus` as (file, length) for a sendfile-capable file wrapper; None if the pack was replaced"""
+    i = random.randrange(len(corpus))
+    f = corpus.open_document(i)
+    if f is None:
+        return None
+    with _corpus_lock:
+        _corpus_stats["served"] += 1
+        _corpus_stats["sendfile"] += 1
+    return f, corpus.span(i)[1]
+def corpus_stats():
+    """Return corpus size and how its documents were served"""
+    corpus = _corpus
+    with _corpus_lock:
+        stats = dict(_corpus_stats)
+    stats["documents"] = len(corpus) if corpus is not None else 0
+    stats["bytes"] = len(corpus.mm) if corpus is not None else 0
+    return stats
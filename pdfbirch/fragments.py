@@ -0,0 +1,130 @@
+"""Unseeded documents stitched from a library of pages laid out earlier.
+
+Unseeded documents are random filler, so their pages need not be new. With
+PDF_FRAGMENTS > 0, every requested page that gets laid out is also kept as
+a fragment: its finished content stream objects (one per physical page,
+compressed, minus the object number). Resources are shared through the
+page tree, so nothing else refers to them. There is one library of up to
+PDF_FRAGMENTS fragments per (lines, fonts, compression), and an unseeded
+document is stitched from a random sample of it; only the object numbers,
+page objects, page tree and xref are written per document.
+
+PDF_FRAGMENT_FRESH of each document's pages are still laid out new and
+replace a random library entry, so the library keeps turning over. While a
+library is filling, documents contribute as many new pages as it has room
+for. Past PDF_FRAGMENT_BYTES the least recently used libraries are trimmed.
+Seeded documents always take the full layout path so they stay reproducible.
+"""
+import math
+import os
+import random
+import threading
+import time
+from collections import OrderedDict
+from . import layout
+from .layout import _PDF_HEAD, _PDF_HEAD_OFFSETS, _content_tail, _layout_pages, _page_objects, _pdf_trailer
+from .metrics import observe
+PDF_FRAGMENTS = int(os.getenv('PDF_FRAGMENTS', '0'))
+PDF_FRAGMENT_FRESH = float(os.getenv('PDF_FRAGMENT_FRESH', '0.1'))
+PDF_FRAGMENT_BYTES = int(os.getenv('PDF_FRAGMENT_BYTES', str(64 * 1024 * 1024)))
+_fragment_libraries = OrderedDict()  # (lines, fonts, level) -> list of fragments
+_fragment_bytes = 0
+_fragment_lock = threading.Lock()
+_fragment_stats = {"reused": 0, "fresh": 0, "evictions": 0}
+def _fragment_size(fragment):
+    return sum(map(len, fragment))
+def _layout_fragments(count, lines, fonts, level):
+    """Lay out `count` new requested pages, yielding each as a tuple of content object tails"""
+    finished = []
+    tails = []
+    for stream in _layout_pages(count, lines, None, fonts, finished.append):
+        tails.append(_content_tail(stream, level))
+        # progress fires just before the last stream of each requested page
+        if finished:
+            finished.clear()
+            yield tuple(tails)
+            tails = []
+def _fragment_remember(key, fragment):
+    global _fragment_bytes
+    size = _fragment_size(fragment)
+    with _fragment_lock:
+        library = _fragment_libraries.get(key)
+        if library is None:
+            library = _fragment_libraries[key] = []
+        if len(library) < PDF_FRAGMENTS:
+            library.append(fragment)
+        else:
+            slot = random.randrange(len(library))
+            size -= _fragment_size(library[slot])
+            library[slot] = fragment
+        _fragment_bytes += size
+        _fragment_stats["fresh"] += 1
+        # Trim from the least recently used library, dropping it once empty
+        while _fragment_bytes > PDF_FRAGMENT_BYTES and _fragment_libraries:
+            lru_key, lru = next(iter(_fragment_libraries.items()))
+            if lru:
+                _fragment_bytes -= _fragment_size(lru.pop())
+                _fragment_stats["evictions"] += 1
+            else:
+                del _fragment_libraries[lru_key]
+def compose_pdf(pages=10, lines=25, fonts=None, target_bytes=None, compress=None, progress=None):
+    """Yield an unseeded PDF like iter_pdf, stitching most pages from the fragment library"""
+    level = layout.PDF_COMPRESS_LEVEL if compress is None else compress
+    key = (lines, fonts, level)
+    with _fragment_lock:
+        library = _fragment_libraries.get(key)
+        if library is not None:
+            _fragment_libraries.move_to_end(key)
+        # Sample from a snapshot; fresh fragments may replace entries meanwhile
+        stored = list(library or ())
+    fresh = pages if not stored else min(pages, max(math.ceil(pages * PDF_FRAGMENT_FRESH), PDF_FRAGMENTS - len(stored)))
+    fresh_at = set(random.sample(range(pages), fresh))
+    new = _layout_fragments(fresh, lines, fonts, level)
+    yield _PDF_HEAD
+    pos = len(_PDF_HEAD)
+    offsets = list(_PDF_HEAD_OFFSETS)
+    num = len(offsets)
+    kids = []
+    layout_s = compose_s = 0.0
+    reused = 0
+    for i in range(pages):
+        t = time.perf_counter()
+        if i in fresh_at:
+            fragment = next(new)
+            t1 = time.perf_counter()
+            layout_s += t1 - t
+            _fragment_remember(key, fragment)
+        else:
+            t1 = t
+            fragment = random.choice(stored)
+            reused += 1
+        chunks = []
+        for tail in fragment:
+            content_len, chunk = _page_objects(num, tail)
+            offsets.append(pos)
+            offsets.append(pos + content_len)
+            pos += len(chunk)
+            kids.append(b"%d 0 R" % (num + 1))
+            num += 2
+            chunks.append(chunk)
+        compose_s += time.perf_counter() - t1
+        if progress is not None:
+            progress(i + 1)
+        yield b"".join(chunks)
+        if target_bytes and pos >= target_bytes:
+            break
+    t1 = time.perf_counter()
+    chunk = _pdf_trailer(num, offsets, kids, pos, level)
+    with _fragment_lock:
+        _fragment_stats["reused"] += reused
+    observe('pdfbirch_stage_seconds', layout_s, stage='layout')
+    observe('pdfbirch_stage_seconds', compose_s + time.perf_counter() - t1, stage='compose')
+    yield chunk
+def fragment_stats():
+    """Return fragment library size and reuse counters"""
+    with _fragment_lock:
+        stats = dict(_fragment_stats)
+        stats["libraries"] = len(_fragment_libraries)
+        stats["fragments"] = sum(map(len, _fragment_libraries.values()))
+        stats["bytes"] = _fragment_bytes
+    return stats
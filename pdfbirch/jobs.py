@@ -0,0 +1,246 @@
+"""Document builds queued in the background, with progress and a result to fetch later.
+
+POST /api/jobs queues a document and answers at once with a job ID. The
+build runs on a small thread pool, page by page, so GET /api/jobs/<id> can
+report real progress; the finished document stays at /api/jobs/<id>/result
+for JOB_TTL seconds. JOB_STORE picks where jobs live: 'memory' (this process
+only) or 'sqlite' (the file at JOB_STORE_PATH, shared by every worker
+process on the host). A running job pushes its expiry forward on every
+progress write, so jobs orphaned by a dead process expire on their own.
+Finished documents held by a store are capped at JOB_MAX_RESULT_BYTES in
+total: the oldest finished jobs are dropped to make room for a new one.
+Expired jobs are purged on every create and read, and every
+JOB_PURGE_INTERVAL seconds by a background thread.
+"""
+import os
+import random
+import secrets
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from . import render
+from .cache import get_seeded_pdf
+from .layout import DEFAULT_DOC_SPEC, random_pdf_name
+from .metrics import log_event, span
+from .procpool import build_pdf_bytes
+from .render import iter_pdf
+from .usage import settle_usage
+JOB_STORE = os.getenv('JOB_STORE', 'memory')
+JOB_STORE_PATH = os.getenv('JOB_STORE_PATH', '/tmp/pdfbirch-jobs.sqlite3')
+JOB_WORKERS = int(os.getenv('JOB_WORKERS', '2'))
+JOB_MAX_PENDING = int(os.getenv('JOB_MAX_PENDING', '32'))
+JOB_TTL = int(os.getenv('JOB_TTL', '600'))
+JOB_MAX_RESULT_BYTES = int(os.getenv('JOB_MAX_RESULT_BYTES', str(128 * 1024 * 1024)))
+JOB_PURGE_INTERVAL = 30
+JOB_PROGRESS_INTERVAL = 0.25  # seconds between progress writes to the store
+JOB_FIELDS = ('id', 'owner', 'status', 'name', 'pages_done', 'pages_total', 'bytes_done', 'target_bytes',
+              'error', 'created_at', 'expires_at')
+_job_store = None
+_job_executor = ThreadPoolExecutor(max_workers=JOB_WORKERS, thread_name_prefix='pdf-job')
+_jobs_lock = threading.Lock()
+_jobs_pending = 0
+_job_purge_thread = None
+class MemoryJobStore:
+    """Jobs and finished documents in dicts, visible to this process only"""
+    def __init__(self):
+        self.jobs = {}
+        self.results = {}  # job id -> document, oldest first
+        self.result_bytes = 0
+        self.lock = threading.Lock()
+    def create(self, job):
+        with self.lock:
+            self.jobs[job['id']] = dict(job)
+    def update(self, job_id, **fields):
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is not None:
+                job.update(fields)
+    def finish(self, job_id, doc, **fields):
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is not None:
+                while self.results and self.result_bytes + len(doc) > JOB_MAX_RESULT_BYTES:
+                    evicted = next(iter(self.results))
+                    self._drop(evicted)
+                    log_event('job_result_evicted', job_id=evicted)
+                job.update(fields, status='done')
+                self.results[job_id] = doc
+                self.result_bytes += len(doc)
+    def get(self, job_id):
+        with self.lock:
+            job = self.jobs.get(job_id)
+            return dict(job) if job is not None else None
+    def result(self, job_id):
+        with self.lock:
+            return self.results.get(job_id)
+    def _drop(self, job_id):
+        self.jobs.pop(job_id, None)
+        doc = self.results.pop(job_id, None)
+        if doc is not None:
+            self.result_bytes -= len(doc)
+    def purge(self, now):
+        with self.lock:
+            for job_id in [job_id for job_id, job in self.jobs.items() if job['expires_at'] <= now]:
+                self._drop(job_id)
+class SqliteJobStore:
+    """Jobs and finished documents in a SQLite file shared by all processes on the host"""
+    def __init__(self, path):
+        import sqlite3
+        self.db = sqlite3.connect(path, timeout=10, isolation_level=None, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS jobs (id TEXT PRIMARY KEY, owner TEXT, status TEXT, name TEXT, "
+                        "pages_done INTEGER, pages_total INTEGER, bytes_done INTEGER, target_bytes INTEGER, "
+                        "error TEXT, created_at REAL, expires_at REAL, result BLOB)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS jobs_expires_at ON jobs (expires_at)")
+        self.lock = threading.Lock()
+    def create(self, job):
+        with self.lock:
+            self.db.execute(f"INSERT INTO jobs ({', '.join(JOB_FIELDS)}) VALUES ({', '.join('?' * len(JOB_FIELDS))})",
+                            [job[field] for field in JOB_FIELDS])
+    def update(self, job_id, **fields):
+        # Column names only ever come from this module, never from a request
+        with self.lock:
+            self.db.execute(f"UPDATE jobs SET {', '.join(f'{k} = ?' for k in fields)} WHERE id = ?",
+                            [*fields.values(), job_id])
+    def finish(self, job_id, doc, **fields):
+        with self.lock, self.db:
+            # One transaction, so processes sharing the file can't overshoot the cap together
+            self.db.execute("BEGIN IMMEDIATE")
+            # Make room among the other finished jobs, oldest first
+            total = self.db.execute("SELECT COALESCE(SUM(LENGTH(result)), 0) FROM jobs").fetchone()[0]
+            finished = self.db.execute("SELECT id, LENGTH(result) FROM jobs WHERE result IS NOT NULL AND id != ? "
+                                       "ORDER BY expires_at", (job_id,)).fetchall()
+            for evicted, size in finished:
+                if total + len(doc) <= JOB_MAX_RESULT_BYTES:
+                    break
+                self.db.execute("DELETE FROM jobs WHERE id = ?", (evicted,))
+                total -= size
+                log_event('job_result_evicted', job_id=evicted)
+            fields = dict(fields, result=doc, status='done')
+            self.db.execute(f"UPDATE jobs SET {', '.join(f'{k} = ?' for k in fields)} WHERE id = ?",
+                            [*fields.values(), job_id])
+    def get(self, job_id):
+        with self.lock:
+            row = self.db.execute(f"SELECT {', '.join(JOB_FIELDS)} FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return dict(zip(JOB_FIELDS, row)) if row else None
+    def result(self, job_id):
+        with self.lock:
+            row = self.db.execute("SELECT result FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return row[0] if row else None
+    def purge(self, now):
+        with self.lock:
+            self.db.execute("DELETE FROM jobs WHERE expires_at <= ?", (now,))
+def get_job_store():
+    """Open the configured job store on first use, with its purge thread"""
+    global _job_store, _job_purge_thread
+    with _jobs_lock:
+        if _job_store is None:
+            _job_store = SqliteJobStore(JOB_STORE_PATH) if JOB_STORE == 'sqlite' else MemoryJobStore()
+            _job_purge_thread = threading.Thread(target=_job_purger, args=(_job_store,), name='job-purge', daemon=True)
+            _job_purge_thread.start()
+        return _job_store
+def _job_purger(store):
+    # Expired results are freed even when no one creates or reads a job
+    while True:
+        time.sleep(JOB_PURGE_INTERVAL)
+        try:
+            store.purge(time.time())
+        except Exception as e:
+            log_event('job_purge_error', 'error', exc_info=True, error=str(e))
+def job_view(job):
+    """The job as shown to its owner, with the URLs to poll and download it"""
+    view = {k: job[k] for k in JOB_FIELDS if k != 'owner'}
+    view['status_url'] = f"/api/jobs/{job['id']}"
+    if job['status'] == 'done':
+        view['result_url'] = f"/api/jobs/{job['id']}/result"
+    return view
+def create_job(email, seed=None, spec=DEFAULT_DOC_SPEC):
+    """Record a queued job for `email` and start building it in the background"""
+    now = time.time()
+    store = get_job_store()
+    store.purge(now)
+    job = {
+        'id': secrets.token_urlsafe(16),
+        'owner': email,
+        'status': 'queued',
+        'name': random_pdf_name(random.Random(seed)) if seed is not None else random_pdf_name(),
+        'pages_done': 0,
+        # With a byte target the page count is only known once the target is reached
+        'pages_total': None if spec.target_bytes else spec.pages,
+        'bytes_done': 0,
+        'target_bytes': spec.target_bytes,
+        'error': None,
+        'created_at': now,
+        'expires_at': now + JOB_TTL,
+    }
+    store.create(job)
+    _job_executor.submit(_run_job, job['id'], email, seed, spec)
+    return job
+def queue_job(email, seed=None, spec=DEFAULT_DOC_SPEC):
+    """create_job unless JOB_MAX_PENDING jobs are already waiting; None when full"""
+    global _jobs_pending
+    with _jobs_lock:
+        if _jobs_pending >= JOB_MAX_PENDING:
+            return None
+        _jobs_pending += 1
+    try:
+        return create_job(email, seed, spec)
+    except Exception:
+        with _jobs_lock:
+            _jobs_pending -= 1
+        raise
+def jobs_pending():
+    """Jobs queued or running in this process"""
+    return _jobs_pending
+def get_job(job_id, email):
+    """The job if it exists, belongs to `email` and has not expired, else None"""
+    store = get_job_store()
+    store.purge(time.time())
+    job = store.get(job_id)
+    if job is None or job['owner'] != email or job['expires_at'] <= time.time():
+        return None
+    return job
+def _build_with_progress(store, job_id, seed, spec):
+    """Build a document page by page, writing pages done to the job store as it goes"""
+    if render.PDF_ENGINE == 'fpdf':
+        # FPDF only produces the document at the end, so there is nothing to report before that
+        return build_pdf_bytes(seed, spec)
+    chunks = []
+    size = 0
+    pages_done = [0]
+    def progress(n):
+        pages_done[0] = n
+    last = time.monotonic()
+    with span('render'):
+        for chunk in iter_pdf(*spec, seed=seed, progress=progress):
+            chunks.append(chunk)
+            size += len(chunk)
+            now = time.monotonic()
+            if now - last >= JOB_PROGRESS_INTERVAL:
+                last = now
+                store.update(job_id, pages_done=pages_done[0], bytes_done=size, expires_at=time.time() + JOB_TTL)
+        doc = b"".join(chunks)
+    # A byte target can stop short of the page cap, so the total is only known now
+    store.update(job_id, pages_done=pages_done[0], pages_total=pages_done[0])
+    return doc
+def _run_job(job_id, email, seed, spec):
+    global _jobs_pending
+    store = get_job_store()
+    try:
+        store.update(job_id, status='running', expires_at=time.time() + JOB_TTL)
+        build = lambda s, sp: _build_with_progress(store, job_id, s, sp)
+        doc = get_seeded_pdf(seed, spec, build) if seed is not None else build(None, spec)
+        if len(doc) > JOB_MAX_RESULT_BYTES:
+            raise ValueError(f"Document is {len(doc)} bytes, more than the {JOB_MAX_RESULT_BYTES} bytes kept for jobs")
+        fields = {} if spec.target_bytes else {'pages_done': spec.pages}
+        store.finish(job_id, doc, bytes_done=len(doc), expires_at=time.time() + JOB_TTL, **fields)
+        settle_usage(email)
+        log_event('job_done', job_id=job_id, bytes=len(doc))
+    except Exception as e:
+        log_event('job_error', 'error', exc_info=True, job_id=job_id, error=str(e))
+        # Hand the download back before the failure is visible to the owner
+        settle_usage(email, delivered=False)
+        store.update(job_id, status='failed', error=str(e), expires_at=time.time() + JOB_TTL)
+    finally:
+        with _jobs_lock:
+            _jobs_pending -= 1
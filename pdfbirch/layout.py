@@ -0,0 +1,390 @@
+"""The template engine's building blocks: fixed PDF objects, line wrapping, fonts and random text.
+
+A document is laid out by _layout_pages() into one content stream per page
+and assembled around the precompiled template head by render.iter_pdf() or,
+from stored pages, by fragments.compose_pdf().
+"""
+import operator
+import os
+import random
+import string
+import struct
+import threading
+import zlib
+from collections import namedtuple
+from . import ttf
+from .metrics import log_event, span
+PREFIXES = ["Research", "Analysis", "Draft", "Final", "Project", "Report", "Case_Study", "Thesis"]
+WORDS = ["strategy", "growth", "market", "value", "user", "product", "system", "data", "cloud", "AI", "project", "scale"]
+def random_pdf_name(rng=random):
+    """Random download filename like Draft_Report_X8N4.pdf"""
+    return f"{rng.choice(PREFIXES)}_{rng.choice(PREFIXES)}_{''.join(rng.choices(string.ascii_uppercase+string.digits, k=4))}.pdf"
+# Document shape. With target_bytes set, pages is only an upper bound and
+# generation stops as soon as the output reaches that size.
+DocSpec = namedtuple('DocSpec', ['pages', 'lines', 'fonts', 'target_bytes'])
+DEFAULT_DOC_SPEC = DocSpec(10, 25, ('Arial', 'Times', 'Courier'), None)
+# --- TEMPLATE PDF ENGINE ---
+# Everything that does not depend on the random text (header, catalog, font
+# resources) is serialized once at import. A document is then just its page
+# content streams plus the page tree, xref table and trailer written directly.
+# Layout mirrors what FPDF does for A4 with 1cm margins and auto page break at
+# 15mm, so output looks the same as gen_pdf_content_fpdf().
+# zlib level for page content streams (0 disables compression), and whether the
+# cross-reference table is written as a compact PDF 1.5 xref stream
+PDF_COMPRESS_LEVEL = int(os.getenv('PDF_COMPRESS_LEVEL', '6'))
+PDF_XREF_STREAM = os.getenv('PDF_XREF_STREAM', '1') == '1'
+PDF_K = 72 / 25.4  # points per mm
+PDF_PAGE_W, PDF_PAGE_H = 210.0, 297.0
+PDF_MARGIN = 28.35 / PDF_K  # FPDF's default 1cm margin, defined in points
+PDF_CELL_MARGIN = PDF_MARGIN / 10
+PDF_BREAK_TRIGGER = PDF_PAGE_H - 15.0
+PDF_FAMILIES = ['Arial', 'Times', 'Courier']
+PDF_STYLES = ['', 'B', 'I', 'BI']
+PDF_BASE_FONTS = {
+    ('Arial', ''): 'Helvetica', ('Arial', 'B'): 'Helvetica-Bold',
+    ('Arial', 'I'): 'Helvetica-Oblique', ('Arial', 'BI'): 'Helvetica-BoldOblique',
+    ('Times', ''): 'Times-Roman', ('Times', 'B'): 'Times-Bold',
+    ('Times', 'I'): 'Times-Italic', ('Times', 'BI'): 'Times-BoldItalic',
+    ('Courier', ''): 'Courier', ('Courier', 'B'): 'Courier-Bold',
+    ('Courier', 'I'): 'Courier-Oblique', ('Courier', 'BI'): 'Courier-BoldOblique',
+}
+def _compile_pdf_template():
+    """Serialize the fixed part of every document: header, catalog, resources and fonts"""
+    from fpdf.fonts import fpdf_charwidths
+    fonts = {}
+    # Object 1 is the catalog, 2 the page tree (written last), 3 the shared
+    # resource dictionary, 4.. the core fonts; page objects follow the fonts
+    objects = [b"<< /Type /Catalog /Pages 2 0 R >>", None]
+    font_refs = []
+    for i, (key, base_font) in enumerate(PDF_BASE_FONTS.items()):
+        family, style = key
+        metrics_name = {'Arial': 'helvetica', 'Times': 'times', 'Courier': 'courier'}[family] + style
+        fonts[key] = (f"/F{i + 1}", fpdf_charwidths[metrics_name])
+        font_refs.append(f"/F{i + 1} {i + 4} 0 R")
+    font_refs = " ".join(font_refs).encode('latin-1')
+    objects.append(b"<< /ProcSet [/PDF /Text] /Font << %s >> >>" % font_refs)
+    for base_font in PDF_BASE_FONTS.values():
+        objects.append(f"<< /Type /Font /Subtype /Type1 /BaseFont /{base_font} /Encoding /WinAnsiEncoding >>".encode('latin-1'))
+    head = bytearray(b"%PDF-1.5\n%\xe2\xe3\xcf\xd3\n")
+    offsets = [0] * (len(objects) + 1)
+    for num, body in enumerate(objects, start=1):
+        if body is None:
+            continue
+        offsets[num] = len(head)
+        head += b"%d 0 obj\n%s\nendobj\n" % (num, body)
+    return bytes(head), offsets, fonts, font_refs
+_PDF_HEAD, _PDF_HEAD_OFFSETS, _PDF_FONTS, _PDF_FONT_REFS = _compile_pdf_template()
+def _string_width(text, cw):
+    return sum(map(cw.__getitem__, text))
+# --- LINE WRAPPING ---
+# Sentences are built from the fixed WORDS vocabulary, so word widths come
+# from a per-font table instead of being summed character by character on
+# every line. Widths are in font units (1/1000 of the font size), so one
+# table per (family, style) covers every size; the size only scales the wrap
+# limit. Each table is prefilled with every form a word takes in a sentence
+# (lower case, capitalized, with and without the final period), and any
+# other word is measured once on first use.
+class _WidthTable(dict):
+    def __init__(self, cw):
+        self.cw = cw
+    def __missing__(self, word):
+        width = self[word] = _string_width(word, self.cw)
+        return width
+def _build_width_table(cw, words=WORDS):
+    table = _WidthTable(cw)
+    for word in words:
+        for form in (word.lower(), word.capitalize()):
+            table[form] = _string_width(form, cw)
+            table[form + '.'] = _string_width(form + '.', cw)
+    table[' '] = cw[' ']
+    return table
+WORD_WIDTHS = {key: _build_width_table(cw) for key, (_, cw) in _PDF_FONTS.items()}
+def wrap_words(words, widths, wmax):
+    """Split words into rows no wider than wmax, breaking exactly where FPDF's multi_cell does"""
+    space = widths[' ']
+    word_widths = list(map(widths.__getitem__, words))
+    if sum(word_widths) + space * (len(words) - 1) <= wmax:
+        return [" ".join(words)]
+    # multi_cell measures the space after a word too, so a word moves down
+    # once row + space + word no longer fits. Like the template layout this
+    # never splits inside a word; no WORDS entry comes close to a full row.
+    rows = []
+    start = 0
+    row_w = -space
+    for i, ww in enumerate(word_widths):
+        if i > start and row_w + space + ww > wmax:
+            rows.append(" ".join(words[start:i]))
+            start = i
+            row_w = -space
+        row_w += space + ww
+    rows.append(" ".join(words[start:]))
+    return rows
+def multi_cell_fast(pdf, w, h, txt, widths):
+    """pdf.multi_cell(w, h, txt, align='L') for one paragraph, wrapped with a width table"""
+    if w == 0:
+        w = pdf.w - pdf.r_margin - pdf.x
+    wmax = (w - 2 * pdf.c_margin) * 1000.0 / pdf.font_size
+    for row in wrap_words(txt.split(' '), widths, wmax):
+        pdf.cell(w, h, row, 0, 2, 'L', 0)
+    pdf.x = pdf.l_margin
+# --- TRUETYPE FONTS ---
+# The core fonts only cover WinAnsi, so non-Latin text needs an embedded
+# font. PDF_TTF_FONTS lists TrueType families as Family=path pairs (DejaVu
+# Sans by default, when installed); a family is chosen through `fonts` like
+# the core ones, and its lines are written in one of the UNICODE_WORDS
+# languages instead of English. Each file is parsed once per process into a
+# ttf.TrueTypeFont, which builds the embedded subsets (see ttf.py). Text is
+# shown through Identity-H with each CID equal to the font's own glyph id
+# (CIDToGIDMap /Identity), so the bytes for a seed never depend on what the
+# process rendered before. Rows are written as escaped two-byte literal
+# strings (half the size of hex), each word translated once per process.
+# TrueType lines only ever show _TTF_CHARS, so every document embeds the same
+# subset of those glyphs: it is built once per family and compression level
+# (and kept in the font's LRU of PDF_TTF_SUBSET_CACHE), and a document only
+# writes the font objects around it.
+PDF_TTF_FONTS = os.getenv('PDF_TTF_FONTS', 'DejaVu=/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf')
+PDF_TTF_SUBSET_CACHE = int(os.getenv('PDF_TTF_SUBSET_CACHE', '64'))
+# WORDS in other languages, in the same order
+UNICODE_WORDS = [
+    ["στρατηγική", "ανάπτυξη", "αγορά", "αξία", "χρήστης", "προϊόν", "σύστημα", "δεδομένα", "νέφος", "νοημοσύνη", "έργο", "κλίμακα"],
+    ["стратегия", "рост", "рынок", "ценность", "пользователь", "продукт", "система", "данные", "облако", "интеллект", "проект", "масштаб"],
+    ["стратегія", "зростання", "ринок", "цінність", "користувач", "продукт", "система", "дані", "хмара", "інтелект", "проєкт", "масштаб"],
+    ["strategia", "wzrost", "rynek", "wartość", "użytkownik", "produkt", "system", "dane", "chmura", "inteligencja", "projekt", "skala"],
+    ["strategie", "růst", "trh", "hodnota", "uživatel", "produkt", "systém", "data", "oblak", "inteligence", "projekt", "měřítko"],
+    ["strateji", "büyüme", "pazar", "değer", "kullanıcı", "ürün", "sistem", "veri", "bulut", "zekâ", "proje", "ölçek"],
+    ["ռազմավարություն", "աճ", "շուկա", "արժեք", "օգտատեր", "արտադրանք", "համակարգ", "տվյալներ", "ամպ", "բանականություն", "նախագիծ", "մասշտաբ"],
+]
+# Every character synth_lines can put on a TrueType line: the words, each
+# capitalized (a line starts with one), the separating spaces and the final '.'
+_TTF_CHARS = frozenset(''.join(word + word.capitalize() for words in UNICODE_WORDS for word in words) + ' .')
+def _parse_ttf_families(value):
+    families = {}
+    for item in filter(None, (part.strip() for part in value.split(','))):
+        family, _, path = item.partition('=')
+        family, path = family.strip(), path.strip()
+        if not family.isalnum() or family in PDF_FAMILIES or not path:
+            log_event('ttf_font_invalid', 'warning', entry=item)
+        elif not os.path.exists(path):
+            log_event('ttf_font_missing', 'warning', family=family, path=path)
+        else:
+            families[family] = path
+    return families
+TTF_FAMILIES = _parse_ttf_families(PDF_TTF_FONTS)
+_TTF_FONT_NAMES = {family: f"/T{i + 1}" for i, family in enumerate(TTF_FAMILIES)}
+_ttf_fonts = {}
+_ttf_lock = threading.Lock()
+def get_ttf_font(family):
+    """The parsed TrueTypeFont for a PDF_TTF_FONTS family, loaded on first use in this process"""
+    font = _ttf_fonts.get(family)
+    if font is None:
+        with _ttf_lock:
+            font = _ttf_fonts.get(family)
+            if font is None:
+                with span('ttf_load'):
+                    font = ttf.TrueTypeFont(family, TTF_FAMILIES[family], PDF_TTF_SUBSET_CACHE)
+                WORD_WIDTHS[(family, '')] = _build_width_table(
+                    font.char_widths, [word for words in UNICODE_WORDS for word in words])
+                _ttf_fonts[family] = font
+    return font
+def ttf_font_objects(num, families, level):
+    """Objects from `num` embedding the _TTF_CHARS subset of each TrueType family in `families`
+
+    Returns the serialized objects and the resource dictionary for the page
+    tree, which names these fonts alongside the shared core ones.
+    """
+    objects = []
+    refs = [_PDF_FONT_REFS]
+    for family in sorted(families):
+        font = get_ttf_font(family)
+        tag, widths, to_unicode, font_file = font.subset(_TTF_CHARS, level)
+        base_font = f"/{tag}+{font.base_font}".encode('latin-1')
+        refs.append(b"%s %d 0 R" % (_TTF_FONT_NAMES[family].encode('latin-1'), num))
+        objects += [
+            b"%d 0 obj\n<< /Type /Font /Subtype /Type0 /BaseFont %s /Encoding /Identity-H "
+            b"/DescendantFonts [%d 0 R] /ToUnicode %d 0 R >>\nendobj\n" % (num, base_font, num + 1, num + 3),
+            b"%d 0 obj\n<< /Type /Font /Subtype /CIDFontType2 /BaseFont %s "
+            b"/CIDSystemInfo << /Registry (Adobe) /Ordering (Identity) /Supplement 0 >> /FontDescriptor %d 0 R "
+            b"/DW %d /W [%s] /CIDToGIDMap /Identity >>\nendobj\n" % (
+                num + 1, base_font, num + 2, font.widths[0], widths),
+            b"%d 0 obj\n<< /Type /FontDescriptor /FontName %s %s /FontFile2 %d 0 R >>\nendobj\n" % (
+                num + 2, base_font, font.descriptor.encode('latin-1'), num + 4),
+            b"%d" % (num + 3) + to_unicode,
+            b"%d" % (num + 4) + font_file,
+        ]
+        num += 5
+    return objects, b"<< /ProcSet [/PDF /Text] /Font << %s >> >>" % b" ".join(refs)
+def ttf_stats():
+    """Return loaded TrueType fonts and subset cache counters"""
+    with _ttf_lock:
+        fonts = list(_ttf_fonts.values())
+    stats = {"cache_hits": 0, "cache_misses": 0, "fonts": len(fonts), "subsets": 0}
+    for font in fonts:
+        for name, value in font.subset_stats().items():
+            stats[name] += value
+    return stats
+# --- TEXT SYNTHESIS ---
+# All random choices for a block of lines are made in a handful of bulk draws:
+# one getrandbits() call per kind of value, mapped to uniform small integers
+# with bytes.translate (rejecting the top of the byte range to avoid modulo
+# bias). Pass an integer seed for reproducible output.
+SYNTH_BLOCK_LINES = 2048
+_PDF_FONT_KEYS = [(family, style) for family in PDF_FAMILIES for style in PDF_STYLES]
+_SYNTH_WORDS = [w.lower() for w in WORDS]  # .capitalize() lowercases the rest of the line anyway
+_NOISE_ALPHABET = (string.ascii_letters + string.digits).encode('ascii')
+_uniform_tables = {}
+def _uniform_bytes(rng, n, mod, alphabet=None):
+    """Return n bytes drawn uniformly from range(mod), or from alphabet if given"""
+    tables = _uniform_tables.get((mod, alphabet))
+    if tables is None:
+        limit = 256 - 256 % mod
+        values = alphabet if alphabet is not None else bytes(range(mod))
+        tables = (bytes(values[i % mod] for i in range(256)), bytes(range(limit, 256)), limit)
+        _uniform_tables[(mod, alphabet)] = tables
+    table, reject, limit = tables
+    out = b""
+    while len(out) < n:
+        m = (n - len(out)) * 256 // limit + 8
+        out += rng.getrandbits(8 * m).to_bytes(m, 'little').translate(table, reject)
+    return out[:n]
+def synth_lines(rng, n, font_keys=_PDF_FONT_KEYS):
+    """Draw fonts, sizes, sentences and noise strings for n lines in bulk"""
+    fonts = _uniform_bytes(rng, n, len(font_keys))
+    sizes = _uniform_bytes(rng, n, 5)
+    counts = _uniform_bytes(rng, n, 11)
+    total = sum(counts) + 10 * n
+    picks = _uniform_bytes(rng, total, len(_SYNTH_WORDS))
+    words = operator.itemgetter(*picks)(_SYNTH_WORDS)
+    noise = _uniform_bytes(rng, 15 * n, len(_NOISE_ALPHABET), _NOISE_ALPHABET).decode('ascii')
+    texts = []
+    pos = 0
+    if not any(key[0] in TTF_FAMILIES for key in font_keys):
+        for c in counts:
+            end = pos + c + 10
+            texts.append(" ".join(words[pos:end]).capitalize() + ".")
+            pos = end
+    else:
+        # Lines set in a TrueType font pick the same words in one of the
+        # UNICODE_WORDS languages; core-font lines stay English
+        languages = _uniform_bytes(rng, n, len(UNICODE_WORDS))
+        for f, c, language in zip(fonts, counts, languages):
+            end = pos + c + 10
+            if font_keys[f][0] in TTF_FAMILIES:
+                line = " ".join(operator.itemgetter(*picks[pos:end])(UNICODE_WORDS[language]))
+            else:
+                line = " ".join(words[pos:end])
+            texts.append(line.capitalize() + ".")
+            pos = end
+    return ([font_keys[f] for f in fonts], [10 + sz for sz in sizes], texts,
+            [noise[i:i + 15] for i in range(0, 15 * n, 15)])
+def _iter_lines(rng, count, font_keys):
+    while count > 0:
+        block = min(count, SYNTH_BLOCK_LINES)
+        yield from zip(*synth_lines(rng, block, font_keys))
+        count -= block
+def _layout_pages(pages=10, lines=25, seed=None, fonts=None, progress=None, used=None):
+    """Lay out random lines like gen_pdf_content_fpdf, yielding each page's content stream when full
+
+    Long lines wrap, so one requested page can spill onto several PDF pages;
+    `progress(n)` is called as each of the n requested pages is finished.
+    TrueType families that show at least one line are added to the set `used`.
+    """
+    rng = random.Random(seed) if seed is not None else random
+    font_keys = _PDF_FONT_KEYS if fonts is None else [key for key in _PDF_FONT_KEYS if key[0] in fonts]
+    font_names = {key: name for key, (name, _) in _PDF_FONTS.items()}
+    ttf_glyphs = {}
+    if fonts is not None:
+        for family in TTF_FAMILIES:
+            if family in fonts:
+                font_keys.append((family, ''))
+                font_names[(family, '')] = _TTF_FONT_NAMES[family]
+                font = get_ttf_font(family)
+                ttf_glyphs[(family, '')] = (font.literals[ord(' ')], font.words.__getitem__)
+    ops = None
+    y = PDF_MARGIN
+    k = PDF_K
+    x_text = (PDF_MARGIN + PDF_CELL_MARGIN) * k
+    w_text = PDF_PAGE_W - 2 * PDF_MARGIN - 2 * PDF_CELL_MARGIN
+    noise_font = _PDF_FONTS[('Arial', '')][0]
+    # Font and size are graphics state, so Tf is only emitted when they change
+    # (each content stream starts from a fresh state)
+    current_font = None
+    for line_num, (font_key, size, line, noise) in enumerate(_iter_lines(rng, pages * lines, font_keys)):
+        if line_num % lines == 0:
+            if ops is not None:
+                if progress is not None:
+                    progress(line_num // lines)
+                yield "\n".join(ops).encode('latin-1')
+            ops = []
+            y = PDF_MARGIN
+            current_font = None
+        font_name = font_names[font_key]
+        glyphs = ttf_glyphs.get(font_key)
+        words = line.split(' ')
+        if glyphs is not None and used is not None:
+            used.add(font_key[0])
+        # Wrap at the same width multi_cell(0, 10, ...) uses
+        for text in wrap_words(words, WORD_WIDTHS[font_key], w_text * 1000.0 * k / size):
+            if y + 10 > PDF_BREAK_TRIGGER:
+                yield "\n".join(ops).encode('latin-1')
+                ops = []
+                y = PDF_MARGIN
+                current_font = None
+            if current_font != (font_name, size):
+                current_font = (font_name, size)
+                ops.append("%s %d Tf" % current_font)
+            if glyphs is None:
+                ops.append("BT %.2f %.2f Td (%s) Tj ET" % (
+                    x_text, (PDF_PAGE_H - (y + 5 + 0.3 * size / k)) * k, text))
+            else:
+                # Two-byte glyph ids for Identity-H
+                space, encode = glyphs
+                ops.append("BT %.2f %.2f Td (%s) Tj ET" % (
+                    x_text, (PDF_PAGE_H - (y + 5 + 0.3 * size / k)) * k, space.join(map(encode, text.split(' ')))))
+            y += 10
+        # Anti-Detector Noise
+        if y + 5 > PDF_BREAK_TRIGGER:
+            yield "\n".join(ops).encode('latin-1')
+            ops = []
+            y = PDF_MARGIN
+            current_font = None
+        if current_font != (noise_font, 6):
+            current_font = (noise_font, 6)
+            ops.append("%s 6 Tf" % noise_font)
+        ops.append("1 g BT %.2f %.2f Td (%s) Tj ET 0 g" % (
+            x_text, (PDF_PAGE_H - (y + 2.5 + 1.8 / k)) * k, noise))
+        y += 5
+    if ops is not None:
+        if progress is not None:
+            progress(pages)
+        yield "\n".join(ops).encode('latin-1')
+def _xref_stream(num, offsets, pos, level):
+    """Cross-reference stream object `num` at `pos` covering objects 0..num"""
+    entries = b"".join([b"\x00\x00\x00\x00\x00\xff\xff"] + [struct.pack('>BIH', 1, off, 0) for off in offsets[1:]]
+                       + [struct.pack('>BIH', 1, pos, 0)])
+    filter_ = b""
+    if level:
+        entries = zlib.compress(entries, level)
+        filter_ = b" /Filter /FlateDecode"
+    return (b"%d 0 obj\n<< /Type /XRef /Size %d /W [1 4 2] /Root 1 0 R /Length %d%s >>\nstream\n%s\nendstream\nendobj\n"
+            b"startxref\n%d\n%%%%EOF\n" % (num, num + 1, len(entries), filter_, entries, pos))
+def _content_tail(stream, level):
+    """A page content stream object minus its leading object number, compressed at `level`"""
+    if level:
+        stream = zlib.compress(stream, level)
+        return b" 0 obj\n<< /Length %d /Filter /FlateDecode >>\nstream\n%s\nendstream\nendobj\n" % (len(stream), stream)
+    return b" 0 obj\n<< /Length %d >>\nstream\n%s\nendstream\nendobj\n" % (len(stream), stream)
+def _page_objects(num, tail):
+    """Content object `num` and the page object num + 1 using it; returns (content length, bytes)"""
+    content = b"%d" % num + tail
+    return len(content), content + b"%d 0 obj\n<< /Type /Page /Parent 2 0 R /Contents %d 0 R >>\nendobj\n" % (num + 1, num)
+def _pdf_trailer(num, offsets, kids, pos, level, resources=b"3 0 R"):
+    """Page tree, cross-reference section and trailer for a document whose pages end at `pos`"""
+    offsets[2] = pos
+    chunk = b"2 0 obj\n<< /Type /Pages /Kids [%s] /Count %d /MediaBox [0 0 %.2f %.2f] /Resources %s >>\nendobj\n" % (
+        b" ".join(kids), len(kids), PDF_PAGE_W * PDF_K, PDF_PAGE_H * PDF_K, resources)
+    xref = pos + len(chunk)
+    if PDF_XREF_STREAM:
+        return chunk + _xref_stream(num, offsets, xref, level)
+    return (chunk + b"xref\n0 %d\n0000000000 65535 f \n" % num
+            + b"".join(b"%010d 00000 n \n" % off for off in offsets[1:])
+            + b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (num, xref))
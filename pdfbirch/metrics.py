@@ -0,0 +1,92 @@
+"""Stage timings and structured logs, shared by every module of the app.
+
+Hot-path stages are timed with `with span('layout'):` into fixed-bucket
+histograms that /metrics exposes in Prometheus text format. Stages that run
+on the process pool (PDF_WORKERS > 0) are only visible as the parent's
+`render` span. METRICS_ALLOCATIONS=1 also records the net number of memory
+blocks allocated per stage (process-wide, so approximate under concurrency;
+off by default because sys.getallocatedblocks walks the whole heap).
+
+log_event() writes one JSON object per line to stderr. Each event name gets
+LOG_RATE lines per second with bursts of up to LOG_BURST; lines over the
+limit are dropped before any formatting and counted in the next line that
+gets through.
+"""
+import bisect
+import json
+import os
+import sys
+import threading
+import time
+import traceback
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'info')
+LOG_RATE = float(os.getenv('LOG_RATE', '20'))
+LOG_BURST = float(os.getenv('LOG_BURST', '50'))
+METRICS_ALLOCATIONS = os.getenv('METRICS_ALLOCATIONS', '') == '1'
+METRIC_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+_LOG_LEVELS = {'debug': 10, 'info': 20, 'warning': 30, 'error': 40}
+_log_min_level = _LOG_LEVELS.get(LOG_LEVEL, 20)
+_log_buckets = {}  # event -> [tokens, last refill, suppressed since last line]
+_log_lock = threading.Lock()
+_log_suppressed_total = 0
+_histograms = {}  # (name, labels) -> [per-bucket counts with +Inf last, sum]
+_alloc_blocks = {}  # stage -> net allocated blocks
+_metrics_lock = threading.Lock()
+def log_event(event, level='info', exc_info=False, **fields):
+    """Write one structured log line unless `event` is over its rate limit"""
+    global _log_suppressed_total
+    if _LOG_LEVELS[level] < _log_min_level:
+        return
+    now = time.monotonic()
+    with _log_lock:
+        bucket = _log_buckets.get(event)
+        if bucket is None:
+            bucket = _log_buckets[event] = [LOG_BURST, now, 0]
+        else:
+            bucket[0] = min(LOG_BURST, bucket[0] + (now - bucket[1]) * LOG_RATE)
+            bucket[1] = now
+        if bucket[0] < 1:
+            bucket[2] += 1
+            _log_suppressed_total += 1
+            return
+        bucket[0] -= 1
+        suppressed, bucket[2] = bucket[2], 0
+    record = {"ts": round(time.time(), 3), "level": level, "event": event}
+    record.update(fields)
+    if suppressed:
+        record["suppressed"] = suppressed
+    if exc_info:
+        record["traceback"] = traceback.format_exc()
+    sys.stderr.write(json.dumps(record, default=str) + "\n")
+def observe(name, value, **labels):
+    """Add one sample to the histogram `name` with the given labels"""
+    key = (name, tuple(sorted(labels.items())))
+    i = bisect.bisect_left(METRIC_BUCKETS, value)
+    with _metrics_lock:
+        h = _histograms.get(key)
+        if h is None:
+            h = _histograms[key] = [[0] * (len(METRIC_BUCKETS) + 1), 0.0]
+        h[0][i] += 1
+        h[1] += value
+class span:
+    """Time a block into pdfbirch_stage_seconds{stage=...}"""
+    __slots__ = ('stage', 'start', 'blocks')
+    def __init__(self, stage):
+        self.stage = stage
+    def __enter__(self):
+        if METRICS_ALLOCATIONS:
+            self.blocks = sys.getallocatedblocks()
+        self.start = time.perf_counter()
+        return self
+    def __exit__(self, *exc):
+        observe('pdfbirch_stage_seconds', time.perf_counter() - self.start, stage=self.stage)
+        if METRICS_ALLOCATIONS:
+            blocks = sys.getallocatedblocks() - self.blocks
+            with _metrics_lock:
+                _alloc_blocks[self.stage] = _alloc_blocks.get(self.stage, 0) + blocks
+def metrics_snapshot():
+    """Sorted copies of the histograms and per-stage allocations, and the count of suppressed log lines"""
+    with _metrics_lock:
+        histograms = sorted((key, (list(counts), total)) for key, (counts, total) in _histograms.items())
+        alloc_blocks = sorted(_alloc_blocks.items())
+    return histograms, alloc_blocks, _log_suppressed_total
@@ -0,0 +1,77 @@
+"""A pool of documents built ahead of the requests that take them.
+
+Documents are random filler, so they can be built ahead of time. With
+PDF_POOL_HIGH > 0 a background thread keeps between PDF_POOL_LOW and
+PDF_POOL_HIGH ready documents (and never more than PDF_POOL_MAX_BYTES);
+/api/download takes from the pool and falls back to inline generation.
+"""
+import multiprocessing
+import os
+import threading
+import time
+from collections import deque
+from .metrics import log_event
+from .procpool import build_pdf_bytes
+PDF_POOL_HIGH = int(os.getenv('PDF_POOL_HIGH', '0'))
+PDF_POOL_LOW = int(os.getenv('PDF_POOL_LOW', str(max(1, PDF_POOL_HIGH // 2))))
+PDF_POOL_MAX_BYTES = int(os.getenv('PDF_POOL_MAX_BYTES', str(32 * 1024 * 1024)))
+_pdf_pool = deque()
+_pdf_pool_bytes = 0
+_pdf_pool_cond = threading.Condition()
+_pdf_pool_thread = None
+_pdf_pool_stats = {"hits": 0, "misses": 0, "generated": 0}
+def _pdf_pool_full():
+    return len(_pdf_pool) >= PDF_POOL_HIGH or _pdf_pool_bytes >= PDF_POOL_MAX_BYTES
+def _pdf_pool_worker():
+    global _pdf_pool_bytes
+    while True:
+        with _pdf_pool_cond:
+            # Sleep until a take drops the pool under the low watermark
+            while len(_pdf_pool) >= PDF_POOL_LOW or _pdf_pool_bytes >= PDF_POOL_MAX_BYTES:
+                _pdf_pool_cond.wait()
+        while True:
+            with _pdf_pool_cond:
+                if _pdf_pool_full():
+                    break
+            try:
+                doc = build_pdf_bytes()
+            except Exception as e:
+                log_event('pool_refill_error', 'error', error=str(e))
+                time.sleep(1)
+                break
+            with _pdf_pool_cond:
+                _pdf_pool.append(doc)
+                _pdf_pool_bytes += len(doc)
+                _pdf_pool_stats["generated"] += 1
+def start_pdf_pool():
+    """Start the pool refill thread once; a no-op when the pool is disabled"""
+    global _pdf_pool_thread
+    if PDF_POOL_HIGH <= 0 or multiprocessing.parent_process() is not None:
+        return
+    with _pdf_pool_cond:
+        if _pdf_pool_thread is None:
+            _pdf_pool_thread = threading.Thread(target=_pdf_pool_worker, name='pdf-pool', daemon=True)
+            _pdf_pool_thread.start()
+def take_pooled_pdf():
+    """Return a ready-made PDF as bytes, or None if the pool is disabled or empty"""
+    global _pdf_pool_bytes
+    if PDF_POOL_HIGH <= 0:
+        return None
+    start_pdf_pool()
+    with _pdf_pool_cond:
+        if not _pdf_pool:
+            _pdf_pool_stats["misses"] += 1
+            return None
+        doc = _pdf_pool.popleft()
+        _pdf_pool_bytes -= len(doc)
+        _pdf_pool_stats["hits"] += 1
+        if len(_pdf_pool) < PDF_POOL_LOW:
+            _pdf_pool_cond.notify()
+    return doc
+def pdf_pool_stats():
+    """Return pool occupancy and hit/miss counters"""
+    with _pdf_pool_cond:
+        stats = dict(_pdf_pool_stats)
+        stats["size"] = len(_pdf_pool)
+        stats["bytes"] = _pdf_pool_bytes
+    return stats
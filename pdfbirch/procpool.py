@@ -0,0 +1,92 @@
+"""Document builds on a pool of spawned worker processes.
+
+Layout is CPU-bound pure Python, so threads in one worker serialize on the
+GIL. PDF_WORKERS > 0 sends builds to a warm pool of spawned processes; each
+is recycled after PDF_WORKER_MAX_TASKS jobs. Documents of at least
+PDF_SHM_THRESHOLD bytes come back through shared memory instead of being
+pickled through the result pipe; the worker hands the segment over with its
+reply, and the parent, which attaches, copies and unlinks it, owns it from
+then on. A worker that dies (OOM, signal) breaks
+the whole executor, so a broken pool is replaced and the document retried
+once on the new one.
+"""
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import resource_tracker, shared_memory
+from .layout import DEFAULT_DOC_SPEC
+from .metrics import log_event, span
+from .render import render_document
+PDF_WORKERS = int(os.getenv('PDF_WORKERS', '0'))
+PDF_WORKER_MAX_TASKS = int(os.getenv('PDF_WORKER_MAX_TASKS', '500'))
+PDF_SHM_THRESHOLD = int(os.getenv('PDF_SHM_THRESHOLD', str(256 * 1024)))
+_process_pool = None
+_process_pool_lock = threading.Lock()
+def _render_in_worker(seed=None, spec=DEFAULT_DOC_SPEC):
+    doc = render_document(seed, spec)
+    if len(doc) < PDF_SHM_THRESHOLD:
+        return doc
+    shm = shared_memory.SharedMemory(create=True, size=len(doc))
+    try:
+        shm.buf[:len(doc)] = doc
+    except BaseException:
+        shm.unlink()
+        raise
+    finally:
+        shm.close()
+    # The parent unlinks it, so stop tracking it here; attaching registers it
+    # again on the parent's side until that unlink
+    resource_tracker.unregister(shm._name, 'shared_memory')
+    return (shm.name, len(doc))
+def _worker_ready():
+    return os.getpid()
+def get_process_pool():
+    """Create the generation process pool on first use and spawn all its workers"""
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is None:
+            _process_pool = ProcessPoolExecutor(
+                max_workers=PDF_WORKERS,
+                mp_context=multiprocessing.get_context('spawn'),
+                max_tasks_per_child=PDF_WORKER_MAX_TASKS or None)
+            # Spawning and importing this module takes a while; do it now
+            # rather than on the first download
+            for f in [_process_pool.submit(_worker_ready) for _ in range(PDF_WORKERS)]:
+                f.result()
+        return _process_pool
+def reset_process_pool(broken):
+    """Drop `broken` as the process pool so the next get_process_pool() starts a new one"""
+    global _process_pool
+    with _process_pool_lock:
+        # Another thread may already have replaced it
+        if _process_pool is broken:
+            _process_pool = None
+    broken.shutdown(wait=False, cancel_futures=True)
+def render_in_process_pool(seed=None, spec=DEFAULT_DOC_SPEC):
+    """Render one document on a worker process and return its bytes"""
+    pool = get_process_pool()
+    try:
+        return _worker_result(pool.submit(_render_in_worker, seed, spec).result())
+    except BrokenProcessPool:
+        log_event('process_pool_broken', 'error', exc_info=True)
+        reset_process_pool(pool)
+        return _worker_result(get_process_pool().submit(_render_in_worker, seed, spec).result())
+def _worker_result(result):
+    """The document bytes from a _render_in_worker reply, freeing its shared memory if it used any"""
+    if isinstance(result, bytes):
+        return result
+    name, size = result
+    shm = shared_memory.SharedMemory(name=name)
+    try:
+        return bytes(shm.buf[:size])
+    finally:
+        shm.close()
+        shm.unlink()
+def build_pdf_bytes(seed=None, spec=DEFAULT_DOC_SPEC):
+    """Render one document on the process pool when PDF_WORKERS > 0, otherwise inline"""
+    with span('render'):
+        if PDF_WORKERS > 0:
+            return render_in_process_pool(seed, spec)
+        return render_document(seed, spec)
@@ -0,0 +1,177 @@
+"""Per-user token buckets, in memory or in a table shared by every instance.
+
+Per-user token buckets keyed by the verified email: RATE_LIMIT_RATE tokens
+per second up to RATE_LIMIT_BURST, one token per document requested. Off
+unless RATE_LIMIT_RATE is set above 0. A request is never charged less than
+it asks for, so batches are capped at the burst (batch_max_files) and a
+larger cost is always refused. The default 'memory' backend is a
+dict lookup and a few float operations under a lock. A bucket left idle
+for BURST/RATE seconds is full again, which is the same as having no
+entry, so such entries are dropped when the table gets large.
+
+With several instances, RATE_LIMIT_BACKEND=postgres (DATABASE_URL) or
+sqlite (RATE_LIMIT_SQLITE_PATH, for processes on one host) keeps the
+buckets in a shared table, updated by a single upsert. To keep most
+requests off the database, an instance takes up to RATE_LIMIT_LEASE tokens
+at a time and spends the spare ones locally, so one user can get at most
+LEASE - 1 requests per instance ahead of the shared bucket. If the shared
+backend fails, the in-memory bucket decides until USAGE_CONNECT_RETRY
+seconds have passed.
+"""
+import os
+import threading
+import time
+from .metrics import log_event
+from .usage import USAGE_CONNECT_RETRY, pg_run, reserve_usage
+RATE_LIMIT_RATE = float(os.getenv('RATE_LIMIT_RATE', '0'))
+RATE_LIMIT_BURST = float(os.getenv('RATE_LIMIT_BURST', '10'))
+RATE_LIMIT_BACKEND = os.getenv('RATE_LIMIT_BACKEND', 'memory')
+RATE_LIMIT_SQLITE_PATH = os.getenv('RATE_LIMIT_SQLITE_PATH', '/tmp/pdfbirch-ratelimit.sqlite3')
+RATE_LIMIT_LEASE = int(os.getenv('RATE_LIMIT_LEASE', '3'))
+RATE_LIMIT_MAX_KEYS = int(os.getenv('RATE_LIMIT_MAX_KEYS', '100000'))
+# Refill the stored bucket, then grant up to `want` whole tokens if at least
+# `cost` are available. SET expressions all see the row as it was before the
+# update, so `granted` and `tokens` agree.
+_RATE_TAKE_SQL = {
+    'postgres': """
+        INSERT INTO rate_limits AS r (key, tokens, updated_at, granted)
+        VALUES (%(key)s, %(burst)s - %(first)s, EXTRACT(EPOCH FROM now()), %(first)s)
+        ON CONFLICT (key) DO UPDATE SET
+            granted = CASE WHEN {refill} >= %(cost)s THEN LEAST(%(want)s, FLOOR({refill})) ELSE 0 END,
+            tokens = {refill} - CASE WHEN {refill} >= %(cost)s THEN LEAST(%(want)s, FLOOR({refill})) ELSE 0 END,
+            updated_at = EXTRACT(EPOCH FROM now())
+        RETURNING granted, tokens""".format(
+            refill="LEAST(%(burst)s, r.tokens + GREATEST(0, EXTRACT(EPOCH FROM now()) - r.updated_at) * %(rate)s)"),
+    'sqlite': """
+        INSERT INTO rate_limits AS r (key, tokens, updated_at, granted)
+        VALUES (:key, :burst - :first, :now, :first)
+        ON CONFLICT (key) DO UPDATE SET
+            granted = CASE WHEN {refill} >= :cost THEN MIN(:want, CAST({refill} AS INTEGER)) ELSE 0 END,
+            tokens = {refill} - CASE WHEN {refill} >= :cost THEN MIN(:want, CAST({refill} AS INTEGER)) ELSE 0 END,
+            updated_at = :now
+        RETURNING granted, tokens""".format(
+            refill="MIN(:burst, r.tokens + MAX(0, :now - r.updated_at) * :rate)"),
+}
+_RATE_TABLE_SQL = ("CREATE TABLE IF NOT EXISTS rate_limits (key TEXT PRIMARY KEY, tokens DOUBLE PRECISION NOT NULL, "
+                   "updated_at DOUBLE PRECISION NOT NULL, granted INTEGER NOT NULL)")
+_rate_buckets = {}  # email -> [tokens, last refill]
+_rate_leases = {}  # email -> tokens taken from the shared bucket but not spent yet
+_rate_lock = threading.Lock()
+_rate_sweep_at = RATE_LIMIT_MAX_KEYS
+_rate_backend = None
+_rate_backend_retry_at = 0.0
+_rate_stats = {"allowed": 0, "limited": 0, "backend_calls": 0, "backend_errors": 0}
+class PostgresRateLimitBackend:
+    """Token buckets in a PostgreSQL table, refilled by the database clock"""
+    def __init__(self):
+        pg_run(lambda cur: cur.execute(_RATE_TABLE_SQL))
+    def take(self, params):
+        def upsert(cur):
+            cur.execute(_RATE_TAKE_SQL['postgres'], params)
+            return cur.fetchone()
+        return pg_run(upsert)
+class SqliteRateLimitBackend:
+    """Token buckets in a SQLite file shared by the processes on one host"""
+    def __init__(self, path):
+        import sqlite3
+        self.db = sqlite3.connect(path, timeout=10, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute(_RATE_TABLE_SQL)
+        self.lock = threading.Lock()
+    def take(self, params):
+        with self.lock, self.db:
+            return self.db.execute(_RATE_TAKE_SQL['sqlite'], dict(params, now=time.time())).fetchone()
+def get_rate_backend():
+    """Open the shared rate-limit backend on first use"""
+    global _rate_backend
+    with _rate_lock:
+        if _rate_backend is None:
+            if RATE_LIMIT_BACKEND == 'sqlite':
+                _rate_backend = SqliteRateLimitBackend(RATE_LIMIT_SQLITE_PATH)
+            else:
+                _rate_backend = PostgresRateLimitBackend()
+        return _rate_backend
+def _take_local(email, cost, now):
+    """Spend `cost` tokens from the in-process bucket; None if allowed, else seconds until they are there"""
+    global _rate_sweep_at
+    bucket = _rate_buckets.get(email)
+    if bucket is None:
+        if len(_rate_buckets) >= _rate_sweep_at:
+            full_after = RATE_LIMIT_BURST / RATE_LIMIT_RATE
+            for key in [key for key, (_, last) in _rate_buckets.items() if now - last >= full_after]:
+                del _rate_buckets[key]
+            # If most buckets are active, don't rescan on every new user
+            _rate_sweep_at = max(RATE_LIMIT_MAX_KEYS, 2 * len(_rate_buckets))
+        bucket = _rate_buckets[email] = [RATE_LIMIT_BURST, now]
+    else:
+        bucket[0] = min(RATE_LIMIT_BURST, bucket[0] + (now - bucket[1]) * RATE_LIMIT_RATE)
+        bucket[1] = now
+    if bucket[0] >= cost:
+        bucket[0] -= cost
+        return None
+    return (cost - bucket[0]) / RATE_LIMIT_RATE
+def _take_shared(email, cost):
+    with _rate_lock:
+        leased = _rate_leases.get(email, 0)
+        if leased >= cost:
+            if leased > cost:
+                _rate_leases[email] = leased - cost
+            else:
+                del _rate_leases[email]
+            return None
+    want = max(cost, RATE_LIMIT_LEASE)
+    granted, tokens = get_rate_backend().take({
+        'key': email, 'cost': cost, 'want': want, 'first': min(want, int(RATE_LIMIT_BURST)),
+        'burst': RATE_LIMIT_BURST, 'rate': RATE_LIMIT_RATE})
+    with _rate_lock:
+        _rate_stats["backend_calls"] += 1
+        if granted >= cost:
+            if granted > cost:
+                _rate_leases[email] = _rate_leases.get(email, 0) + granted - cost
+            return None
+    return (cost - tokens) / RATE_LIMIT_RATE
+def rate_limit(email, cost=1):
+    """Take `cost` tokens from the user's bucket; None if allowed, else whole seconds to wait"""
+    global _rate_backend_retry_at
+    if RATE_LIMIT_RATE <= 0:
+        return None
+    if cost > RATE_LIMIT_BURST:
+        # Can never fit, so refuse it without draining the bucket
+        with _rate_lock:
+            _rate_stats["limited"] += 1
+        return max(1, int(RATE_LIMIT_BURST / RATE_LIMIT_RATE + 0.999))
+    wait = None
+    if RATE_LIMIT_BACKEND == 'memory' or time.monotonic() < _rate_backend_retry_at:
+        with _rate_lock:
+            wait = _take_local(email, cost, time.monotonic())
+    else:
+        try:
+            wait = _take_shared(email, cost)
+        except Exception as e:
+            log_event('rate_limit_backend_error', 'error', backend=RATE_LIMIT_BACKEND, error=str(e))
+            with _rate_lock:
+                _rate_stats["backend_errors"] += 1
+                # Don't pay a failed round trip on every request while it is down
+                _rate_backend_retry_at = time.monotonic() + USAGE_CONNECT_RETRY
+                wait = _take_local(email, cost, time.monotonic())
+    with _rate_lock:
+        _rate_stats["allowed" if wait is None else "limited"] += 1
+    if wait is None:
+        return None
+    return max(1, int(wait + 0.999))
+def admit(email, count=1):
+    """Check the rate limit, then reserve `count` documents of the daily quota; (message, retry_after) if refused"""
+    retry_after = rate_limit(email, count)
+    if retry_after is not None:
+        return "Too many requests", retry_after
+    retry_after = reserve_usage(email, count)
+    if retry_after is not None:
+        return "Daily download limit reached", retry_after
+    return None
+def rate_limit_stats():
+    """Return limiter decisions and backend call counters"""
+    with _rate_lock:
+        stats = dict(_rate_stats)
+        stats["buckets"] = len(_rate_buckets)
+        stats["leases"] = len(_rate_leases)
+    return stats
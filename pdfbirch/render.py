@@ -0,0 +1,193 @@
+"""Whole documents: the template engine's writer and the reference FPDF engine.
+
+PDF_ENGINE picks which one render_document() uses. iter_pdf() writes the
+template head, one chunk per finished page and the xref; unseeded documents
+are stitched from stored pages instead when the fragment library is on.
+"""
+import io
+import os
+import random
+import string
+import time
+from . import fragments, layout
+from .layout import (
+    DEFAULT_DOC_SPEC, TTF_FAMILIES, WORD_WIDTHS, WORDS, _PDF_HEAD, _PDF_HEAD_OFFSETS, _content_tail, _layout_pages,
+    _page_objects, _pdf_trailer, multi_cell_fast, ttf_font_objects)
+from .metrics import log_event, observe, span
+PDF_ENGINE = os.getenv('PDF_ENGINE', 'template')
+def iter_pdf(pages=10, lines=25, fonts=None, target_bytes=None, seed=None, compress=None, progress=None):
+    """Yield a complete PDF in chunks: the template head, one chunk per finished page, then the xref"""
+    # Fragments are stitched under the core font resources only, so TrueType documents are always laid out
+    if seed is None and fragments.PDF_FRAGMENTS > 0 and not (fonts and any(f in TTF_FAMILIES for f in fonts)):
+        yield from fragments.compose_pdf(pages, lines, fonts, target_bytes, compress, progress)
+        return
+    level = layout.PDF_COMPRESS_LEVEL if compress is None else compress
+    yield _PDF_HEAD
+    pos = len(_PDF_HEAD)
+    offsets = list(_PDF_HEAD_OFFSETS)
+    num = len(offsets)
+    kids = []
+    # Layout and serialization are interleaved per page, so their times are
+    # summed here and recorded once per document
+    layout_s = serialize_s = 0.0
+    used = set()
+    t = time.perf_counter()
+    for stream in _layout_pages(pages, lines, seed, fonts, progress, used):
+        t1 = time.perf_counter()
+        layout_s += t1 - t
+        content_len, chunk = _page_objects(num, _content_tail(stream, level))
+        offsets.append(pos)
+        offsets.append(pos + content_len)
+        pos += len(chunk)
+        kids.append(b"%d 0 R" % (num + 1))
+        num += 2
+        serialize_s += time.perf_counter() - t1
+        yield chunk
+        if target_bytes and pos >= target_bytes:
+            break
+        t = time.perf_counter()
+    t1 = time.perf_counter()
+    resources = b"3 0 R"
+    if used:
+        # Fonts go after the pages, once it is known which families were shown
+        objects, resources = ttf_font_objects(num, used, level)
+        for obj in objects:
+            offsets.append(pos)
+            pos += len(obj)
+            num += 1
+        yield b"".join(objects)
+    chunk = _pdf_trailer(num, offsets, kids, pos, level, resources)
+    observe('pdfbirch_stage_seconds', layout_s, stage='layout')
+    observe('pdfbirch_stage_seconds', serialize_s + time.perf_counter() - t1, stage='serialize')
+    yield chunk
+def render_pdf(pages=10, lines=25, fonts=None, target_bytes=None, seed=None, compress=None):
+    """Build a complete PDF from the precompiled template"""
+    return b"".join(iter_pdf(pages, lines, fonts, target_bytes, seed, compress))
+def render_document(seed=None, spec=DEFAULT_DOC_SPEC):
+    """Render one document in this process with the configured PDF_ENGINE"""
+    if PDF_ENGINE == 'fpdf':
+        return gen_pdf_content_fpdf(seed, spec).getvalue()
+    return render_pdf(*spec, seed=seed)
+def gen_pdf_content_fpdf(seed=None, spec=DEFAULT_DOC_SPEC):
+    """Reference FPDF implementation of gen_pdf_content (PDF_ENGINE=fpdf)"""
+    try:
+        with span('layout'):
+            pdf = layout_fpdf(seed, spec)
+        with span('serialize'):
+            view = pdf.getbuffer()
+        return _BufferReader(view)
+    except Exception as e:
+        log_event('generation_error', 'error', exc_info=True, error=str(e))
+        raise
+# pyfpdf 1.7.2 builds the document in a str attribute, and `self.buffer += s`
+# on an attribute copies the whole buffer on every line, so serialization is
+# quadratic (8s for 1000 pages), and output(dest='S').encode('latin-1') copies
+# it once more. BufferedFPDF appends bytes to a bytearray instead; object
+# offsets are still len(self.buffer), now in bytes. Page contents stay str so
+# alias_nb_pages keeps working, and are encoded once when the page is written.
+# /CreationDate comes from `creation_date`, which seeded layouts clear so the
+# same seed gives the same bytes (the template engine writes no Info at all).
+_BufferedFPDF = None
+def buffered_fpdf_class():
+    """FPDF subclass that writes into a bytearray and hands out a memoryview of it"""
+    global _BufferedFPDF
+    if _BufferedFPDF is not None:
+        return _BufferedFPDF
+    from datetime import datetime
+    from fpdf import FPDF, FPDF_VERSION
+    class BufferedFPDF(FPDF):
+        def __init__(self, *args, **kwargs):
+            FPDF.__init__(self, *args, **kwargs)
+            self.buffer = bytearray()
+            self.creation_date = datetime.now()
+        def _out(self, s):
+            if self.state == 2:
+                if isinstance(s, bytes):
+                    s = s.decode('latin-1')
+                elif not isinstance(s, str):
+                    s = str(s)
+                self.pages[self.page] += s + "\n"
+                return
+            buf = self.buffer
+            if isinstance(s, (bytes, bytearray)):
+                buf += s
+            else:
+                buf += str(s).encode('latin-1')
+            buf += b"\n"
+        def _putinfo(self):
+            """FPDF._putinfo, with /CreationDate from `creation_date` and left out when that is None"""
+            self._out('/Producer ' + self._textstring('PyFPDF ' + FPDF_VERSION + ' http://pyfpdf.googlecode.com/'))
+            for name in ('title', 'subject', 'author', 'keywords', 'creator'):
+                if hasattr(self, name):
+                    self._out(f"/{name.capitalize()} " + self._textstring(getattr(self, name)))
+            if self.creation_date is not None:
+                self._out('/CreationDate ' + self._textstring('D:' + self.creation_date.strftime('%Y%m%d%H%M%S')))
+        def getbuffer(self):
+            """Finish the document and return a memoryview of its bytes"""
+            if self.state < 3:
+                self.close()
+            return memoryview(self.buffer)
+        def output(self, name='', dest=''):
+            """Like FPDF.output, but dest='S' returns bytes"""
+            view = self.getbuffer()
+            if dest.upper() == 'F' or (not dest and name):
+                with open(name, 'wb') as f:
+                    f.write(view)
+                return ''
+            return view.tobytes()
+    _BufferedFPDF = BufferedFPDF
+    return BufferedFPDF
+class _BufferReader(io.RawIOBase):
+    """Read-only file over a memoryview, so send_file can stream a finished buffer without copying it whole"""
+    def __init__(self, view):
+        self.view = view
+        self.pos = 0
+    def readable(self):
+        return True
+    def seekable(self):
+        return True
+    def readinto(self, b):
+        n = max(0, min(len(b), len(self.view) - self.pos))
+        b[:n] = self.view[self.pos:self.pos + n]
+        self.pos += n
+        return n
+    def seek(self, offset, whence=io.SEEK_SET):
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self.pos, io.SEEK_END: len(self.view)}[whence]
+        self.pos = max(0, base + offset)
+        return self.pos
+    def tell(self):
+        return self.pos
+    def getbuffer(self):
+        return self.view
+    def getvalue(self):
+        return self.view.tobytes()
+def layout_fpdf(seed=None, spec=DEFAULT_DOC_SPEC):
+    """Lay out a random document with FPDF and return the unserialized FPDF object"""
+    rng = random.Random(seed) if seed is not None else random
+    pdf = buffered_fpdf_class()()
+    if seed is not None:
+        pdf.creation_date = None
+    pdf.set_auto_page_break(auto=True, margin=15)
+   
+    for page_num in range(spec.pages):
+        pdf.add_page()
+       
+        for line_num in range(spec.lines):
+            # Randomize font, style, and size for EACH line
+            family = rng.choice(spec.fonts)
+            style = rng.choice(['', 'B', 'I', 'BI'])
+            size = rng.randint(10, 14)
+           
+            pdf.set_font(family, style, size)
+           
+            # Generate random sentence
+            line = " ".join(rng.choices(WORDS, k=rng.randint(10, 20))).capitalize() + "."
+            multi_cell_fast(pdf, 0, 10, line, WORD_WIDTHS[(family, style)])
+           
+            # Anti-Detector Noise
+            pdf.set_text_color(255, 255, 255)
+            pdf.set_font('Arial', '', 6)
+            noise = ''.join(rng.choices(string.ascii_letters + string.digits, k=15))
+            pdf.cell(0, 5, noise, ln=1)
+            pdf.set_text_color(0, 0, 0)
+    return pdf
@@ -0,0 +1,81 @@
+"""Document parameters from a request body and query string, checked against the generation budget.
+
+The routes, the ASGI app and the command-line tools all go through
+request_doc_spec(), so a document shape is accepted or refused the same way
+everywhere. `args` is the query string as a mapping (Flask's request.args,
+Starlette's query_params) and may be left out.
+"""
+import os
+from . import render
+from .layout import DEFAULT_DOC_SPEC, TTF_FAMILIES, DocSpec
+PDF_MAX_PAGES = int(os.getenv('PDF_MAX_PAGES', '5000'))
+PDF_MAX_LINES_PER_PAGE = int(os.getenv('PDF_MAX_LINES_PER_PAGE', '100'))
+# Generation cost is linear in lines and bytes, so the budget is expressed in those
+PDF_MAX_TOTAL_LINES = int(os.getenv('PDF_MAX_TOTAL_LINES', str(5000 * 25)))
+PDF_MAX_BYTES = int(os.getenv('PDF_MAX_BYTES', str(64 * 1024 * 1024)))
+def request_body(body):
+    """A decoded JSON request body as a dict: {} when absent or malformed, None when it is not an object"""
+    if body is None:
+        return {}
+    return body if isinstance(body, dict) else None
+def request_seed(body, args=None):
+    """Optional `seed` from the JSON body or query string `args`; makes the document reproducible"""
+    if args is None:
+        args = {}
+    seed = body.get('seed', args.get('seed'))
+    if seed is None:
+        return None
+    seed = str(seed)
+    if not seed or len(seed) > 128:
+        raise ValueError("seed must be 1-128 characters")
+    return seed
+class GenerationBudgetError(ValueError):
+    """Requested documents would cost more than the configured generation budget"""
+def _int_param(body, args, name, default, low, high):
+    value = body.get(name, args.get(name))
+    if value is None:
+        return default
+    # JSON true/false and 2.5 would otherwise pass int() as 1/0 and 2
+    if isinstance(value, bool) or (isinstance(value, float) and not value.is_integer()):
+        raise ValueError(f"{name} must be an integer")
+    try:
+        value = int(value)
+    except (TypeError, ValueError, OverflowError):
+        raise ValueError(f"{name} must be an integer")
+    if not low <= value <= high:
+        raise ValueError(f"{name} must be between {low} and {high}")
+    return value
+def request_doc_spec(body, count=1, args=None):
+    """Document shape from the request, checked against the budget before any work starts"""
+    if args is None:
+        args = {}
+    target_bytes = _int_param(body, args, 'target_bytes', None, 1, PDF_MAX_BYTES)
+    # A byte target decides the length itself unless pages is given as a cap
+    default_pages = PDF_MAX_PAGES if target_bytes else DEFAULT_DOC_SPEC.pages
+    pages = _int_param(body, args, 'pages', default_pages, 1, PDF_MAX_PAGES)
+    lines = _int_param(body, args, 'lines', DEFAULT_DOC_SPEC.lines, 1, PDF_MAX_LINES_PER_PAGE)
+    fonts = body.get('fonts', args.get('fonts'))
+    if fonts is None:
+        fonts = DEFAULT_DOC_SPEC.fonts
+    else:
+        if isinstance(fonts, str):
+            fonts = [f.strip() for f in fonts.split(',') if f.strip()]
+        elif not isinstance(fonts, (list, tuple)) or not all(isinstance(f, str) for f in fonts):
+            raise ValueError("fonts must be a comma-separated string or a list of font names")
+        known = DEFAULT_DOC_SPEC.fonts + tuple(TTF_FAMILIES)
+        unknown = [f for f in fonts if f not in known]
+        if unknown:
+            raise ValueError(f"Unknown fonts: {', '.join(unknown)}; choose from {', '.join(known)}")
+        fonts = tuple(f for f in known if f in fonts)
+        if not fonts:
+            raise ValueError(f"fonts must include at least one of {', '.join(known)}")
+    if target_bytes and render.PDF_ENGINE == 'fpdf':
+        raise ValueError("target_bytes is not supported by the fpdf engine")
+    if render.PDF_ENGINE == 'fpdf' and any(f in TTF_FAMILIES for f in fonts):
+        raise ValueError("TrueType fonts are not supported by the fpdf engine")
+    if target_bytes:
+        if target_bytes * count > PDF_MAX_BYTES:
+            raise GenerationBudgetError(f"Requested {target_bytes * count} bytes, budget is {PDF_MAX_BYTES}")
+    elif pages * lines * count > PDF_MAX_TOTAL_LINES:
+        raise GenerationBudgetError(f"Requested {pages * lines * count} lines, budget is {PDF_MAX_TOTAL_LINES}")
+    return DocSpec(pages, lines, fonts, target_bytes)
@@ -0,0 +1,309 @@
+"""TrueType parsing and subsetting for the template engine's embedded fonts.
+
+A TrueTypeFont reads one .ttf with glyf outlines into its raw tables, cmap,
+advance widths and glyph offsets. subset() builds the embedding for a
+document from the glyphs it shows: a /W array, a ToUnicode CMap and a
+FontFile2 program that keeps every glyph id in place and empties the outlines
+not shown, so text can use Identity-H with CID = glyph id. Each outline is
+deflated once per process as its own byte-aligned chunk, and building a
+subset compresses only its small tables and splices the cached chunks in
+after them. Finished subsets are kept in a small LRU per font.
+
+Streams come back as object tails in the form layout.py's writer uses
+(b" 0 obj ... endobj\n", the object number prepended by the caller).
+"""
+import hashlib
+import struct
+import sys
+import threading
+import zlib
+from array import array
+from collections import OrderedDict
+from itertools import accumulate
+_REQUIRED_TABLES = ('head', 'hhea', 'maxp', 'hmtx', 'loca', 'glyf', 'cmap')
+# Tables a PDF viewer needs from an embedded TrueType program; cmap, name and
+# the rest are not used with Identity CIDs
+_SUBSET_TABLES = ('cvt ', 'fpgm', 'glyf', 'head', 'hhea', 'hmtx', 'loca', 'maxp', 'prep')
+_TOUNICODE_HEAD = (b"/CIDInit /ProcSet findresource begin\n12 dict begin\nbegincmap\n"
+                   b"/CIDSystemInfo << /Registry (Adobe) /Ordering (UCS) /Supplement 0 >> def\n"
+                   b"/CMapName /Adobe-Identity-UCS def\n/CMapType 2 def\n"
+                   b"1 begincodespacerange\n<0000> <FFFF>\nendcodespacerange\n")
+_TOUNICODE_TAIL = b"endcmap\nCMapName currentdict /CMap defineresource pop\nend\nend"
+class _DefaultMap(dict):
+    """A dict that returns `default` for missing keys, so str.translate and width sums never fail on unmapped text"""
+    def __init__(self, items, default):
+        super().__init__(items)
+        self.default = default
+    def __missing__(self, key):
+        return self.default
+class _LiteralTable(dict):
+    """Word -> its glyph ids as literal string text, translated on first use like layout._WidthTable measures"""
+    def __init__(self, literals):
+        self.literals = literals
+    def __missing__(self, word):
+        text = self[word] = word.translate(self.literals)
+        return text
+def _u32_array(data, typecode='I'):
+    values = array(typecode, data)
+    if sys.byteorder == 'little':
+        values.byteswap()
+    return values
+def checksum(data):
+    """TrueType checksum: the sum of `data` as big-endian uint32s, zero-padded to 4 bytes"""
+    return sum(_u32_array(data + b"\0" * (-len(data) % 4))) & 0xFFFFFFFF
+def _glyph_literal(glyph):
+    """Glyph id as the two big-endian bytes of a literal string, escaped, as latin-1 text"""
+    return ''.join('\\' + c if c in '()\\' else '\\r' if c == '\r' else c for c in (chr(glyph >> 8), chr(glyph & 0xFF)))
+def _stream_tail(data, entries=b""):
+    """A stream object minus its leading object number, with extra dictionary `entries` after /Length"""
+    return b" 0 obj\n<< /Length %d%s >>\nstream\n%s\nendstream\nendobj\n" % (len(data), entries, data)
+def _cmap(table):
+    """Code point -> glyph id from the best Unicode subtable (format 12, else format 4)"""
+    subtables = {}
+    for i in range(struct.unpack_from('>H', table, 2)[0]):
+        platform, encoding, offset = struct.unpack_from('>HHI', table, 4 + 8 * i)
+        subtables.setdefault((struct.unpack_from('>H', table, offset)[0], platform in (0, 3)), offset)
+    cmap = {}
+    offset = subtables.get((12, True))
+    if offset is not None:
+        for i in range(struct.unpack_from('>I', table, offset + 12)[0]):
+            start, end, glyph = struct.unpack_from('>III', table, offset + 16 + 12 * i)
+            cmap.update(zip(range(start, end + 1), range(glyph, glyph + end - start + 1)))
+        return cmap
+    offset = subtables.get((4, True))
+    if offset is None:
+        raise ValueError("font has no Unicode cmap")
+    segments = struct.unpack_from('>H', table, offset + 6)[0] // 2
+    ends = struct.unpack_from('>%dH' % segments, table, offset + 14)
+    starts = struct.unpack_from('>%dH' % segments, table, offset + 16 + 2 * segments)
+    deltas = struct.unpack_from('>%dH' % segments, table, offset + 16 + 4 * segments)
+    range_base = offset + 16 + 6 * segments
+    range_offsets = struct.unpack_from('>%dH' % segments, table, range_base)
+    for i, (start, end, delta, range_offset) in enumerate(zip(starts, ends, deltas, range_offsets)):
+        for code in range(start, min(end, 0xFFFE) + 1):
+            if range_offset == 0:
+                glyph = (code + delta) & 0xFFFF
+            else:
+                glyph = struct.unpack_from('>H', table, range_base + 2 * i + range_offset + 2 * (code - start))[0]
+                if glyph:
+                    glyph = (glyph + delta) & 0xFFFF
+            if glyph:
+                cmap[code] = glyph
+    return cmap
+def _postscript_name(table):
+    if table is None:
+        return None
+    count, strings = struct.unpack_from('>2xHH', table)
+    for i in range(count):
+        platform, _, _, name_id, length, offset = struct.unpack_from('>6H', table, 6 + 12 * i)
+        if name_id == 6:
+            raw = table[strings + offset:strings + offset + length]
+            name = raw.decode('utf-16-be' if platform in (0, 3) else 'latin-1', 'replace')
+            return ''.join(c for c in name if c.isalnum() or c in '-_') or None
+    return None
+class TrueTypeFont:
+    """One TrueType file parsed for embedding: metrics, cmap, glyph offsets and subset font programs"""
+    def __init__(self, family, path, subset_cache=64):
+        with open(path, 'rb') as f:
+            data = f.read()
+        if data[:4] not in (b"\x00\x01\x00\x00", b"true"):
+            raise ValueError(f"{path} is not a TrueType font with glyf outlines")
+        tables = {}
+        for i in range(struct.unpack_from('>H', data, 4)[0]):
+            tag, _, offset, length = struct.unpack_from('>4sIII', data, 12 + 16 * i)
+            tables[tag.decode('latin-1')] = data[offset:offset + length]
+        missing = [tag for tag in _REQUIRED_TABLES if tag not in tables]
+        if missing:
+            raise ValueError(f"{path} has no {', '.join(missing)} table")
+        os2 = tables.get('OS/2')
+        if os2 is not None and struct.unpack_from('>H', os2, 8)[0] & 0x000F == 0x0002:
+            raise ValueError(f"{path} does not permit embedding")
+        self.family = family
+        self.tables = tables
+        head, hhea = tables['head'], tables['hhea']
+        scale = 1000.0 / struct.unpack_from('>H', head, 18)[0]
+        self.glyph_count = struct.unpack_from('>H', tables['maxp'], 4)[0]
+        self.metric_count = struct.unpack_from('>H', hhea, 34)[0]
+        if struct.unpack_from('>h', head, 50)[0]:
+            self.loca = _u32_array(tables['loca'])
+        else:
+            self.loca = array('I', (2 * v for v in _u32_array(tables['loca'], 'H')))
+        advances = _u32_array(tables['hmtx'][:4 * self.metric_count], 'H')[::2]
+        self.widths = [round(advances[min(g, self.metric_count - 1)] * scale) for g in range(self.glyph_count)]
+        cmap = _cmap(tables['cmap'])
+        # Code point -> glyph, and -> its literal string bytes for
+        # str.translate (unmapped text shows .notdef); glyph -> lowest code
+        # point for ToUnicode
+        self.glyphs = _DefaultMap(cmap, 0)
+        self.literals = _DefaultMap({code: _glyph_literal(glyph) for code, glyph in cmap.items()}, "\0\0")
+        self.words = _LiteralTable(self.literals)
+        self.unicodes = {}
+        for code, glyph in sorted(cmap.items(), reverse=True):
+            self.unicodes[glyph] = code
+        self.char_widths = _DefaultMap(((chr(code), self.widths[glyph]) for code, glyph in cmap.items()
+                                        if glyph < self.glyph_count), self.widths[0])
+        ascent, descent = struct.unpack_from('>hh', hhea, 4)
+        cap_height = ascent
+        weight = 400
+        if os2 is not None:
+            weight = struct.unpack_from('>H', os2, 4)[0]
+            if struct.unpack_from('>H', os2, 0)[0] >= 2:
+                cap_height = struct.unpack_from('>h', os2, 88)[0]
+        italic_angle = fixed_pitch = 0
+        post = tables.get('post')
+        if post is not None:
+            italic_angle = struct.unpack_from('>i', post, 4)[0] / 65536.0
+            fixed_pitch = struct.unpack_from('>I', post, 12)[0]
+        flags = 4 | (1 if fixed_pitch else 0) | (64 if italic_angle else 0)
+        bbox = " ".join(str(round(v * scale)) for v in struct.unpack_from('>4h', head, 36))
+        self.base_font = _postscript_name(tables.get('name')) or family
+        # Same StemV estimate from the weight class as FPDF uses
+        self.descriptor = ("/Flags %d /FontBBox [%s] /ItalicAngle %g /Ascent %d /Descent %d /CapHeight %d "
+                           "/StemV %d /MissingWidth %d" % (
+                               flags, bbox, italic_angle, round(ascent * scale), round(descent * scale),
+                               round(cap_height * scale), 50 + int((weight / 65.0) ** 2), self.widths[0]))
+        self.subset_cache = subset_cache
+        self._components = {}
+        self._chunks = {}  # (glyph, level) -> _glyph_chunk
+        self._subsets = OrderedDict()
+        self._stats = {"cache_hits": 0, "cache_misses": 0}
+        self._lock = threading.Lock()
+    def glyph_data(self, glyph):
+        return self.tables['glyf'][self.loca[glyph]:self.loca[glyph + 1]]
+    def components(self, glyph):
+        """Glyph ids a composite glyph is built from (empty for simple glyphs)"""
+        parts = self._components.get(glyph)
+        if parts is None:
+            parts = []
+            data = self.glyph_data(glyph)
+            if len(data) >= 10 and struct.unpack_from('>h', data)[0] < 0:
+                pos = 10
+                while True:
+                    flags, part = struct.unpack_from('>HH', data, pos)
+                    parts.append(part)
+                    # arguments as words or bytes, then no scale, one, x/y or a 2x2 matrix
+                    pos += 4 + (4 if flags & 0x0001 else 2) + (
+                        2 if flags & 0x0008 else 4 if flags & 0x0040 else 8 if flags & 0x0080 else 0)
+                    if not flags & 0x0020:
+                        break
+            self._components[glyph] = parts
+        return parts
+    def subset(self, chars, level):
+        """The embedding for a document showing `chars`: (tag, /W array, ToUnicode tail, FontFile2 tail)"""
+        shown = frozenset(self.glyphs[ord(c)] for c in chars)
+        key = (shown, level)
+        with self._lock:
+            entry = self._subsets.get(key)
+            if entry is not None:
+                self._subsets.move_to_end(key)
+                self._stats["cache_hits"] += 1
+                return entry
+            self._stats["cache_misses"] += 1
+        entry = self._build_subset(shown, level)
+        with self._lock:
+            self._subsets[key] = entry
+            while len(self._subsets) > self.subset_cache:
+                self._subsets.popitem(last=False)
+        return entry
+    def _glyph_chunk(self, glyph, level):
+        """A glyph's outline padded to 4 bytes, its checksum, and its own byte-aligned raw deflate chunk at `level`"""
+        chunk = self._chunks.get((glyph, level))
+        if chunk is None:
+            data = self.glyph_data(glyph)
+            data += b"\0" * (-len(data) % 4)
+            deflated = b""
+            if level:
+                deflate = zlib.compressobj(level, zlib.DEFLATED, -15)
+                deflated = deflate.compress(data) + deflate.flush(zlib.Z_SYNC_FLUSH)
+            chunk = self._chunks[(glyph, level)] = (data, checksum(data), deflated)
+        return chunk
+    def _build_subset(self, shown, level):
+        keep = {0}
+        pending = list(shown)
+        while pending:
+            glyph = pending.pop()
+            if glyph not in keep and glyph < self.glyph_count:
+                keep.add(glyph)
+                pending.extend(self.components(glyph))
+        # Glyph ids must not move, so the subset runs up to the highest kept
+        # glyph and leaves everything else empty; hmtx is cut at the same point
+        count = max(keep) + 1
+        kept = sorted(keep)
+        glyphs = [self._glyph_chunk(glyph, level) for glyph in kept]
+        lengths = [0] * count
+        for glyph, (data, _, _) in zip(kept, glyphs):
+            lengths[glyph] = len(data)
+        loca = array('I', accumulate(lengths, initial=0))
+        if sys.byteorder == 'little':
+            loca.byteswap()
+        metrics = min(count, self.metric_count)
+        tables = {tag: self.tables[tag] for tag in _SUBSET_TABLES if tag in self.tables and tag != 'glyf'}
+        tables['loca'] = loca.tobytes()
+        tables['hmtx'] = self.tables['hmtx'][:4 * metrics + 2 * (count - metrics)]
+        tables['hhea'] = self.tables['hhea'][:34] + struct.pack('>H', metrics) + self.tables['hhea'][36:]
+        tables['maxp'] = self.tables['maxp'][:4] + struct.pack('>H', count) + self.tables['maxp'][6:]
+        # Long loca offsets, checkSumAdjustment filled in once the file is complete
+        head = self.tables['head']
+        tables['head'] = head[:8] + b"\0\0\0\0" + head[12:50] + b"\x00\x01" + head[52:]
+        used = sorted(g for g in shown if g < self.glyph_count)
+        tag = ''.join(chr(65 + b % 26) for b in hashlib.sha256(array('H', used).tobytes()).digest()[:6])
+        return tag, self._width_array(used), self._to_unicode(used, level), self._font_file(tables, glyphs, level)
+    def _font_file(self, tables, glyphs, level):
+        """FontFile2 stream tail for `tables` plus a glyf table of `glyphs` from _glyph_chunk
+
+        glyf is stored last, so the compressed stream is the rest of the file
+        deflated now followed by the glyphs' cached chunks (each byte-aligned
+        and referring to nothing before it), a final empty block and the
+        adler32 of everything.
+        """
+        count = len(tables) + 1
+        selector = count.bit_length() - 1
+        offset = 12 + 16 * count
+        records = {}
+        body = []
+        for tag, data in sorted(tables.items()):
+            records[tag] = (checksum(data), offset, len(data))
+            data += b"\0" * (-len(data) % 4)
+            body.append(data)
+            offset += len(data)
+        records['glyf'] = (sum(checksum for _, checksum, _ in glyphs) & 0xFFFFFFFF, offset,
+                           sum(len(data) for data, _, _ in glyphs))
+        directory = struct.pack('>IHHHH', 0x00010000, count, 16 << selector, selector, 16 * count - (16 << selector))
+        directory += b"".join(struct.pack('>4sIII', tag.encode('latin-1'), *records[tag]) for tag in sorted(records))
+        # Every table is 4-byte aligned, so the file's checksum is the sum of its parts
+        total = checksum(directory) + sum(checksum for checksum, _, _ in records.values())
+        i = sorted(tables).index('head')
+        body[i] = body[i][:8] + struct.pack('>I', (0xB1B0AFBA - total) & 0xFFFFFFFF) + body[i][12:]
+        prefix = directory + b"".join(body)
+        length = len(prefix) + records['glyf'][2]
+        if not level:
+            return _stream_tail(b"".join([prefix] + [data for data, _, _ in glyphs]), b" /Length1 %d" % length)
+        adler = zlib.adler32(prefix)
+        for data, _, _ in glyphs:
+            adler = zlib.adler32(data, adler)
+        deflate = zlib.compressobj(level, zlib.DEFLATED, -15)
+        data = b"".join([b"\x78\x9c", deflate.compress(prefix), deflate.flush(zlib.Z_SYNC_FLUSH)]
+                        + [deflated for _, _, deflated in glyphs] + [b"\x03\x00", struct.pack('>I', adler)])
+        return _stream_tail(data, b" /Length1 %d /Filter /FlateDecode" % length)
+    def _width_array(self, used):
+        """/W entries for the shown glyphs, one run per stretch of consecutive ids"""
+        runs = []
+        for glyph in used:
+            if runs and runs[-1][-1][0] == glyph - 1:
+                runs[-1].append((glyph, self.widths[glyph]))
+            else:
+                runs.append([(glyph, self.widths[glyph])])
+        return b" ".join(b"%d [%s]" % (run[0][0], b" ".join(b"%d" % w for _, w in run)) for run in runs)
+    def _to_unicode(self, used, level):
+        pairs = [b"<%04x> <%s>" % (g, chr(self.unicodes[g]).encode('utf-16-be').hex().encode('ascii'))
+                 for g in used if g in self.unicodes]
+        blocks = [b"%d beginbfchar\n%s\nendbfchar\n" % (len(pairs[i:i + 100]), b"\n".join(pairs[i:i + 100]))
+                  for i in range(0, len(pairs), 100)]
+        data = _TOUNICODE_HEAD + b"".join(blocks) + _TOUNICODE_TAIL
+        if not level:
+            return _stream_tail(data)
+        return _stream_tail(zlib.compress(data, level), b" /Filter /FlateDecode")
+    def subset_stats(self):
+        """Subset cache counters and the number of cached subsets"""
+        with self._lock:
+            return dict(self._stats, subsets=len(self._subsets))
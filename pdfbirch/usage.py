@@ -0,0 +1,292 @@
+"""Daily download counts per user, and the quota admit() reserves from.
+
+Server-side download counts per user and UTC day. USAGE_STORE picks the
+backend: 'postgres' (DATABASE_URL through a psycopg2 ThreadedConnectionPool
+shared with the rate limiter; the default when DATABASE_URL is set),
+'sqlite' (USAGE_SQLITE_PATH, a stand-in for local runs and tests) or '' to
+turn counting off. Requests never wait on a write: increments collect in
+memory and a background thread upserts them in one batch every
+USAGE_FLUSH_INTERVAL seconds (and at exit). Reads go through an in-process
+LRU that is refreshed after USAGE_CACHE_TTL seconds; a user's count is the
+cached stored value plus this process's unwritten increments, so other
+processes' downloads show up within the TTL.
+With USAGE_DAILY_LIMIT > 0 requests past the limit get 429: admit() takes
+the request's downloads from the quota in the store with one conditional
+upsert (check and increment in a single statement, so concurrent requests
+across processes can't both slip under the limit), and a build that fails
+hands them back through settle_usage(). Without a limit nothing is reserved
+and downloads are counted, batched as above, once they were delivered. If
+the database is unreachable counting fails open on the local count and
+increments are retried later.
+"""
+import atexit
+import os
+import threading
+import time
+from collections import OrderedDict
+from .metrics import log_event
+DATABASE_URL = os.getenv('DATABASE_URL')
+USAGE_STORE = os.getenv('USAGE_STORE', 'postgres' if DATABASE_URL else '')
+USAGE_SQLITE_PATH = os.getenv('USAGE_SQLITE_PATH', '/tmp/pdfbirch-usage.sqlite3')
+DATABASE_POOL_SIZE = int(os.getenv('DATABASE_POOL_SIZE', '4'))
+USAGE_DAILY_LIMIT = int(os.getenv('USAGE_DAILY_LIMIT', '0'))
+USAGE_FLUSH_INTERVAL = float(os.getenv('USAGE_FLUSH_INTERVAL', '2'))
+USAGE_CACHE_TTL = float(os.getenv('USAGE_CACHE_TTL', '30'))
+USAGE_CACHE_SIZE = int(os.getenv('USAGE_CACHE_SIZE', '10000'))
+USAGE_CONNECT_RETRY = 30  # seconds between attempts to open an unreachable store
+_USAGE_UPSERT = ("INSERT INTO usage (email, day, downloads) VALUES {} "
+                 "ON CONFLICT (email, day) DO UPDATE SET downloads = usage.downloads + excluded.downloads")
+_USAGE_SELECT = "SELECT downloads FROM usage WHERE email = {0} AND day = {0}"
+_USAGE_RESERVE = ("INSERT INTO usage (email, day, downloads) VALUES ({0}, {0}, {0}) "
+                  "ON CONFLICT (email, day) DO UPDATE SET downloads = usage.downloads + excluded.downloads "
+                  "WHERE usage.downloads + excluded.downloads <= {0} RETURNING downloads")
+_pg_pool = None
+_pg_pool_lock = threading.Lock()
+_usage_store = None
+_usage_store_retry_at = 0.0
+_usage_store_lock = threading.Lock()
+_usage_lock = threading.Lock()
+_usage_flush_lock = threading.Lock()
+_usage_pending = {}  # (email, day) -> increments not yet handed to the store
+_usage_inflight = {}  # (email, day) -> increments in the batch being written
+_usage_cache = OrderedDict()  # (email, day) -> (stored count, fetched at)
+_usage_thread = None
+_usage_stats = {"cache_hits": 0, "cache_misses": 0, "flushes": 0, "rows_written": 0, "errors": 0}
+def pg_run(fn):
+    """Run fn(cursor) in one transaction on a connection from the process-wide DATABASE_URL pool"""
+    global _pg_pool
+    if _pg_pool is None:
+        with _pg_pool_lock:
+            if _pg_pool is None:
+                from psycopg2.pool import ThreadedConnectionPool
+                _pg_pool = ThreadedConnectionPool(1, DATABASE_POOL_SIZE, DATABASE_URL)
+    conn = _pg_pool.getconn()
+    try:
+        with conn:  # commits, or rolls back on error
+            with conn.cursor() as cur:
+                return fn(cur)
+    finally:
+        # Don't hand a broken connection to the next caller
+        _pg_pool.putconn(conn, close=bool(conn.closed))
+class PostgresUsageStore:
+    """Daily download counts in PostgreSQL, through the shared connection pool"""
+    def __init__(self):
+        pg_run(lambda cur: cur.execute(
+            "CREATE TABLE IF NOT EXISTS usage (email TEXT NOT NULL, day DATE NOT NULL, "
+            "downloads INTEGER NOT NULL DEFAULT 0, PRIMARY KEY (email, day))"))
+    def fetch(self, email, day):
+        def select(cur):
+            cur.execute(_USAGE_SELECT.format('%s'), (email, day))
+            row = cur.fetchone()
+            return row[0] if row else 0
+        return pg_run(select)
+    def add(self, rows):
+        from psycopg2.extras import execute_values
+        # One multi-row INSERT per page of rows rather than a statement per row
+        pg_run(lambda cur: execute_values(cur, _USAGE_UPSERT.format('%s'), rows, page_size=500))
+    def reserve(self, email, day, count, limit):
+        def upsert(cur):
+            cur.execute(_USAGE_RESERVE.format('%s'), (email, day, count, limit))
+            row = cur.fetchone()
+            return row[0] if row else None
+        return pg_run(upsert)
+class SqliteUsageStore:
+    """Daily download counts in a SQLite file; a stand-in for PostgreSQL"""
+    def __init__(self, path):
+        import sqlite3
+        self.db = sqlite3.connect(path, timeout=10, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS usage (email TEXT NOT NULL, day TEXT NOT NULL, "
+                        "downloads INTEGER NOT NULL DEFAULT 0, PRIMARY KEY (email, day))")
+        self.lock = threading.Lock()
+    def fetch(self, email, day):
+        with self.lock:
+            row = self.db.execute(_USAGE_SELECT.format('?'), (email, day)).fetchone()
+        return row[0] if row else 0
+    def add(self, rows):
+        with self.lock, self.db:
+            self.db.executemany(_USAGE_UPSERT.format('(?, ?, ?)'), rows)
+    def reserve(self, email, day, count, limit):
+        with self.lock, self.db:
+            row = self.db.execute(_USAGE_RESERVE.format('?'), (email, day, count, limit)).fetchone()
+        return row[0] if row else None
+def get_usage_store():
+    """Open the configured usage store on first use; None when counting is off or the store is unreachable"""
+    global _usage_store, _usage_store_retry_at
+    if _usage_store is not None or not USAGE_STORE:
+        return _usage_store
+    with _usage_store_lock:
+        if _usage_store is None and time.monotonic() >= _usage_store_retry_at:
+            try:
+                if USAGE_STORE == 'sqlite':
+                    _usage_store = SqliteUsageStore(USAGE_SQLITE_PATH)
+                else:
+                    _usage_store = PostgresUsageStore()
+            except Exception as e:
+                log_event('usage_store_error', 'error', store=USAGE_STORE, error=str(e))
+                _usage_store_retry_at = time.monotonic() + USAGE_CONNECT_RETRY
+    return _usage_store
+def _usage_key(email):
+    return (email, time.strftime('%Y-%m-%d', time.gmtime()))
+def _usage_cache_put(key, stored):
+    # Caller holds _usage_lock
+    _usage_cache[key] = (stored, time.monotonic())
+    _usage_cache.move_to_end(key)
+    while len(_usage_cache) > USAGE_CACHE_SIZE:
+        _usage_cache.popitem(last=False)
+def get_usage(email):
+    """Downloads `email` has made today (UTC), including ones not yet written to the store"""
+    if not USAGE_STORE:
+        return 0
+    key = _usage_key(email)
+    now = time.monotonic()
+    with _usage_lock:
+        entry = _usage_cache.get(key)
+        if entry is not None and now - entry[1] < USAGE_CACHE_TTL:
+            _usage_cache.move_to_end(key)
+            _usage_stats["cache_hits"] += 1
+            return entry[0] + _usage_pending.get(key, 0) + _usage_inflight.get(key, 0)
+        _usage_stats["cache_misses"] += 1
+    store = get_usage_store()
+    stored = entry[0] if entry is not None else 0
+    if store is not None:
+        try:
+            stored = store.fetch(*key)
+        except Exception as e:
+            log_event('usage_read_error', 'error', error=str(e))
+            with _usage_lock:
+                _usage_stats["errors"] += 1
+        else:
+            with _usage_lock:
+                _usage_cache_put(key, stored)
+    with _usage_lock:
+        return stored + _usage_pending.get(key, 0) + _usage_inflight.get(key, 0)
+def record_usage(email, count=1):
+    """Count `count` downloads for `email`; written to the store by the next flush"""
+    if not USAGE_STORE:
+        return
+    key = _usage_key(email)
+    with _usage_lock:
+        _usage_pending[key] = _usage_pending.get(key, 0) + count
+    start_usage_flusher()
+def flush_usage():
+    """Write all pending increments to the store in one batch and return how many rows were written"""
+    store = get_usage_store()
+    if store is None:
+        return 0
+    with _usage_flush_lock:
+        with _usage_lock:
+            if not _usage_pending:
+                return 0
+            _usage_inflight.update(_usage_pending)
+            _usage_pending.clear()
+            rows = [(email, day, n) for (email, day), n in _usage_inflight.items()]
+        try:
+            store.add(rows)
+        except Exception as e:
+            log_event('usage_write_error', 'error', rows=len(rows), error=str(e))
+            with _usage_lock:
+                for key, n in _usage_inflight.items():
+                    _usage_pending[key] = _usage_pending.get(key, 0) + n
+                _usage_inflight.clear()
+                _usage_stats["errors"] += 1
+            return 0
+        with _usage_lock:
+            # The store now has these increments, so fold them into the cached values
+            for key, n in _usage_inflight.items():
+                entry = _usage_cache.get(key)
+                if entry is not None:
+                    _usage_cache[key] = (entry[0] + n, entry[1])
+            _usage_inflight.clear()
+            _usage_stats["flushes"] += 1
+            _usage_stats["rows_written"] += len(rows)
+    return len(rows)
+def _usage_flusher():
+    while True:
+        time.sleep(USAGE_FLUSH_INTERVAL)
+        try:
+            flush_usage()
+        except Exception as e:
+            log_event('usage_flush_error', 'error', exc_info=True, error=str(e))
+def start_usage_flusher():
+    """Start the background flush thread once"""
+    global _usage_thread
+    if _usage_thread is not None:
+        return
+    with _usage_lock:
+        if _usage_thread is None:
+            _usage_thread = threading.Thread(target=_usage_flusher, name='usage-flush', daemon=True)
+            _usage_thread.start()
+            atexit.register(flush_usage)
+def usage_reserved():
+    """Whether admit() takes downloads from a daily quota up front"""
+    return USAGE_DAILY_LIMIT > 0 and bool(USAGE_STORE)
+def _usage_reset_after():
+    return 86400 - int(time.time()) % 86400
+def reserve_usage(email, count=1):
+    """Take `count` downloads from today's quota in one conditional upsert; None if taken, else seconds until reset"""
+    if not usage_reserved():
+        return None
+    if count > USAGE_DAILY_LIMIT:
+        return _usage_reset_after()
+    key = _usage_key(email)
+    store = get_usage_store()
+    if store is not None:
+        try:
+            stored = store.reserve(*key, count, USAGE_DAILY_LIMIT)
+        except Exception as e:
+            log_event('usage_reserve_error', 'error', error=str(e))
+            with _usage_lock:
+                _usage_stats["errors"] += 1
+        else:
+            if stored is None:
+                return _usage_reset_after()
+            with _usage_lock:
+                _usage_cache_put(key, stored)
+            return None
+    # No store to ask: fail open on what this process knows
+    if get_usage(email) + count > USAGE_DAILY_LIMIT:
+        return _usage_reset_after()
+    record_usage(email, count)
+    return None
+def refund_usage(email, count=1):
+    """Give back `count` downloads reserved by reserve_usage() whose build failed"""
+    key = _usage_key(email)
+    store = get_usage_store()
+    if store is not None:
+        try:
+            store.add([(*key, -count)])
+        except Exception as e:
+            log_event('usage_write_error', 'error', rows=1, error=str(e))
+        else:
+            with _usage_lock:
+                entry = _usage_cache.get(key)
+                if entry is not None:
+                    _usage_cache[key] = (entry[0] - count, entry[1])
+            return
+    record_usage(email, -count)
+def settle_usage(email, count=1, delivered=True):
+    """Finish the accounting for `count` admitted downloads once their build succeeded or failed"""
+    if usage_reserved():
+        if not delivered:
+            refund_usage(email, count)
+    elif delivered:
+        record_usage(email, count)
+def settled_chunks(chunks, email, count=1):
+    """Pass a streamed build through and settle its usage at the end; only a failing build hands it back"""
+    # A client that goes away mid-stream (GeneratorExit) still used the build
+    failed = False
+    try:
+        yield from chunks
+    except Exception:
+        failed = True
+        raise
+    finally:
+        settle_usage(email, count, not failed)
+def usage_stats():
+    """Return usage cache and flush counters"""
+    with _usage_lock:
+        stats = dict(_usage_stats)
+        stats["cached_users"] = len(_usage_cache)
+        stats["pending_rows"] = len(_usage_pending)
+    return stats
@@ -0,0 +1,53 @@
+"""Shared fixtures: api/index.py imported offline, with state that tests may touch reset per test."""
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+API_DIR = os.path.join(ROOT, 'api')
+TEST_EMAIL = 'test@pdfbirch.app'
+
+# Settings read at import time; keep the suite offline and free of leftovers from other runs
+os.environ.setdefault('LOG_LEVEL', 'error')
+os.environ.setdefault('RATE_LIMIT_RATE', '0')
+os.environ.setdefault('PDF_CACHE_DIR', '')
+os.environ.pop('DATABASE_URL', None)
+os.environ.pop('USAGE_STORE', None)
+# The pdfbirch package lives at the repository root; index.py and asgi.py are top-level modules in api/
+for path in (ROOT, API_DIR):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+import index  # noqa: E402
+
+
+@pytest.fixture
+def app_index():
+    return index
+
+
+@pytest.fixture
+def client(monkeypatch):
+    """Flask test client where any non-empty token verifies as TEST_EMAIL"""
+    monkeypatch.setattr(index, 'verify_firebase_token', lambda token: TEST_EMAIL if token else None)
+    return index.app.test_client()
+
+
+@pytest.fixture
+def auth():
+    return {'Authorization': 'Bearer test'}
+
+
+@pytest.fixture
+def asgi_client(monkeypatch):
+    """Starlette test client for asgi.py where any non-empty token verifies as TEST_EMAIL"""
+    pytest.importorskip('starlette')
+    pytest.importorskip('httpx')
+    from starlette.testclient import TestClient
+    import asgi
+
+    async def verify_token(token):
+        return TEST_EMAIL if token else None
+    monkeypatch.setattr(asgi, 'verify_token', verify_token)
+    return TestClient(asgi.app)
@@ -0,0 +1,74 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip('starlette')
+
+import asgi  # noqa: E402
+from pdfbirch import usage  # noqa: E402
+
+
+@pytest.fixture
+def charged(monkeypatch):
+    """Every record_usage call as (email, count)"""
+    calls = []
+    monkeypatch.setattr(usage, 'record_usage', lambda email, count=1: calls.append((email, count)))
+    return calls
+
+
+@pytest.mark.parametrize('path, body', [
+    ('/api/download', {}),
+    ('/api/download', {'seed': 'busy'}),
+    ('/api/download_batch', {'count': 2}),
+])
+def test_busy_server_refuses_before_charging(asgi_client, auth, charged, monkeypatch, path, body):
+    monkeypatch.setattr(asgi, 'ASGI_MAX_BUILDS', 0)
+    resp = asgi_client.post(path, json=body, headers=auth)
+    assert resp.status_code == 503
+    assert resp.headers['Retry-After'] == '1'
+    assert charged == []
+    assert asgi._builds == 0
+
+
+@pytest.mark.parametrize('path, body', [
+    ('/api/download', {}),
+    ('/api/download', {'seed': 'slot'}),
+    ('/api/download_batch', {'count': 2}),
+])
+def test_build_slots_are_released(asgi_client, auth, charged, path, body):
+    resp = asgi_client.post(path, json=body, headers=auth)
+    assert resp.status_code == 200
+    assert len(charged) == 1
+    assert asgi._builds == 0
+
+
+def test_refused_request_releases_its_slot(app_index, asgi_client, auth, charged, monkeypatch):
+    monkeypatch.setattr(app_index, 'admit', lambda email, count=1: ("Too many requests", 7))
+    resp = asgi_client.post('/api/download', json={}, headers=auth)
+    assert resp.status_code == 429
+    assert charged == []
+    assert asgi._builds == 0
+
+
+def test_streamed_build_holds_its_slot_until_sent(asgi_client, auth, charged, monkeypatch):
+    seen = []
+    real = asgi.stream_build
+
+    async def watching(chunks):
+        async for data in real(chunks):
+            seen.append(asgi._builds)
+            yield data
+    monkeypatch.setattr(asgi, 'stream_build', watching)
+    resp = asgi_client.post('/api/download', json={}, headers=auth)
+    assert resp.content.startswith(b'%PDF') and resp.content.rstrip().endswith(b'%%EOF')
+    assert seen and all(n == 1 for n in seen)
+    assert asgi._builds == 0
+
+
+def test_stream_sends_the_first_chunk_alone(monkeypatch):
+    monkeypatch.setattr(asgi, 'ASGI_STREAM_CHUNK', 10)
+    chunks = [b'%PDF-1.4\n', b'a' * 4, b'b' * 4, b'c' * 4, b'd']
+
+    async def collect():
+        return [data async for data in asgi.stream_build(iter(chunks))]
+    assert asyncio.run(collect()) == [b'%PDF-1.4\n', b'aaaabbbbcccc', b'd']
@@ -0,0 +1,147 @@
+import datetime
+import json
+import time
+from collections import OrderedDict
+
+import pytest
+
+jwt = pytest.importorskip('jwt')
+x509 = pytest.importorskip('cryptography.x509')
+from cryptography.hazmat.primitives import hashes, serialization  # noqa: E402
+from cryptography.hazmat.primitives.asymmetric import rsa  # noqa: E402
+from cryptography.x509.oid import NameOID  # noqa: E402
+
+from pdfbirch import auth as auth_module  # noqa: E402
+
+PROJECT = 'pdfbirch-test'
+KID = 'test-kid'
+EMAIL = 'local@pdfbirch.app'
+
+
+def _self_signed(key):
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, 'pdfbirch-test')])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    cert = (x509.CertificateBuilder().subject_name(name).issuer_name(name)
+            .public_key(key.public_key()).serial_number(1)
+            .not_valid_before(now - datetime.timedelta(minutes=1))
+            .not_valid_after(now + datetime.timedelta(days=1))
+            .sign(key, hashes.SHA256()))
+    return cert.public_bytes(serialization.Encoding.PEM).decode('ascii')
+
+
+@pytest.fixture(scope='module')
+def signing_key():
+    return rsa.generate_private_key(public_exponent=65537, key_size=2048)
+
+
+@pytest.fixture
+def local_auth(monkeypatch, tmp_path, signing_key):
+    """TOKEN_VERIFIER=local against a throwaway cert loaded from FIREBASE_PUBLIC_KEYS_FILE"""
+    keys_file = tmp_path / 'keys.json'
+    keys_file.write_text(json.dumps({KID: _self_signed(signing_key)}))
+    monkeypatch.setattr(auth_module, 'TOKEN_VERIFIER', 'local')
+    monkeypatch.setattr(auth_module, 'TOKEN_CHECK_REVOKED', False)
+    monkeypatch.setattr(auth_module, 'TOKEN_CLOCK_SKEW', 0)
+    monkeypatch.setattr(auth_module, 'FIREBASE_PROJECT_ID', PROJECT)
+    monkeypatch.setattr(auth_module, 'FIREBASE_PUBLIC_KEYS_FILE', str(keys_file))
+    monkeypatch.setattr(auth_module, '_signing_keys', {})
+    monkeypatch.setattr(auth_module, '_signing_keys_ready', False)
+    monkeypatch.setattr(auth_module, '_token_cache', OrderedDict())
+    # The keys file must make an unknown kid fail without touching the network
+    monkeypatch.setattr(auth_module, 'refresh_signing_keys', lambda: pytest.fail("network key refresh"))
+    return auth_module
+
+
+def _claims(**overrides):
+    now = int(time.time())
+    claims = {'iss': f'https://securetoken.google.com/{PROJECT}', 'aud': PROJECT, 'sub': 'uid-1',
+              'iat': now - 10, 'exp': now + 3600, 'auth_time': now - 10, 'email': EMAIL}
+    claims.update(overrides)
+    return {k: v for k, v in claims.items() if v is not None}
+
+
+def _token(key, claims=None, algorithm='RS256', kid=KID):
+    return jwt.encode(claims or _claims(), key, algorithm=algorithm, headers={'kid': kid})
+
+
+def test_valid_token_is_accepted_and_cached(local_auth, signing_key):
+    token = _token(signing_key)
+    claims = local_auth.verify_token_locally(token)
+    assert claims['sub'] == 'uid-1' and claims['email'] == EMAIL
+    assert local_auth.verify_firebase_token(token) == EMAIL
+    assert local_auth._token_cache_get(local_auth._token_cache_key(token)) == EMAIL
+
+
+@pytest.mark.parametrize('overrides', [
+    {'aud': 'some-other-project'},
+    {'iss': 'https://securetoken.google.com/some-other-project'},
+    {'exp': int(time.time()) - 60},
+    {'iat': int(time.time()) + 600},
+    {'auth_time': int(time.time()) + 600},
+    {'sub': None},
+    {'sub': ''},
+], ids=['aud', 'iss', 'expired', 'future-iat', 'future-auth-time', 'missing-sub', 'empty-sub'])
+def test_bad_claims_are_rejected(local_auth, signing_key, overrides):
+    with pytest.raises(Exception):
+        local_auth.verify_token_locally(_token(signing_key, _claims(**overrides)))
+
+
+def test_non_rs256_algorithm_is_rejected(local_auth, signing_key):
+    with pytest.raises(ValueError, match='algorithm'):
+        local_auth.verify_token_locally(_token('x' * 32, algorithm='HS256'))
+    with pytest.raises(ValueError, match='algorithm'):
+        local_auth.verify_token_locally(_token(signing_key, algorithm='RS512'))
+
+
+def test_unknown_kid_is_rejected(local_auth, signing_key):
+    with pytest.raises(ValueError, match='Unknown signing key'):
+        local_auth.verify_token_locally(_token(signing_key, kid='rotated-away'))
+
+
+def test_token_from_another_key_is_rejected(local_auth):
+    other = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    with pytest.raises(jwt.InvalidSignatureError):
+        local_auth.verify_token_locally(_token(other))
+
+
+def test_failures_are_never_cached(local_auth, signing_key, monkeypatch):
+    puts = []
+    real_put = local_auth._token_cache_put
+    monkeypatch.setattr(local_auth, '_token_cache_put', lambda *a: (puts.append(a), real_put(*a)))
+    bad = [_token(signing_key, _claims(aud='some-other-project')),
+           _token(signing_key, kid='rotated-away'),
+           _token('x' * 32, algorithm='HS256'),
+           'not-a-jwt']
+    for token in bad:
+        assert local_auth.verify_firebase_token(token) is None
+        assert local_auth.verify_firebase_token(token) is None
+    assert puts == []
+    assert len(local_auth._token_cache) == 0
+
+
+def test_revocation_checks_bypass_the_cache_by_default(monkeypatch):
+    monkeypatch.setattr(auth_module, '_token_cache', OrderedDict())
+    monkeypatch.setattr(auth_module, 'TOKEN_CHECK_REVOKED', True)
+    monkeypatch.setattr(auth_module, 'TOKEN_REVOCATION_TTL', 0)
+    calls = []
+
+    def verify(token, check_revoked, clock_skew_seconds):
+        calls.append(check_revoked)
+        return {'email': EMAIL, 'exp': time.time() + 3600}
+    monkeypatch.setattr(auth_module, 'init_firebase', lambda: None)
+    monkeypatch.setattr(auth_module, 'firebase_auth', type('Auth', (), {'verify_id_token': staticmethod(verify)}),
+                        raising=False)
+    assert auth_module.verify_firebase_token('tok') == EMAIL
+    assert auth_module.verify_firebase_token('tok') == EMAIL
+    assert calls == [True, True]
+    assert len(auth_module._token_cache) == 0
+
+
+def test_revocation_ttl_opts_in_to_a_short_cache(monkeypatch):
+    monkeypatch.setattr(auth_module, '_token_cache', OrderedDict())
+    monkeypatch.setattr(auth_module, 'TOKEN_CHECK_REVOKED', True)
+    monkeypatch.setattr(auth_module, 'TOKEN_REVOCATION_TTL', 30)
+    key = auth_module._token_cache_key('tok')
+    auth_module._token_cache_put(key, EMAIL, {'exp': time.time() + 3600})
+    assert auth_module._token_cache_get(key) == EMAIL
+    assert auth_module._token_cache[key][1] <= time.time() + 30
@@ -0,0 +1,70 @@
+import io
+import os
+import subprocess
+import sys
+import tarfile
+
+import pytest
+
+from conftest import ROOT
+from pdfbirch.corpus import PackedCorpus
+from pdfbirch.render import render_document
+from pdfbirch.spec import request_doc_spec
+
+SPEC_ARGS = ['--pages', '2', '--lines', '5', '--fonts', 'Courier,Times', '--quiet']
+
+
+def _cli(*args):
+    return subprocess.run([sys.executable, '-m', 'pdfbirch.cli', *args, *SPEC_ARGS], cwd=ROOT, check=True,
+                          capture_output=True)
+
+
+def _spec():
+    return request_doc_spec({'pages': 2, 'lines': 5, 'fonts': 'Courier,Times'}, 1, {})
+
+
+def _members(data):
+    with tarfile.open(fileobj=io.BytesIO(data), mode='r:*') as tar:
+        return [(m.name, m.mtime, tar.extractfile(m).read()) for m in tar.getmembers()]
+
+
+@pytest.mark.parametrize('suffix', ['.tar', '.tar.gz'])
+def test_seeded_tar_is_identical_for_any_worker_count(tmp_path, suffix):
+    outputs = []
+    for workers in ('1', '2'):
+        out = tmp_path / f'docs-{workers}{suffix}'
+        _cli('generate', '--count', '6', '--seed', 'cli', '--tar', str(out), '--workers', workers)
+        outputs.append(out.read_bytes())
+    assert outputs[0] == outputs[1]
+    members = _members(outputs[0])
+    spec = _spec()
+    assert [doc for _, _, doc in members] == [render_document(f'cli/{i}', spec) for i in range(6)]
+    assert [name[:7] for name, _, _ in members] == [f'{i:06d}_' for i in range(1, 7)]
+    assert all(mtime == 0 for _, mtime, _ in members)
+
+
+def test_tar_to_stdout(tmp_path):
+    out = tmp_path / 'docs.tar'
+    _cli('generate', '--count', '2', '--seed', 'cli', '--tar', str(out), '--workers', '1')
+    data = _cli('generate', '--count', '2', '--seed', 'cli', '--tar', '-', '--workers', '1').stdout
+    assert data == out.read_bytes()
+
+
+@pytest.mark.parametrize('workers', ['1', '2'])
+def test_build_corpus_round_trip(tmp_path, workers):
+    out = tmp_path / 'corpus.pack'
+    result = _cli('build-corpus', '--out', str(out), '--count', '5', '--workers', workers)
+    assert b'packed 5 documents' in result.stderr
+    corpus = PackedCorpus(str(out))
+    assert len(corpus) == 5
+    assert corpus.spec == _spec()
+    docs = [bytes(corpus.document(i)) for i in range(5)]
+    assert all(doc.startswith(b'%PDF') and doc.rstrip().endswith(b'%%EOF') for doc in docs)
+    assert len(set(docs)) == 5
+    assert [name for name in os.listdir(tmp_path)] == ['corpus.pack']
+
+
+def test_bad_arguments_exit_with_usage(tmp_path):
+    with pytest.raises(subprocess.CalledProcessError) as e:
+        _cli('generate', '--count', '0', '--out', str(tmp_path))
+    assert e.value.returncode == 2 and b'--count must be at least 1' in e.value.stderr
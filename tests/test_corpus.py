@@ -0,0 +1,171 @@
+import json
+import os
+import struct
+
+import pytest
+from werkzeug.wsgi import FileWrapper
+
+from pdfbirch import corpus as packs
+from pdfbirch.layout import DEFAULT_DOC_SPEC
+
+DOCS = [b'%PDF-1.4 first\n%%EOF\n', b'%PDF-1.4 second document\n%%EOF\n', b'%PDF-1.4 3\n%%EOF\n']
+
+
+@pytest.fixture
+def pack(monkeypatch, tmp_path):
+    """A pack of DOCS at PDF_CORPUS_PATH, checked for rebuilds on every request"""
+    path = str(tmp_path / 'corpus.pack')
+    packs.write_corpus(path, DOCS)
+    monkeypatch.setattr(packs, 'PDF_CORPUS_PATH', path)
+    monkeypatch.setattr(packs, 'PDF_CORPUS_CHECK_INTERVAL', 0)
+    monkeypatch.setattr(packs, '_corpus', None)
+    monkeypatch.setattr(packs, '_corpus_checked_at', float('-inf'))
+    monkeypatch.setattr(packs, '_corpus_stats', {"served": 0, "sendfile": 0, "reloads": 0})
+    return path
+
+
+def test_pack_layout(pack):
+    with open(pack, 'rb') as f:
+        data = f.read()
+    assert data[:8] == b'PDFBPACK'
+    meta_len, = struct.unpack_from('<I', data, 8)
+    meta = json.loads(data[12:12 + meta_len])
+    assert meta['version'] == 1
+    assert meta['spec'] == json.loads(json.dumps(DEFAULT_DOC_SPEC._asdict()))
+    index_at, count, magic = struct.unpack_from('<QQ8s', data, len(data) - 24)
+    assert (count, magic) == (len(DOCS), b'PDFBPACK')
+    offsets = struct.unpack_from('<%dQ' % (count + 1), data, index_at)
+    assert offsets[0] == 12 + meta_len and offsets[-1] == index_at
+    assert [data[a:b] for a, b in zip(offsets, offsets[1:])] == DOCS
+
+    corpus = packs.PackedCorpus(pack)
+    assert len(corpus) == len(DOCS) and corpus.spec == DEFAULT_DOC_SPEC
+    for i, doc in enumerate(DOCS):
+        view = corpus.document(i)
+        assert isinstance(view, memoryview) and view.obj is corpus.mm
+        assert view == doc
+        assert corpus.span(i) == (offsets[i], len(doc))
+
+
+def _damage(path, at, data):
+    with open(path, 'r+b') as f:
+        f.seek(at, os.SEEK_SET if at >= 0 else os.SEEK_END)
+        f.write(data)
+
+
+@pytest.mark.parametrize('at, data, error', [
+    (0, b'NOTAPACK', 'not a corpus pack'),
+    (-8, b'PDFBPAC?', 'damaged trailer'),
+    (-16, struct.pack('<Q', len(DOCS) + 1), 'damaged trailer'),
+    (-24, struct.pack('<Q', 1), 'damaged trailer'),
+])
+def test_damaged_packs_are_rejected(pack, at, data, error):
+    _damage(pack, at, data)
+    with pytest.raises(ValueError, match=error):
+        packs.PackedCorpus(pack)
+
+
+def test_truncated_pack_is_rejected(pack):
+    os.truncate(pack, os.path.getsize(pack) - 1)
+    with pytest.raises(ValueError, match='damaged trailer'):
+        packs.PackedCorpus(pack)
+    os.truncate(pack, 4)
+    with pytest.raises(ValueError, match='not a corpus pack'):
+        packs.PackedCorpus(pack)
+
+
+def test_damaged_rebuild_keeps_serving_the_old_pack(pack):
+    first = packs.get_corpus()
+    with open(pack + '.new', 'wb') as f:
+        f.write(b'PDFBPACK' + b'\0' * 40)
+    os.replace(pack + '.new', pack)
+    assert packs.get_corpus() is first
+
+
+def test_rebuild_swaps_the_inode_and_reloads(pack):
+    first = packs.get_corpus()
+    old_view = first.document(1)
+    old_inode = os.stat(pack).st_ino
+    assert packs.get_corpus() is first
+
+    packs.write_corpus(pack, [b'%PDF-1.4 rebuilt\n%%EOF\n'])
+    assert os.stat(pack).st_ino != old_inode
+    assert not [name for name in os.listdir(os.path.dirname(pack)) if name.endswith('.tmp')]
+    second = packs.get_corpus()
+    assert second is not first and len(second) == 1
+    assert second.document(0) == b'%PDF-1.4 rebuilt\n%%EOF\n'
+    assert packs.corpus_stats()['reloads'] == 2
+    # Responses already under way keep reading the replaced file
+    assert old_view == DOCS[1]
+    assert first.open_document(0) is None
+
+
+def test_failed_build_leaves_the_old_pack(pack):
+    def docs():
+        yield b'%PDF-1.4 partial'
+        raise RuntimeError("render failed")
+    before = os.stat(pack).st_ino
+    with pytest.raises(RuntimeError):
+        packs.write_corpus(pack, docs())
+    assert os.stat(pack).st_ino == before
+    assert os.listdir(os.path.dirname(pack)) == ['corpus.pack']
+
+
+def test_corpus_file_reads_one_document(pack):
+    corpus = packs.PackedCorpus(pack)
+    f = corpus.open_document(1)
+    try:
+        assert f.fileno() >= 0 and f.readable()
+        assert os.lseek(f.fileno(), 0, os.SEEK_CUR) == corpus.span(1)[0]
+        assert b''.join(iter(lambda: f.read(5), b'')) == DOCS[1]
+        assert f.read(5) == b''
+    finally:
+        f.close()
+    with pytest.raises(OSError):
+        os.fstat(f.fd)
+
+
+def test_download_hands_the_file_wrapper_a_descriptor(pack, client, auth):
+    wrapped = []
+
+    def file_wrapper(f, block_size):
+        wrapped.append((f, block_size))
+        return FileWrapper(f, block_size)
+    resp = client.post('/api/download', json={}, headers=auth,
+                       environ_overrides={'wsgi.file_wrapper': file_wrapper})
+    assert resp.status_code == 200
+    assert resp.data in DOCS and resp.content_length == len(resp.data)
+    (f, block_size), = wrapped
+    assert isinstance(f, packs._CorpusFile) and block_size == 256 * 1024
+    resp.close()
+    assert f.closed
+    assert packs.corpus_stats() == {"served": 1, "sendfile": 1, "reloads": 1,
+                                        "documents": len(DOCS), "bytes": os.path.getsize(pack)}
+
+
+def test_download_without_file_wrapper_writes_the_mapping(pack, client, auth):
+    resp = client.post('/api/download', json={}, headers=auth)
+    assert resp.status_code == 200
+    assert resp.data in DOCS and resp.content_length == len(resp.data)
+    stats = packs.corpus_stats()
+    assert stats['served'] == 1 and stats['sendfile'] == 0
+    # Seeded and non-default requests are built, not read from the pack
+    assert client.post('/api/download', json={'seed': 's'}, headers=auth).data not in DOCS
+    assert client.post('/api/download', json={'pages': 1}, headers=auth).data not in DOCS
+
+
+@pytest.mark.parametrize('server, body_type', [('gunicorn/22.0', memoryview), ('Werkzeug/3.1', bytes)])
+def test_body_is_a_view_of_the_mapping(app_index, pack, server, body_type):
+    corpus = packs.get_corpus()
+    with app_index.app.test_request_context(environ_overrides={'SERVER_SOFTWARE': server}):
+        resp = app_index.corpus_response(corpus, 'x.pdf')
+    doc, = resp.response
+    assert type(doc) is body_type and doc in DOCS
+    assert resp.content_length == len(doc)
+
+
+def test_download_from_corpus_asgi(pack, asgi_client, auth):
+    resp = asgi_client.post('/api/download', json={}, headers=auth)
+    assert resp.status_code == 200
+    assert resp.content in DOCS
+    assert int(resp.headers['content-length']) == len(resp.content)
@@ -0,0 +1,73 @@
+import io
+import re
+from collections import OrderedDict
+
+import pytest
+
+pypdf = pytest.importorskip('pypdf')
+
+from pdfbirch import fragments, layout, render  # noqa: E402
+
+LINES = 3  # few enough that every requested page fits on one PDF page
+NOISE = re.compile(r'[A-Za-z0-9]{15}')
+
+
+@pytest.fixture
+def library(monkeypatch):
+    """A fresh fragment library of 4 pages per key"""
+    monkeypatch.setattr(fragments, 'PDF_FRAGMENTS', 4)
+    monkeypatch.setattr(fragments, '_fragment_libraries', OrderedDict())
+    monkeypatch.setattr(fragments, '_fragment_bytes', 0)
+    monkeypatch.setattr(fragments, '_fragment_stats', {"reused": 0, "fresh": 0, "evictions": 0})
+
+
+def _page_texts(doc):
+    reader = pypdf.PdfReader(io.BytesIO(doc), strict=True)
+    return [page.extract_text() for page in reader.pages]
+
+
+def _check_page(text):
+    """A page of LINES sentences of WORDS, each followed by a noise line"""
+    lines = text.split('\n')
+    noise = [i for i, line in enumerate(lines) if NOISE.fullmatch(line)]
+    assert len(noise) == LINES and noise[-1] == len(lines) - 1
+    prose = ' '.join(line for line in lines if not NOISE.fullmatch(line))
+    assert prose.count('.') == LINES
+    assert set(prose.replace('.', '').lower().split()) <= {w.lower() for w in layout.WORDS}
+
+
+@pytest.mark.parametrize('xref_stream', [True, False])
+@pytest.mark.parametrize('level', [0, 6])
+def test_composed_documents_parse_strictly(library, monkeypatch, xref_stream, level):
+    monkeypatch.setattr(layout, 'PDF_XREF_STREAM', xref_stream)
+    seen = set()
+    for _ in range(6):
+        progress = []
+        doc = render.render_pdf(pages=5, lines=LINES, fonts=('Courier', 'Times'), compress=level)
+        assert (b'/Type /XRef' in doc) == xref_stream
+        texts = _page_texts(doc)
+        assert len(texts) == 5
+        for text in texts:
+            _check_page(text)
+        seen.update(texts)
+        list(fragments.compose_pdf(5, LINES, ('Courier', 'Times'), None, level, progress.append))
+        assert progress == [1, 2, 3, 4, 5]
+    stats = fragments.fragment_stats()
+    assert stats['reused'] > 0 and stats['libraries'] == 1 and stats['fragments'] == 4
+    # Every page shown was laid out once and then reused, never made up
+    assert len(seen) <= stats['fresh']
+
+
+def test_composed_documents_stop_at_target_bytes(library):
+    full = render.render_pdf(pages=40, lines=LINES, compress=6)
+    doc = render.render_pdf(pages=40, lines=LINES, target_bytes=len(full) // 4, compress=6)
+    texts = _page_texts(doc)
+    assert 0 < len(texts) < 40
+    assert len(doc) >= len(full) // 4
+
+
+def test_seeded_and_ttf_documents_are_never_composed(library, monkeypatch):
+    monkeypatch.setattr(fragments, 'compose_pdf', lambda *a, **k: pytest.fail("composed"))
+    render.render_pdf(pages=2, lines=LINES, seed='s')
+    for family in layout.TTF_FAMILIES:
+        render.render_pdf(pages=2, lines=LINES, fonts=(family,))
@@ -0,0 +1,68 @@
+import time
+
+import pytest
+
+from pdfbirch import jobs
+
+
+def _job(job_id, now, ttl=60):
+    return {'id': job_id, 'owner': 'a@example.com', 'status': 'queued', 'name': 'x.pdf', 'pages_done': 0,
+            'pages_total': 1, 'bytes_done': 0, 'target_bytes': None, 'error': None,
+            'created_at': now, 'expires_at': now + ttl}
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def store(request, tmp_path):
+    if request.param == 'sqlite':
+        return jobs.SqliteJobStore(str(tmp_path / 'jobs.sqlite3'))
+    return jobs.MemoryJobStore()
+
+
+def test_finished_results_are_capped_oldest_first(store, monkeypatch):
+    monkeypatch.setattr(jobs, 'JOB_MAX_RESULT_BYTES', 5000)
+    now = time.time()
+    for i in range(4):
+        store.create(_job(f'j{i}', now, ttl=60 + i))
+        store.finish(f'j{i}', b'x' * 2000, bytes_done=2000, expires_at=now + 60 + i)
+    assert [store.get(f'j{i}') is None for i in range(4)] == [True, True, False, False]
+    assert store.result('j3') == b'x' * 2000
+    assert store.get('j3')['status'] == 'done'
+
+
+def test_purge_frees_expired_results(store):
+    now = time.time()
+    store.create(_job('old', now, ttl=1))
+    store.finish('old', b'x' * 100, expires_at=now + 1)
+    store.create(_job('new', now, ttl=60))
+    store.purge(now + 2)
+    assert store.get('old') is None and store.result('old') is None
+    assert store.get('new') is not None
+    if hasattr(store, 'result_bytes'):
+        assert store.result_bytes == 0
+
+
+def test_get_job_purges_expired_jobs(monkeypatch):
+    store = jobs.MemoryJobStore()
+    monkeypatch.setattr(jobs, '_job_store', store)
+    now = time.time()
+    store.create(_job('gone', now, ttl=-1))
+    store.finish('gone', b'x' * 100, expires_at=now - 1)
+    assert jobs.get_job('gone', 'a@example.com') is None
+    assert store.results == {} and store.result_bytes == 0
+
+
+def test_burst_of_large_jobs_stays_under_cap(client, auth, monkeypatch):
+    store = jobs.MemoryJobStore()
+    monkeypatch.setattr(jobs, '_job_store', store)
+    monkeypatch.setattr(jobs, 'JOB_MAX_RESULT_BYTES', 3 * 200_000)
+    ids = []
+    for _ in range(6):
+        r = client.post('/api/jobs', json={'target_bytes': 200_000}, headers=auth)
+        assert r.status_code == 202
+        ids.append(r.get_json()['id'])
+    deadline = time.time() + 60
+    while jobs.jobs_pending() and time.time() < deadline:
+        time.sleep(0.05)
+    assert store.result_bytes <= jobs.JOB_MAX_RESULT_BYTES
+    assert client.get(f'/api/jobs/{ids[-1]}/result', headers=auth).status_code == 200
+    assert client.get(f'/api/jobs/{ids[0]}', headers=auth).status_code == 404
@@ -0,0 +1,70 @@
+import os
+import signal
+import time
+
+import pytest
+
+from pdfbirch import procpool
+from pdfbirch.layout import DEFAULT_DOC_SPEC
+from pdfbirch.render import render_document
+
+
+@pytest.fixture
+def workers(monkeypatch):
+    monkeypatch.setattr(procpool, 'PDF_WORKERS', 1)
+    monkeypatch.setattr(procpool, 'PDF_WORKER_MAX_TASKS', 0)
+    monkeypatch.setattr(procpool, '_process_pool', None)
+    yield procpool
+    if procpool._process_pool is not None:
+        procpool._process_pool.shutdown(cancel_futures=True)
+        procpool._process_pool = None
+
+
+def test_killed_worker_is_replaced(workers):
+    seeded = render_document('pool')
+    assert workers.build_pdf_bytes('pool') == seeded
+    broken = workers._process_pool
+    for pid in list(broken._processes):
+        os.kill(pid, signal.SIGKILL)
+    # Let the executor notice before the next submit, as it would in a server
+    deadline = time.time() + 10
+    while not broken._broken and time.time() < deadline:
+        time.sleep(0.05)
+    assert workers.build_pdf_bytes('pool') == seeded
+    assert workers._process_pool is not broken
+    assert workers.build_pdf_bytes('pool') == seeded
+
+
+def test_worker_killed_mid_render_is_retried(workers, monkeypatch):
+    pool = workers.get_process_pool()
+    pid = next(iter(pool._processes))
+    original_submit = pool.submit
+
+    def submit_then_kill(*args):
+        future = original_submit(*args)
+        os.kill(pid, signal.SIGKILL)
+        return future
+    monkeypatch.setattr(pool, 'submit', submit_then_kill)
+    # Long enough that the worker is still busy when it is killed
+    spec = DEFAULT_DOC_SPEC._replace(pages=1000)
+    assert workers.render_in_process_pool('mid', spec) == render_document('mid', spec)
+    assert workers._process_pool is not pool
+
+
+def _segments():
+    return {name for name in os.listdir('/dev/shm') if name.startswith('psm_')}
+
+
+def test_shared_memory_is_unlinked_after_many_documents(workers, monkeypatch):
+    if not os.path.isdir('/dev/shm'):
+        pytest.skip("no /dev/shm")
+    # Spawned workers read the threshold at import: every document goes through shared memory,
+    # and workers are recycled along the way
+    monkeypatch.setenv('PDF_SHM_THRESHOLD', '0')
+    monkeypatch.setattr(workers, 'PDF_WORKER_MAX_TASKS', 4)
+    before = _segments()
+    spec = DEFAULT_DOC_SPEC._replace(pages=1)
+    for i in range(40):
+        assert workers.build_pdf_bytes(f'shm/{i}', spec) == render_document(f'shm/{i}', spec)
+    workers._process_pool.shutdown()
+    assert _segments() == before
@@ -0,0 +1,131 @@
+import sqlite3
+
+import pytest
+
+from conftest import TEST_EMAIL
+from pdfbirch import ratelimit
+
+
+@pytest.fixture
+def limiter(monkeypatch, tmp_path):
+    """Rate limiting on with a fresh memory backend: burst 5, one token every 1000 s, leases of 3"""
+    monkeypatch.setattr(ratelimit, 'RATE_LIMIT_RATE', 0.001)
+    monkeypatch.setattr(ratelimit, 'RATE_LIMIT_BURST', 5.0)
+    monkeypatch.setattr(ratelimit, 'RATE_LIMIT_LEASE', 3)
+    monkeypatch.setattr(ratelimit, 'RATE_LIMIT_BACKEND', 'memory')
+    monkeypatch.setattr(ratelimit, 'RATE_LIMIT_SQLITE_PATH', str(tmp_path / 'rate.sqlite3'))
+    monkeypatch.setattr(ratelimit, '_rate_backend', None)
+    monkeypatch.setattr(ratelimit, '_rate_backend_retry_at', 0.0)
+    monkeypatch.setattr(ratelimit, '_rate_buckets', {})
+    monkeypatch.setattr(ratelimit, '_rate_leases', {})
+    monkeypatch.setattr(ratelimit, '_rate_stats', dict.fromkeys(ratelimit._rate_stats, 0))
+    return ratelimit
+
+
+@pytest.fixture
+def sqlite_limiter(limiter, monkeypatch):
+    monkeypatch.setattr(limiter, 'RATE_LIMIT_BACKEND', 'sqlite')
+    return limiter
+
+
+def _stored(limiter, email):
+    with sqlite3.connect(limiter.RATE_LIMIT_SQLITE_PATH) as db:
+        return db.execute("SELECT tokens, granted FROM rate_limits WHERE key = ?", (email,)).fetchone()
+
+
+def test_off_by_default():
+    assert ratelimit.RATE_LIMIT_RATE == 0
+    assert all(ratelimit.rate_limit('a@example.com', 1000) is None for _ in range(50))
+
+
+def test_memory_bucket_and_retry_after(limiter):
+    assert [limiter.rate_limit('a@example.com') for _ in range(5)] == [None] * 5
+    # Empty bucket, one token every 1000 s
+    assert limiter.rate_limit('a@example.com') == 1000
+    assert limiter.rate_limit('a@example.com', 3) == 3000
+    assert limiter.rate_limit('b@example.com', 5) is None
+    assert limiter.rate_limit_stats()['limited'] == 2
+
+
+def test_cost_above_burst_is_refused_without_draining(limiter):
+    assert limiter.rate_limit('a@example.com', 6) == 5000
+    assert limiter.rate_limit('a@example.com', 5) is None
+
+
+def test_batch_larger_than_burst_is_a_400(app_index, limiter, client, auth, monkeypatch):
+    monkeypatch.setattr(app_index, 'BATCH_MAX_FILES', 20)
+    assert app_index.batch_max_files() == 5
+    resp = client.post('/api/download_batch', json={'count': 6}, headers=auth)
+    assert resp.status_code == 400
+    assert b'between 1 and 5' in resp.data
+
+
+def test_route_answers_429_with_retry_after(limiter, client, auth, monkeypatch):
+    monkeypatch.setattr(limiter, 'RATE_LIMIT_BURST', 1.0)
+    monkeypatch.setattr(limiter, 'RATE_LIMIT_RATE', 0.5)
+    assert client.post('/api/download', json={'pages': 1}, headers=auth).status_code == 200
+    resp = client.post('/api/download', json={'pages': 1}, headers=auth)
+    assert resp.status_code == 429
+    assert resp.headers['Retry-After'] == '2'
+
+
+def test_sqlite_upsert_grants_a_lease(sqlite_limiter):
+    email = TEST_EMAIL
+    assert sqlite_limiter.rate_limit(email) is None
+    # The first call inserts the row, taking a lease of 3 from the burst of 5
+    tokens, granted = _stored(sqlite_limiter, email)
+    assert granted == 3 and tokens == pytest.approx(2)
+    assert sqlite_limiter._rate_leases == {email: 2}
+    # The next two are spent from the lease without a round trip
+    assert sqlite_limiter.rate_limit(email) is None
+    assert sqlite_limiter.rate_limit(email) is None
+    assert sqlite_limiter.rate_limit_stats()['backend_calls'] == 1
+    # Then the update path refills (hardly at all) and grants the 2 that are left
+    assert sqlite_limiter.rate_limit(email) is None
+    tokens, granted = _stored(sqlite_limiter, email)
+    assert granted == 2 and tokens == pytest.approx(0, abs=0.01)
+    assert sqlite_limiter.rate_limit(email) is None
+    assert sqlite_limiter.rate_limit(email) == 1000
+    assert _stored(sqlite_limiter, email)[1] == 0
+
+
+def test_sqlite_bucket_is_shared_between_instances(sqlite_limiter):
+    email = TEST_EMAIL
+    assert sqlite_limiter.rate_limit(email, 2) is None
+    # Another instance has no lease of its own and must go to the shared row
+    sqlite_limiter._rate_leases.clear()
+    assert sqlite_limiter.rate_limit(email, 2) is None
+    sqlite_limiter._rate_leases.clear()
+    assert sqlite_limiter.rate_limit(email, 2) == 2000
+    assert sqlite_limiter.rate_limit_stats()['backend_calls'] == 3
+
+
+def test_sqlite_refused_cost_takes_nothing(sqlite_limiter):
+    email = TEST_EMAIL
+    assert sqlite_limiter.rate_limit(email, 5) is None
+    assert sqlite_limiter.rate_limit(email, 2) == 2000
+    assert _stored(sqlite_limiter, email)[1] == 0
+    assert sqlite_limiter._rate_leases == {}
+
+
+class FailingBackend:
+    def __init__(self):
+        self.calls = 0
+
+    def take(self, params):
+        self.calls += 1
+        raise ConnectionError("database is down")
+
+
+def test_local_buckets_decide_while_the_backend_is_down(limiter, monkeypatch):
+    backend = FailingBackend()
+    monkeypatch.setattr(limiter, 'RATE_LIMIT_BACKEND', 'postgres')
+    monkeypatch.setattr(limiter, '_rate_backend', backend)
+    assert [limiter.rate_limit('a@example.com') for _ in range(5)] == [None] * 5
+    assert limiter.rate_limit('a@example.com') == 1000
+    # One failed round trip, then the backend is left alone until the retry time
+    assert backend.calls == 1
+    assert limiter.rate_limit_stats()['backend_errors'] == 1
+    monkeypatch.setattr(limiter, '_rate_backend_retry_at', 0.0)
+    assert limiter.rate_limit('b@example.com') is None
+    assert backend.calls == 2
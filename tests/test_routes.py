@@ -0,0 +1,113 @@
+import pytest
+
+from pdfbirch import render, spec
+from pdfbirch.layout import DocSpec
+
+JSON_ROUTES = ['/api/download', '/api/download_batch', '/api/jobs']
+
+
+@pytest.mark.parametrize('path', JSON_ROUTES)
+@pytest.mark.parametrize('body', [[1], 'pages', 7, []])
+def test_non_object_json_body_is_a_400(client, auth, path, body):
+    resp = client.post(path, json=body, headers=auth)
+    assert resp.status_code == 400
+    assert b'JSON object' in resp.data
+
+
+@pytest.mark.parametrize('path', JSON_ROUTES)
+@pytest.mark.parametrize('body', [[1], 'pages', 7, []])
+def test_non_object_json_body_is_a_400_asgi(asgi_client, auth, path, body):
+    resp = asgi_client.post(path, json=body, headers=auth)
+    assert resp.status_code == 400
+    assert 'JSON object' in resp.text
+
+
+def test_missing_or_malformed_body_still_uses_defaults(client, auth):
+    resp = client.post('/api/download', data='{not json', content_type='application/json', headers=auth)
+    assert resp.status_code == 200
+    assert resp.data.startswith(b'%PDF')
+    resp = client.post('/api/download', headers=auth)
+    assert resp.status_code == 200
+
+
+@pytest.mark.parametrize('fonts', [123, {'Courier': 1}, ['Courier', 5], [None], True])
+def test_malformed_fonts_is_a_400(client, auth, fonts):
+    resp = client.post('/api/download', json={'fonts': fonts}, headers=auth)
+    assert resp.status_code == 400
+    assert b'fonts must be' in resp.data
+
+
+@pytest.mark.parametrize('fonts', ['Courier', ['Courier', 'Times'], ('Courier',), 'Courier, Times,'])
+def test_fonts_as_string_or_list(fonts):
+    assert 'Courier' in spec.request_doc_spec({'fonts': fonts}, 1, {}).fonts
+
+
+@pytest.mark.parametrize('fonts, names', [
+    ('Courier,Unknown', ['Unknown']),
+    (['Unknown', 'Comic Sans'], ['Unknown', 'Comic Sans']),
+    ('courier', ['courier']),
+])
+def test_unknown_fonts_are_a_400_naming_them(client, asgi_client, auth, fonts, names):
+    resp = client.post('/api/download', json={'fonts': fonts}, headers=auth)
+    assert resp.status_code == 400
+    text = resp.get_data(as_text=True)
+    assert text.startswith('Unknown fonts: ' + ', '.join(names) + ';')
+    resp = asgi_client.post('/api/download', json={'fonts': fonts}, headers=auth)
+    assert resp.status_code == 400 and resp.text == text
+
+
+@pytest.mark.parametrize('body', [{'pages': True}, {'lines': False}, {'target_bytes': True}, {'pages': 2.5},
+                                  {'pages': '2.5'}, {'pages': [2]}])
+def test_non_integer_params_are_a_400(client, auth, body):
+    resp = client.post('/api/download', json=body, headers=auth)
+    assert resp.status_code == 400
+    assert resp.data == f"{next(iter(body))} must be an integer".encode()
+
+
+def test_integral_floats_and_strings_are_accepted():
+    assert spec.request_doc_spec({'pages': 2.0, 'lines': '3'}, 1, {})[:2] == (2, 3)
+
+
+def test_target_bytes_is_bounded_by_pdf_max_bytes(client, auth):
+    resp = client.post('/api/download', json={'target_bytes': spec.PDF_MAX_BYTES + 1}, headers=auth)
+    assert resp.status_code == 400
+    assert resp.data == f"target_bytes must be between 1 and {spec.PDF_MAX_BYTES}".encode()
+    # Within the bound, a batch still answers to the overall byte budget
+    resp = client.post('/api/download_batch', json={'count': 2, 'target_bytes': spec.PDF_MAX_BYTES},
+                       headers=auth)
+    assert resp.status_code == 413
+
+
+def test_seeded_fpdf_documents_are_reproducible(monkeypatch):
+    pytest.importorskip('fpdf')
+    monkeypatch.setattr(render, 'PDF_ENGINE', 'fpdf')
+    doc_spec = DocSpec(2, 5, ('Arial', 'Courier'), None)
+    first = render.render_document('fpdf-seed', doc_spec)
+    assert b'/CreationDate' not in first and b'/Producer' in first
+    assert render.render_document('fpdf-seed', doc_spec) == first
+    assert b'/CreationDate (D:' in render.render_document(None, doc_spec)
+
+
+STATS_ROUTES = ['/metrics', '/api/token_cache_stats', '/api/pool_stats', '/api/cache_stats']
+
+
+@pytest.mark.parametrize('path', STATS_ROUTES)
+def test_stats_routes_are_off_without_metrics_token(app_index, monkeypatch, client, path):
+    monkeypatch.setattr(app_index, 'METRICS_TOKEN', '')
+    assert client.get(path).status_code == 404
+    assert client.get(path, headers={'Authorization': 'Bearer '}).status_code == 404
+
+
+@pytest.mark.parametrize('path', STATS_ROUTES)
+def test_stats_routes_need_the_metrics_token(app_index, monkeypatch, client, asgi_client, path):
+    monkeypatch.setattr(app_index, 'METRICS_TOKEN', 's3cret')
+    for http in (client, asgi_client):
+        assert http.get(path).status_code == 401
+        assert http.get(path, headers={'Authorization': 'Bearer wrong'}).status_code == 401
+        assert http.get(path, headers={'Authorization': 'Bearer s3cret'}).status_code == 200
+
+
+def test_stats_routes_are_off_by_default_asgi(app_index, monkeypatch, asgi_client):
+    monkeypatch.setattr(app_index, 'METRICS_TOKEN', '')
+    for path in STATS_ROUTES:
+        assert asgi_client.get(path).status_code == 404
@@ -0,0 +1,43 @@
+import gzip
+
+import pytest
+
+
+@pytest.fixture
+def fresh_home(app_index, monkeypatch):
+    """A never-served copy of the home page asset"""
+    asset = app_index._static_asset(app_index.HTML_PAGE, 'text/html; charset=utf-8')
+    monkeypatch.setattr(app_index, '_STATIC_HOME', asset)
+    return asset
+
+
+def test_assets_are_not_compressed_at_import(app_index, fresh_home):
+    assert set(fresh_home['bodies']) == {'identity'}
+    assert set(fresh_home['etags']) >= {'identity', 'gzip'}
+
+
+def test_gzip_is_built_on_first_request_and_reused(client, fresh_home):
+    resp = client.get('/', headers={'Accept-Encoding': 'gzip'})
+    assert resp.status_code == 200
+    assert resp.headers['Content-Encoding'] == 'gzip'
+    assert resp.headers['ETag'] == f'"{fresh_home["etags"]["gzip"]}"'
+    assert gzip.decompress(resp.data) == fresh_home['bodies']['identity']
+    cached = fresh_home['bodies']['gzip']
+    assert client.get('/', headers={'Accept-Encoding': 'gzip'}).data == cached
+    assert fresh_home['bodies']['gzip'] is cached
+
+
+def test_brotli_is_built_on_first_request(app_index, client, fresh_home):
+    brotli = pytest.importorskip('brotli')
+    resp = client.get('/', headers={'Accept-Encoding': 'gzip;q=0.5, br'})
+    assert resp.headers['Content-Encoding'] == 'br'
+    assert brotli.decompress(resp.data) == fresh_home['bodies']['identity']
+    assert 'gzip' not in fresh_home['bodies']
+
+
+def test_revalidation_does_not_compress(client, fresh_home):
+    tag = fresh_home['etags']['identity']
+    resp = client.get('/', headers={'Accept-Encoding': 'gzip', 'If-None-Match': f'"{tag}"'})
+    assert resp.status_code == 304
+    assert resp.headers['ETag'] == f'"{fresh_home["etags"]["gzip"]}"'
+    assert set(fresh_home['bodies']) == {'identity'}
@@ -0,0 +1,72 @@
+import hashlib
+import io
+import os
+import subprocess
+import sys
+
+import pytest
+
+pypdf = pytest.importorskip('pypdf')
+
+from conftest import ROOT  # noqa: E402
+from pdfbirch import layout, render  # noqa: E402
+
+FONTS = ('Arial', 'Times', 'Courier')
+
+
+def _parse(doc):
+    reader = pypdf.PdfReader(io.BytesIO(doc), strict=True)
+    # Every cross-reference entry must point at the start of its object
+    offsets = reader.xref[0]
+    assert offsets
+    for num, offset in offsets.items():
+        assert doc[offset:].startswith(b"%d 0 obj" % num), num
+    return reader
+
+
+@pytest.mark.parametrize('xref_stream', [True, False], ids=['xref-stream', 'xref-table'])
+@pytest.mark.parametrize('level', [0, 6])
+def test_template_documents_parse_strictly(monkeypatch, level, xref_stream):
+    monkeypatch.setattr(layout, 'PDF_XREF_STREAM', xref_stream)
+    doc = render.render_pdf(pages=3, lines=25, fonts=FONTS, seed='template', compress=level)
+    reader = _parse(doc)
+    assert len(reader.pages) >= 3
+    assert all(page.extract_text().strip() for page in reader.pages)
+    assert (b"/FlateDecode" in doc) == (level > 0)
+    startxref = int(doc[doc.rindex(b"startxref") + 9:].split()[0])
+    if xref_stream:
+        assert b"\nxref\n" not in doc
+        assert doc[startxref:].split(b"\n", 1)[1].startswith(b"<< /Type /XRef")
+    else:
+        assert b"/Type /XRef" not in doc
+        assert doc[startxref:].startswith(b"xref\n0 %d\n" % (len(reader.xref[0]) + 1))
+    assert doc.endswith(b"%%EOF\n")
+
+
+@pytest.mark.parametrize('level', [0, 6])
+def test_same_layout_at_every_level(level):
+    plain = _parse(render.render_pdf(pages=2, seed='levels', compress=0))
+    reader = _parse(render.render_pdf(pages=2, seed='levels', compress=level))
+    assert [p.extract_text() for p in reader.pages] == [p.extract_text() for p in plain.pages]
+
+
+def test_compression_shrinks_the_document():
+    plain = render.render_pdf(pages=5, seed='size', compress=0)
+    assert len(render.render_pdf(pages=5, seed='size', compress=6)) < len(plain) // 2
+
+
+def _digests():
+    return [hashlib.sha256(render.render_pdf(pages=4, fonts=FONTS, seed=seed, compress=level)).hexdigest()
+            for seed in ('stable-a', 'stable-b') for level in (0, 6)]
+
+
+def test_seeded_output_is_byte_stable():
+    digests = _digests()
+    assert _digests() == digests
+    assert len(set(digests)) == 4
+    # A fresh interpreter with another hash seed must produce the same bytes
+    script = "import test_template; print(' '.join(test_template._digests()))"
+    env = dict(os.environ, PYTHONHASHSEED='12345',
+               PYTHONPATH=os.pathsep.join([ROOT, os.path.dirname(os.path.abspath(__file__))]))
+    out = subprocess.run([sys.executable, '-c', script], env=env, check=True, capture_output=True, text=True)
+    assert out.stdout.split() == digests
@@ -0,0 +1,135 @@
+import io
+import re
+import struct
+import zlib
+
+import pytest
+
+pypdf = pytest.importorskip('pypdf')
+
+from pdfbirch import layout, render, ttf  # noqa: E402
+
+
+@pytest.fixture(scope='module')
+def family():
+    family = next(iter(layout.TTF_FAMILIES), None)
+    if family is None:
+        pytest.skip("no PDF_TTF_FONTS family installed")
+    return family
+
+
+def _font_program(doc, name='/T1'):
+    """The embedded FontFile2 stream object and its decoded program"""
+    reader = pypdf.PdfReader(io.BytesIO(doc), strict=True)
+    font = reader.trailer['/Root']['/Pages']['/Resources']['/Font'][name].get_object()
+    descriptor = font['/DescendantFonts'][0].get_object()['/FontDescriptor']
+    stream = descriptor['/FontFile2'].get_object()
+    return reader, stream, stream.get_data()
+
+
+def _tables(program):
+    tables = {}
+    for i in range(struct.unpack_from('>H', program, 4)[0]):
+        tag, checksum, offset, length = struct.unpack_from('>4sIII', program, 12 + 16 * i)
+        assert offset % 4 == 0
+        tables[tag.decode('latin-1')] = (checksum, program[offset:offset + length])
+    return tables
+
+
+@pytest.mark.parametrize('level', [6, 0, 1])
+def test_subset_program_is_a_valid_truetype_file(family, level):
+    doc = render.render_pdf(pages=3, fonts=(family, 'Courier'), seed='ttf', compress=level)
+    reader, stream, program = _font_program(doc)
+    assert reader.pages[0].extract_text().strip()
+    if level:
+        # The spliced chunks must form one valid zlib stream, adler32 included
+        assert zlib.decompress(stream._data) == program
+    else:
+        assert stream._data == program
+    assert stream['/Length1'] == len(program)
+    tables = _tables(program)
+    for tag, (checksum, data) in tables.items():
+        if tag == 'head':
+            data = data[:8] + b"\0\0\0\0" + data[12:]
+        assert ttf.checksum(data) == checksum, tag
+    assert ttf.checksum(program) == 0xB1B0AFBA
+
+    count = struct.unpack_from('>H', tables['maxp'][1], 4)[0]
+    metrics = struct.unpack_from('>H', tables['hhea'][1], 34)[0]
+    assert len(tables['hmtx'][1]) == 4 * metrics + 2 * (count - metrics)
+    glyf = tables['glyf'][1]
+    loca = struct.unpack('>%dI' % (count + 1), tables['loca'][1])
+    assert loca[-1] == len(glyf)
+    assert all(a <= b for a, b in zip(loca, loca[1:]))
+
+    font = layout.get_ttf_font(family)
+    kept = [g for g in range(count) if loca[g + 1] > loca[g]]
+    assert kept
+    for glyph in kept:
+        outline = font.glyph_data(glyph)
+        assert glyf[loca[glyph]:loca[glyph + 1]] == outline + b"\0" * (-len(outline) % 4)
+
+
+def test_subset_keeps_only_shown_glyphs(family):
+    font = layout.get_ttf_font(family)
+    word = layout.UNICODE_WORDS[0][0]
+    shown = {font.glyphs[ord(c)] for c in word}
+    tag, widths, to_unicode, font_file = font.subset(word, 0)
+    assert len(tag) == 6 and tag.isupper()
+    program = font_file[font_file.index(b"stream\n") + 7:font_file.rindex(b"\nendstream")]
+    tables = _tables(program)
+    count = struct.unpack_from('>H', tables['maxp'][1], 4)[0]
+    loca = struct.unpack('>%dI' % (count + 1), tables['loca'][1])
+    kept = {g for g in range(count) if loca[g + 1] > loca[g]}
+    assert shown <= kept <= shown | {0} | {p for g in shown for p in font.components(g)}
+    assert count == max(shown) + 1
+    listed = {}
+    for start, run in re.findall(rb'(\d+) \[([\d ]+)\]', widths):
+        listed.update((int(start) + i, int(w)) for i, w in enumerate(run.split()))
+    assert listed == {g: font.widths[g] for g in shown}
+    for glyph in shown:
+        assert b"<%04x>" % glyph in to_unicode
+
+
+def test_subsets_are_cached_per_glyph_set_and_level(family):
+    font = layout.get_ttf_font(family)
+    word = layout.UNICODE_WORDS[1][0]
+    before = font.subset_stats()
+    first = font.subset(word, 6)
+    assert font.subset(word[::-1], 6) is first
+    assert font.subset(word, 1) is not first
+    after = font.subset_stats()
+    assert after['cache_hits'] - before['cache_hits'] >= 1
+    assert after['cache_misses'] - before['cache_misses'] <= 2
+
+
+def test_core_font_documents_embed_nothing():
+    doc = render.render_pdf(pages=2, fonts=('Courier',), seed='core', compress=6)
+    assert b"/FontFile2" not in doc
+    pypdf.PdfReader(io.BytesIO(doc), strict=True)
+
+
+def test_checksum_pads_to_four_bytes():
+    assert ttf.checksum(b"") == 0
+    assert ttf.checksum(b"\x00\x00\x00\x01\x01") == 1 + 0x01000000
+    assert ttf.checksum(b"\xff\xff\xff\xff" * 2) == 0xFFFFFFFE
+
+
+def test_documents_share_one_vocabulary_subset(family):
+    docs = [render.render_pdf(pages=2, fonts=(family,), seed=seed, compress=6) for seed in ('a', 'b')]
+    programs = [_font_program(doc)[2] for doc in docs]
+    assert programs[0] == programs[1]
+    font = layout.get_ttf_font(family)
+    before = font.subset_stats()
+    render.render_pdf(pages=2, fonts=(family,), seed='c', compress=6)
+    after = font.subset_stats()
+    assert after['cache_misses'] == before['cache_misses']
+    assert after['cache_hits'] == before['cache_hits'] + 1
+
+
+def test_synthesized_lines_only_show_vocabulary_characters(family):
+    import random
+    keys = [(family, '')]
+    for seed in range(20):
+        _, _, texts, _ = layout.synth_lines(random.Random(seed), 50, keys)
+        assert set(''.join(texts)) <= layout._TTF_CHARS
@@ -0,0 +1,186 @@
+import threading
+import time
+
+import pytest
+
+from conftest import TEST_EMAIL
+from pdfbirch import jobs, ratelimit
+from pdfbirch import usage as usage_module
+
+
+@pytest.fixture
+def usage(monkeypatch, tmp_path):
+    """A fresh USAGE_STORE=sqlite setup with a daily limit of 3 and no background flushes"""
+    monkeypatch.setattr(usage_module, 'USAGE_STORE', 'sqlite')
+    monkeypatch.setattr(usage_module, 'USAGE_SQLITE_PATH', str(tmp_path / 'usage.sqlite3'))
+    monkeypatch.setattr(usage_module, 'USAGE_DAILY_LIMIT', 3)
+    monkeypatch.setattr(usage_module, 'USAGE_FLUSH_INTERVAL', 3600)
+    monkeypatch.setattr(usage_module, '_usage_store', None)
+    monkeypatch.setattr(usage_module, '_usage_store_retry_at', 0.0)
+    for name in ('_usage_pending', '_usage_inflight', '_usage_cache'):
+        monkeypatch.setattr(usage_module, name, type(getattr(usage_module, name))())
+    return usage_module
+
+
+def test_counts_reach_the_store_on_flush(usage):
+    usage.record_usage('a@example.com')
+    usage.record_usage('a@example.com', 2)
+    usage.record_usage('b@example.com')
+    assert usage.get_usage('a@example.com') == 3
+    assert usage.flush_usage() == 2
+    store = usage.get_usage_store()
+    assert store.fetch(*usage._usage_key('a@example.com')) == 3
+    assert store.fetch(*usage._usage_key('b@example.com')) == 1
+    # Cached value plus nothing pending, so no double counting after the flush
+    assert usage.get_usage('a@example.com') == 3
+    usage.record_usage('a@example.com')
+    usage.flush_usage()
+    assert store.fetch(*usage._usage_key('a@example.com')) == 4
+
+
+def _stored(usage, email=TEST_EMAIL):
+    return usage.get_usage_store().fetch(*usage._usage_key(email))
+
+
+def test_admit_reserves_in_the_store_and_refuses_past_the_daily_limit(usage):
+    assert ratelimit.admit('a@example.com', 2) is None
+    # Taken in the store at once, not left for the next flush
+    assert _stored(usage, 'a@example.com') == 2 and usage._usage_pending == {}
+    assert ratelimit.admit('a@example.com', 2)[0] == "Daily download limit reached"
+    assert ratelimit.admit('a@example.com') is None
+    message, retry_after = ratelimit.admit('a@example.com')
+    assert message == "Daily download limit reached"
+    assert 0 < retry_after <= 86400
+    assert _stored(usage, 'a@example.com') == 3
+    assert usage.get_usage('a@example.com') == 3
+    # More than the whole quota never reaches the store
+    assert ratelimit.admit('b@example.com', 4) is not None
+    assert _stored(usage, 'b@example.com') == 0
+
+
+def test_reservations_are_atomic_across_processes(usage):
+    # Two connections to one file stand in for two server processes
+    stores = [usage.SqliteUsageStore(usage.USAGE_SQLITE_PATH) for _ in range(2)]
+    day = usage._usage_key(TEST_EMAIL)[1]
+    taken = []
+    start = threading.Barrier(8)
+
+    def worker(store):
+        start.wait()
+        for _ in range(5):
+            taken.append(store.reserve(TEST_EMAIL, day, 1, 10))
+    threads = [threading.Thread(target=worker, args=(stores[i % 2],)) for i in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    granted = sorted(n for n in taken if n is not None)
+    assert granted == list(range(1, 11))
+    assert _stored(usage) == 10
+
+
+def test_failed_build_hands_the_reservation_back(app_index, usage, client, auth, monkeypatch):
+    def fail(*args, **kwargs):
+        raise RuntimeError("render failed")
+    monkeypatch.setattr(app_index, 'get_seeded_pdf', fail)
+    assert client.post('/api/download', json={'seed': 's'}, headers=auth).status_code == 500
+    assert _stored(usage) == 0
+    assert usage.get_usage(TEST_EMAIL) == 0
+
+
+def test_failed_stream_hands_the_reservation_back(app_index, usage, client, auth, monkeypatch):
+    def broken(*args, **kwargs):
+        yield b"%PDF-1.5\n"
+        raise RuntimeError("layout failed")
+    monkeypatch.setattr(app_index, 'iter_pdf', broken)
+    resp = client.post('/api/download', json={'pages': 1}, headers=auth)
+    assert _stored(usage) == 1
+    with pytest.raises(RuntimeError):
+        resp.get_data()
+    assert _stored(usage) == 0
+
+
+def test_failed_build_hands_the_reservation_back_asgi(app_index, usage, asgi_client, auth, monkeypatch):
+    def fail(*args, **kwargs):
+        raise RuntimeError("render failed")
+    monkeypatch.setattr(app_index, 'get_seeded_pdf', fail)
+    assert asgi_client.post('/api/download', json={'seed': 's'}, headers=auth).status_code == 500
+    assert _stored(usage) == 0
+    assert asgi_client.post('/api/download', json={'seed': 's', 'pages': 1}, headers=auth).status_code == 500
+    assert asgi_client.post('/api/download_batch', json={'count': 3, 'pages': 1}, headers=auth).status_code == 200
+    assert _stored(usage) == 3
+
+
+def _wait_for_job(client, auth, location):
+    for _ in range(200):
+        job = client.get(location, headers=auth).get_json()
+        if job['status'] in ('done', 'failed'):
+            return job
+        time.sleep(0.01)
+    pytest.fail("job did not finish")
+
+
+def test_jobs_are_charged_only_when_they_finish(usage, client, auth, monkeypatch):
+    r = client.post('/api/jobs', json={'pages': 1}, headers=auth)
+    assert _wait_for_job(client, auth, r.headers['Location'])['status'] == 'done'
+    assert _stored(usage) == 1
+    monkeypatch.setattr(jobs, 'get_seeded_pdf', lambda *a: 1 / 0)
+    r = client.post('/api/jobs', json={'seed': 'x'}, headers=auth)
+    assert _wait_for_job(client, auth, r.headers['Location'])['status'] == 'failed'
+    assert _stored(usage) == 1
+    monkeypatch.setattr(jobs, 'JOB_MAX_PENDING', 0)
+    assert client.post('/api/jobs', json={}, headers=auth).status_code == 503
+    assert _stored(usage) == 1
+
+
+def test_without_a_limit_only_delivered_downloads_count(app_index, usage, client, auth, monkeypatch):
+    monkeypatch.setattr(usage, 'USAGE_DAILY_LIMIT', 0)
+    assert client.post('/api/download', json={'seed': 'ok', 'pages': 1}, headers=auth).status_code == 200
+    monkeypatch.setattr(app_index, 'get_seeded_pdf', lambda *a: 1 / 0)
+    assert client.post('/api/download', json={'seed': 'no'}, headers=auth).status_code == 500
+    assert usage._usage_pending == {usage._usage_key(TEST_EMAIL): 1}
+    assert _stored(usage) == 0
+
+
+def test_download_returns_429_with_retry_after(usage, client, auth):
+    for _ in range(3):
+        assert client.post('/api/download', json={'pages': 1}, headers=auth).status_code == 200
+    r = client.post('/api/download', json={'pages': 1}, headers=auth)
+    assert r.status_code == 429
+    assert 0 < int(r.headers['Retry-After']) <= 86400
+
+
+def test_check_limit_reports_used_and_remaining(usage, client, auth):
+    usage.record_usage(TEST_EMAIL, 2)
+    usage.flush_usage()
+    body = client.get('/api/check_limit', headers=auth).get_json()
+    assert body == {"allowed": True, "used": 2, "limit": 3, "remaining": 1}
+    usage.record_usage(TEST_EMAIL)
+    body = client.get('/api/check_limit', headers=auth).get_json()
+    assert body["allowed"] is False and body["remaining"] == 0
+
+
+class FailingStore:
+    def fetch(self, email, day):
+        raise RuntimeError("database down")
+
+    def add(self, rows):
+        raise RuntimeError("database down")
+
+    def reserve(self, email, day, count, limit):
+        raise RuntimeError("database down")
+
+
+def test_failing_store_fails_open(usage, client, auth, monkeypatch):
+    monkeypatch.setattr(usage, '_usage_store', FailingStore())
+    assert client.post('/api/download', json={'pages': 1}, headers=auth).status_code == 200
+    # Admission falls back to counting locally
+    assert ratelimit.admit(TEST_EMAIL) is None
+    assert usage.get_usage(TEST_EMAIL) == 2
+    assert ratelimit.admit(TEST_EMAIL, 2) is not None
+    # The failed write keeps its increments for the next flush
+    assert usage.flush_usage() == 0
+    assert usage._usage_pending == {usage._usage_key(TEST_EMAIL): 2}
+    monkeypatch.setattr(usage, '_usage_store', None)
+    assert usage.flush_usage() == 1
+    assert _stored(usage) == 2
@@ -0,0 +1,55 @@
+import random
+
+import pytest
+
+pytest.importorskip('fpdf')
+
+from pdfbirch import layout, render  # noqa: E402
+
+SEEDS = range(30)
+
+
+@pytest.fixture(scope='module')
+def pdf():
+    pdf = render.buffered_fpdf_class()()
+    pdf.add_page()
+    return pdf
+
+
+def test_width_tables_match_fpdf(pdf):
+    # TrueType families join WORD_WIDTHS once used; FPDF only knows the core fonts
+    for family, style in layout._PDF_FONTS:
+        table = layout.WORD_WIDTHS[(family, style)]
+        pdf.set_font(family, style, 12)
+        for word in list(table):
+            # get_string_width is in user units: font units * size / 1000 / k
+            assert table[word] * pdf.font_size / 1000 == pytest.approx(pdf.get_string_width(word)), word
+        assert table['unlisted'] == layout._string_width('unlisted', table.cw)
+
+
+@pytest.mark.parametrize('seed', SEEDS)
+def test_wrap_words_breaks_like_multi_cell(pdf, seed):
+    rng = random.Random(seed)
+    fonts, sizes, texts, _ = layout.synth_lines(rng, 250)
+    full = pdf.w - pdf.r_margin - pdf.l_margin
+    rows = set()
+    for (family, style), size, text in zip(fonts, sizes, texts):
+        # Narrower cells too, so lines break two and three times
+        w = rng.choice([full, full / 2, full / 3, rng.uniform(60, full)])
+        pdf.set_font(family, style, size)
+        expected = pdf.multi_cell(w, 10, text, align='L', split_only=True)
+        wmax = (w - 2 * pdf.c_margin) * 1000.0 / pdf.font_size
+        assert layout.wrap_words(text.split(' '), layout.WORD_WIDTHS[(family, style)], wmax) == expected
+        rows.add(len(expected))
+    assert {1, 2, 3} <= rows
+
+
+@pytest.mark.parametrize('seed', SEEDS)
+def test_layout_matches_stock_multi_cell(monkeypatch, seed):
+    spec = layout.DocSpec(3, 25, ('Arial', 'Times', 'Courier'), None)
+    fast = render.layout_fpdf(seed, spec)
+    monkeypatch.setattr(render, 'multi_cell_fast',
+                        lambda pdf, w, h, txt, widths: pdf.multi_cell(w, h, txt, align='L'))
+    stock = render.layout_fpdf(seed, spec)
+    assert fast.page == stock.page
+    assert fast.pages == stock.pages
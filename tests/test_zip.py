@@ -0,0 +1,93 @@
+import io
+import struct
+import zipfile
+import zlib
+
+import pytest
+
+from pdfbirch.layout import DocSpec
+
+LOCAL_HEADER = struct.Struct('<4s5H3I2H')
+DESCRIPTOR = struct.Struct('<4sI')
+
+
+@pytest.fixture
+def spec():
+    return DocSpec(1, 5, ('Courier',), None)
+
+
+def _stream(app_index, count, seed, spec):
+    chunks = list(app_index._stream_zip(count, seed, spec))
+    return chunks, b''.join(chunks)
+
+
+def _local_entries(data, zf):
+    """Walk the local headers in file order, checking each data descriptor against the central directory"""
+    entries = []
+    for info in sorted(zf.infolist(), key=lambda i: i.header_offset):
+        (sig, _, flags, method, _, _, crc, csize, size,
+         name_len, extra_len) = LOCAL_HEADER.unpack_from(data, info.header_offset)
+        assert sig == b'PK\x03\x04'
+        # Streamed: sizes and CRC follow the data in a descriptor
+        assert flags & 0x08 and method == zipfile.ZIP_DEFLATED
+        assert crc == 0
+        start = info.header_offset + LOCAL_HEADER.size + name_len + extra_len
+        raw = data[start:start + info.compress_size]
+        sig, crc = DESCRIPTOR.unpack_from(data, start + info.compress_size)
+        assert sig == b'PK\x07\x08' and crc == info.CRC
+        fmt = '<QQ' if extra_len else '<II'
+        assert struct.unpack_from(fmt, data, start + info.compress_size + 8) == (info.compress_size, info.file_size)
+        doc = zlib.decompressobj(-15).decompress(raw)
+        assert zlib.crc32(doc) == info.CRC and len(doc) == info.file_size
+        entries.append((info.filename, doc))
+    return entries
+
+
+def test_streamed_archive_reads_back(app_index, spec):
+    chunks, data = _stream(app_index, 4, 'zip', spec)
+    zf = zipfile.ZipFile(io.BytesIO(data))
+    assert zf.testzip() is None
+    names = zf.namelist()
+    assert len(names) == len(set(names)) == 4 and all(n.endswith('.pdf') for n in names)
+    entries = _local_entries(data, zf)
+    # One chunk per finished document, then the central directory
+    assert len(chunks) == 5
+    assert [c.count(b'PK\x03\x04') for c in chunks[:4]] == [1, 1, 1, 1]
+    assert chunks[4].startswith(b'PK\x01\x02') and b'PK\x05\x06' in chunks[4]
+    assert b'PK\x06\x06' not in data
+    # A seeded batch holds seed/0 .. seed/3, in whatever order they finished
+    expected = {app_index.get_seeded_pdf(f'zip/{i}', spec) for i in range(4)}
+    assert {doc for _, doc in entries} == expected
+    assert {zf.read(name) for name in names} == expected
+
+
+def test_unseeded_archive(app_index, spec):
+    _, data = _stream(app_index, 3, None, spec)
+    zf = zipfile.ZipFile(io.BytesIO(data))
+    assert zf.testzip() is None
+    assert all(zf.read(name).startswith(b'%PDF') for name in zf.namelist())
+
+
+@pytest.mark.parametrize('count, zip64', [(3, False), (4, True)])
+def test_entry_count_zip64_boundary(app_index, spec, monkeypatch, count, zip64):
+    monkeypatch.setattr(zipfile, 'ZIP_FILECOUNT_LIMIT', 3)
+    _, data = _stream(app_index, count, 'count', spec)
+    assert (b'PK\x06\x06' in data) == zip64 and (b'PK\x06\x07' in data) == zip64
+    zf = zipfile.ZipFile(io.BytesIO(data))
+    assert zf.testzip() is None and len(zf.namelist()) == count
+    _local_entries(data, zf)
+
+
+def test_entry_size_zip64_boundary(app_index, spec, monkeypatch):
+    size = len(app_index.get_seeded_pdf('size/0', spec))
+    monkeypatch.setattr(zipfile, 'ZIP64_LIMIT', size - 1)
+    _, data = _stream(app_index, 2, 'size', spec)
+    zf = zipfile.ZipFile(io.BytesIO(data))
+    assert zf.testzip() is None
+    big = [info for info in zf.infolist() if info.file_size > size - 1]
+    assert big
+    for info in big:
+        # Sizes moved into the zip64 extra field of the central directory
+        assert struct.unpack_from('<H', info.extra)[0] == 1
+    entries = dict(_local_entries(data, zf))
+    assert entries[big[0].filename] == zf.read(big[0])